@@ -0,0 +1,274 @@
+"""Benchmark a full tracker run offline against mock PChome/Slack/Telegram.
+
+Builds a synthetic database, then runs the ``StreamingPipeline`` that
+``main.py`` runs and reports the wall time and SQLite commits of each of
+its stages, as measured by ``Metrics``, plus the whole run's peak RSS.
+Pages and prices are fetched and alerts sent on worker threads, so HTTP
+requests are counted per endpoint and listed under the stage that waits
+for them: PChome's under ``fetch`` and the notifiers' under ``deliver``.
+
+Results can be saved as a JSON baseline and later runs checked against it:
+a stage regresses when it makes more requests or commits than the baseline,
+or is slower by more than ``--tolerance``. Timings are only comparable on
+the machine that produced the baseline.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--products 1000] [--history-rows 100000]
+        [--latency-ms 0] [--error-rate 0] [--variant-rate 0] [--write-batch-size 500]
+        [--save-baseline | --check]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from mock_services import (  # noqa: E402
+    BASE_PRICE,
+    SLACK_WEBHOOK_URL,
+    TELEGRAM_API_BASE,
+    MockServices,
+    product_id,
+)
+
+from api import PChomeAPI  # noqa: E402
+from config import Account  # noqa: E402
+from db import PriceDatabase  # noqa: E402
+from dispatcher import NotificationDispatcher  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from pipeline import DEFAULT_WRITE_BATCH_SIZE, StreamingPipeline  # noqa: E402
+from ratelimit import TokenBucket  # noqa: E402
+from slack_notifier import SlackNotifier  # noqa: E402
+from telegram_notifier import TelegramNotifier  # noqa: E402
+from tracker import AccountClient  # noqa: E402
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+
+# Slowdowns shorter than this are treated as noise, in seconds
+MIN_REGRESSION_SECONDS = 0.05
+
+# Hours between consecutive synthetic history rows of a product
+HISTORY_INTERVAL_HOURS = 6
+
+# Stage listing the requests to each mock endpoint
+ENDPOINT_STAGES = {
+    "trace_list": "fetch",
+    "button": "fetch",
+    "slack": "deliver",
+    "telegram": "deliver",
+}
+
+
+def build_synthetic_db(path: Path, products: int, history_rows: int) -> None:
+    """Create a database with ``products`` products and ``history_rows`` prices.
+
+    Rows are spread evenly over the products, one every few hours going back
+    from now, with every price at or above ``BASE_PRICE``.
+    """
+    with PriceDatabase(path) as db:
+        db.conn.executemany(
+            "INSERT INTO products (id, name) VALUES (?, ?)",
+            ((product_id(i), f"測試商品 {i}") for i in range(products)),
+        )
+        samples = -(-history_rows // products)
+        db.conn.execute(
+            """
+            WITH RECURSIVE seq(i) AS (
+                SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i + 1 < ?1
+            )
+            INSERT INTO price_history (product_id, price, recorded_at, last_seen_at)
+            SELECT
+                printf('BENCH%07d', i % ?2),
+                ?3 + (i * 7919) % 97,
+                datetime('now', printf('-%d hours', (?4 - i / ?2) * ?5)),
+                datetime('now', printf('-%d hours', (?4 - i / ?2) * ?5))
+            FROM seq
+            """,
+            (history_rows, products, BASE_PRICE, samples, HISTORY_INTERVAL_HOURS),
+        )
+        db.conn.commit()
+        db.rebuild_product_stats()
+
+
+def _peak_rss_mib() -> float:
+    """Peak resident set size of this process so far, in MiB."""
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def run_pipeline(args: argparse.Namespace) -> dict:
+    """Run the streaming pipeline once and return the measurements per stage."""
+    services = MockServices(
+        args.products,
+        drop_rate=args.drop_rate,
+        latency=args.latency_ms / 1000,
+        error_rate=args.error_rate,
+        variant_rate=args.variant_rate,
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "bench.db"
+        build_synthetic_db(db_path, args.products, args.history_rows)
+
+        slack = SlackNotifier(SLACK_WEBHOOK_URL, transport=services.transport())
+        telegram = TelegramNotifier(
+            "bench-token", "1", api_base=TELEGRAM_API_BASE, transport=services.transport()
+        )
+        if not args.real_rate_limits:
+            slack.rate_limiter = TokenBucket(rate=1e6, capacity=1e6)
+            telegram.rate_limiters = [TokenBucket(rate=1e6, capacity=1e6)]
+
+        metrics = Metrics()
+        with (
+            PChomeAPI("bench", transport=services.transport()) as api,
+            PriceDatabase(db_path) as db,
+            NotificationDispatcher(
+                [slack, telegram], digest_threshold=args.digest_threshold
+            ) as dispatcher,
+        ):
+            metrics.instrument_database(db.conn)
+            account = Account(1, "bench", SLACK_WEBHOOK_URL, "bench-token", "1")
+            pipeline = StreamingPipeline(
+                db,
+                [AccountClient(account, api, dispatcher.channels)],
+                dispatcher,
+                metrics,
+                write_batch_size=args.write_batch_size,
+            )
+            services.reset_counts()
+            start = time.perf_counter()
+            # The pipeline reports progress on stdout
+            with contextlib.redirect_stdout(io.StringIO()):
+                pipeline.run()
+            elapsed = time.perf_counter() - start
+        requests = services.reset_counts()
+
+    stages = {
+        name: {
+            "seconds": round(seconds, 4),
+            "requests": {
+                endpoint: count
+                for endpoint, count in requests.items()
+                if ENDPOINT_STAGES.get(endpoint) == name
+            },
+            "commits": metrics.sqlite_statements.get((name, "COMMIT"), 0),
+        }
+        for name, seconds in metrics.stage_seconds.items()
+    }
+    stages["run"] = {
+        "seconds": round(elapsed, 4),
+        "requests": dict(requests),
+        "commits": sum(
+            count for (_, kind), count in metrics.sqlite_statements.items() if kind == "COMMIT"
+        ),
+        "peak_rss_mib": round(_peak_rss_mib(), 1),
+    }
+    return stages
+
+
+def scenario_key(args: argparse.Namespace) -> str:
+    """Baseline key identifying the benchmark parameters."""
+    key = (
+        f"products={args.products},history_rows={args.history_rows},"
+        f"latency_ms={args.latency_ms},error_rate={args.error_rate},"
+        f"drop_rate={args.drop_rate},digest_threshold={args.digest_threshold}"
+    )
+    # Keys of baselines saved before variants were benchmarked stay valid
+    if args.variant_rate:
+        key += f",variant_rate={args.variant_rate}"
+    if args.write_batch_size != DEFAULT_WRITE_BATCH_SIZE:
+        key += f",write_batch_size={args.write_batch_size}"
+    return key
+
+
+def find_regressions(stages: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Compare a run with its baseline and describe every regression."""
+    regressions: list[str] = []
+    for name, result in stages.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        for endpoint, count in result["requests"].items():
+            if count > expected["requests"].get(endpoint, 0):
+                regressions.append(
+                    f"{name}: {count} {endpoint} requests "
+                    f"(baseline {expected['requests'].get(endpoint, 0)})"
+                )
+        if result["commits"] > expected["commits"]:
+            regressions.append(
+                f"{name}: {result['commits']} commits (baseline {expected['commits']})"
+            )
+        slower = result["seconds"] - expected["seconds"]
+        if slower > MIN_REGRESSION_SECONDS and slower > expected["seconds"] * tolerance:
+            regressions.append(
+                f"{name}: {result['seconds']:.3f}s (baseline {expected['seconds']:.3f}s)"
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--history-rows", type=int, default=100_000)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.05)
+    parser.add_argument("--variant-rate", type=float, default=0.0)
+    parser.add_argument("--digest-threshold", type=int, default=5)
+    parser.add_argument("--write-batch-size", type=int, default=DEFAULT_WRITE_BATCH_SIZE)
+    parser.add_argument(
+        "--real-rate-limits",
+        action="store_true",
+        help="keep the notifiers' Slack/Telegram rate limits instead of lifting them",
+    )
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--save-baseline", action="store_true")
+    group.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    stages = run_pipeline(args)
+
+    print(f"{'stage':>14} {'seconds':>9} {'requests':>9} {'commits':>8} {'peak RSS':>10}")
+    for name, result in stages.items():
+        peak_rss = f"{result['peak_rss_mib']:>7.1f}MiB" if "peak_rss_mib" in result else ""
+        print(
+            f"{name:>14} {result['seconds']:>9.3f} {sum(result['requests'].values()):>9} "
+            f"{result['commits']:>8} {peak_rss:>10}"
+        )
+
+    key = scenario_key(args)
+    baselines = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+
+    if args.save_baseline:
+        baselines[key] = stages
+        args.baseline.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print(f"\nSaved baseline for {key}")
+        return 0
+
+    if args.check:
+        if key not in baselines:
+            print(f"\nNo baseline for {key}; run with --save-baseline first")
+            return 1
+        regressions = find_regressions(stages, baselines[key], args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""Benchmark per-product price recording against the batched write path.
+
+Usage:
+    python benchmarks/bench_record_prices.py [--sizes 1000 10000]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from db import PriceDatabase  # noqa: E402
+
+
+def _seed(db: PriceDatabase, count: int) -> list[tuple[str, int]]:
+    """Create ``count`` products and return one price per product."""
+    product_ids = [f"BENCH-{i:07d}" for i in range(count)]
+    db.conn.executemany(
+        "INSERT INTO products (id, name) VALUES (?, ?)",
+        [(product_id, product_id) for product_id in product_ids],
+    )
+    db.conn.commit()
+    return [(product_id, 1000 + i % 500) for i, product_id in enumerate(product_ids)]
+
+
+def _measure(count: int, write: Callable[[PriceDatabase, list[tuple[str, int]]], None]) -> dict:
+    """Run one write strategy against a fresh on-disk database."""
+    with tempfile.TemporaryDirectory() as tmp, PriceDatabase(Path(tmp) / "bench.db") as db:
+        prices = _seed(db, count)
+
+        commits = 0
+
+        def trace(statement: str) -> None:
+            nonlocal commits
+            if statement.strip().upper() == "COMMIT":
+                commits += 1
+
+        db.conn.set_trace_callback(trace)
+        start = time.perf_counter()
+        write(db, prices)
+        elapsed = time.perf_counter() - start
+        db.conn.set_trace_callback(None)
+
+    return {"commits": commits, "seconds": elapsed}
+
+
+def _per_product(db: PriceDatabase, prices: list[tuple[str, int]]) -> None:
+    for product_id, price in prices:
+        db.record_price(product_id, price)
+
+
+def _batched(db: PriceDatabase, prices: list[tuple[str, int]]) -> None:
+    db.record_prices(prices)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    args = parser.parse_args()
+
+    print(f"{'products':>10} {'strategy':>12} {'commits':>8} {'seconds':>9}")
+    for count in args.sizes:
+        for name, write in (("per-product", _per_product), ("batched", _batched)):
+            result = _measure(count, write)
+            print(f"{count:>10} {name:>12} {result['commits']:>8} {result['seconds']:>9.3f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
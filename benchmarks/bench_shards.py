@@ -0,0 +1,167 @@
+"""Benchmark sharded runs as concurrent processes against mock PChome/Slack/Telegram.
+
+For each shard count, copies ``src/`` to a scratch project with a synthetic
+database, starts one ``main.py`` process per shard with ``SHARD_COUNT`` and
+``SHARD_INDEX`` set, the way an Indexed Job starts its pods, and waits for
+the last one to merge. Every process serves its requests from its own
+``MockServices`` with ``--latency-ms`` per response.
+
+Each shard count runs twice and only the second run is timed: the first
+fills every shard's tracking list cache, as a previous run would in
+production, so the timed run reads the list with one request and spends
+its time on the price requests that sharding splits. Every shard also
+starts an interpreter and parses the whole list, so the speedup stays
+below linear on machines with fewer CPUs than shards.
+
+Reports the wall time and speedup of each shard count, and checks that the
+merged database holds the same products, prices and alerts as the run with
+a single process. Exits non-zero if it does not.
+
+Usage:
+    python benchmarks/bench_shards.py [--products 4000] [--shards 1 2 4]
+        [--latency-ms 200]
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench_pipeline import build_synthetic_db
+from mock_services import SLACK_WEBHOOK_URL, TELEGRAM_API_BASE
+
+BENCH_DIR = Path(__file__).resolve().parent
+SRC_DIR = BENCH_DIR.parent / "src"
+
+# Runs main.py with every httpx client sent to the mock services
+DRIVER = """
+import os, runpy, sys
+
+import httpx
+
+sys.path.insert(0, os.environ["BENCH_DIR"])
+from mock_services import MockServices
+
+services = MockServices(
+    int(os.environ["BENCH_PRODUCTS"]), latency=float(os.environ["BENCH_LATENCY"])
+)
+init = httpx.Client.__init__
+
+def mock_client(self, *args, **kwargs):
+    kwargs["transport"] = services.transport()
+    init(self, *args, **kwargs)
+
+httpx.Client.__init__ = mock_client
+sys.argv = [sys.argv[1]]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+BENCH_ENV = {
+    "PCHOME_ECWEBSESS": "bench",
+    "SLACK_WEBHOOK_URL": SLACK_WEBHOOK_URL,
+    "TELEGRAM_BOT_TOKEN": "bench-token",
+    "TELEGRAM_CHAT_ID": "1",
+    "TELEGRAM_API_BASE": TELEGRAM_API_BASE,
+}
+
+# Rows compared between shard counts, which must match the single-process run
+MERGED_COUNTS = {
+    "products": "SELECT count(*) FROM products WHERE deleted_at IS NULL",
+    "prices": "SELECT count(*) FROM price_history",
+    "alerts": "SELECT count(*) FROM notification_outbox",
+}
+
+
+def _child_env(args: argparse.Namespace, shard_count: int) -> dict[str, str]:
+    env = {
+        name: value
+        for name, value in os.environ.items()
+        if not name.startswith(("PCHOME_", "SLACK_", "TELEGRAM_", "METRICS_", "SHARD_"))
+    }
+    env.update(BENCH_ENV)
+    env.update(
+        BENCH_DIR=str(BENCH_DIR),
+        BENCH_PRODUCTS=str(args.products),
+        BENCH_LATENCY=str(args.latency_ms / 1000),
+        SHARD_COUNT=str(shard_count),
+    )
+    return env
+
+
+def _run_shards(project: Path, env: dict[str, str], shard_count: int, run_id: str) -> float:
+    """Start every shard of one run and return its wall time once all have exited."""
+    start = time.perf_counter()
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-c", DRIVER, str(project / "src" / "main.py")],
+            env={**env, "SHARD_INDEX": str(index), "SHARD_RUN_ID": run_id},
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        for index in range(shard_count)
+    ]
+    for process in processes:
+        _, stderr = process.communicate()
+        if process.returncode:
+            raise RuntimeError(f"Shard exited with {process.returncode}:\n{stderr}")
+    return time.perf_counter() - start
+
+
+def run_sharded(args: argparse.Namespace, shard_count: int) -> tuple[float, dict[str, int]]:
+    """Wall time of a warm run split into ``shard_count`` processes, and the merged counts."""
+    with tempfile.TemporaryDirectory() as tmp:
+        project = Path(tmp)
+        shutil.copytree(SRC_DIR, project / "src")
+        db_path = project / "db" / "prices.db"
+        db_path.parent.mkdir()
+        build_synthetic_db(db_path, args.products, args.history_rows)
+
+        env = _child_env(args, shard_count)
+        _run_shards(project, env, shard_count, "warm-up")
+        elapsed = _run_shards(project, env, shard_count, "timed")
+
+        conn = sqlite3.connect(db_path)
+        try:
+            counts = {name: conn.execute(sql).fetchone()[0] for name, sql in MERGED_COUNTS.items()}
+        finally:
+            conn.close()
+    return elapsed, counts
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=4000)
+    parser.add_argument("--history-rows", type=int, default=40_000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--latency-ms", type=float, default=200)
+    args = parser.parse_args()
+
+    print(
+        f"📦 {args.products} products, {args.history_rows} history rows, "
+        f"{args.latency_ms:.0f}ms per response, {os.cpu_count()} CPUs\n"
+    )
+    baseline_time = baseline_counts = None
+    ok = True
+    for shard_count in args.shards:
+        elapsed, counts = run_sharded(args, shard_count)
+        if baseline_time is None:
+            baseline_time, baseline_counts = elapsed, counts
+        same = counts == baseline_counts
+        ok &= same
+        print(
+            f"   {'✅' if same else '❌'} {shard_count} shard(s): {elapsed:.2f}s, "
+            f"{baseline_time / elapsed:.2f}x, "
+            + ", ".join(f"{count} {name}" for name, count in counts.items())
+        )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
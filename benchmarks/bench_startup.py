@@ -0,0 +1,144 @@
+"""Benchmark the tracker's cold start up to its first PChome request.
+
+Copies ``src/`` to a scratch project so the run gets its own empty
+database and no ``.env``, then starts ``main.py`` in a fresh interpreter
+the way the CronJob does. An audit hook stops the process at its first
+DNS lookup, so the measured time covers interpreter startup, imports,
+configuration, notifier and database setup, but no network.
+
+Each scenario runs ``--runs`` times and reports the median time to first
+request and total import time (from ``-X importtime``): ``source`` starts
+without bytecode caches, ``bytecode`` after ``compileall`` like the Docker
+image. ``--top`` lists the modules with the most self import time.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 10] [--top 15]
+"""
+
+import argparse
+import compileall
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+# Runs main.py and exits as soon as it resolves a host for its first request
+DRIVER = """
+import os, runpy, sys
+
+def stop_at_first_request(event, args):
+    if event == "socket.getaddrinfo":
+        os._exit(0)
+
+sys.addaudithook(stop_at_first_request)
+sys.argv = [sys.argv[1]]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+BENCH_ENV = {
+    "PCHOME_ECWEBSESS": "bench",
+    "SLACK_WEBHOOK_URL": "https://hooks.slack.com/services/BENCH/BENCH/BENCH",
+    "TELEGRAM_BOT_TOKEN": "bench-token",
+    "TELEGRAM_CHAT_ID": "1",
+}
+
+
+def _child_env(bytecode: bool) -> dict[str, str]:
+    env = {
+        name: value
+        for name, value in os.environ.items()
+        if not name.startswith(("PCHOME_", "SLACK_", "TELEGRAM_", "METRICS_", "PYTHON"))
+    }
+    env.update(BENCH_ENV)
+    if not bytecode:
+        env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def parse_importtime(stderr: str) -> tuple[float, dict[str, int]]:
+    """Total import seconds and self microseconds per module of one run."""
+    total_us = 0
+    self_us: dict[str, int] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line.removeprefix("import time:").split("|")
+        self_us[name.strip()] = int(own)
+        # Only top-level imports, whose cumulative time includes their children
+        if not name.startswith("  "):
+            total_us += int(cumulative)
+    return total_us / 1e6, self_us
+
+
+def run_scenario(main_path: Path, bytecode: bool, runs: int) -> tuple[list, list, dict]:
+    """Start the tracker ``runs`` times and collect its timings."""
+    env = _child_env(bytecode)
+    first_request: list[float] = []
+    imports: list[float] = []
+    self_us: dict[str, list[int]] = {}
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", DRIVER, str(main_path)],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=False,
+        )
+        elapsed = time.perf_counter() - start
+        if process.returncode != 0:
+            raise RuntimeError(f"main.py exited with {process.returncode}:\n{process.stderr}")
+        total, modules = parse_importtime(process.stderr)
+        first_request.append(elapsed)
+        imports.append(total)
+        for name, value in modules.items():
+            self_us.setdefault(name, []).append(value)
+        # Every run starts from an empty database like a fresh pod
+        shutil.rmtree(main_path.parent.parent / "db", ignore_errors=True)
+    return first_request, imports, self_us
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = Path(tmp) / "src"
+        shutil.copytree(SRC_DIR, src, ignore=shutil.ignore_patterns("__pycache__"))
+        main_path = src / "main.py"
+
+        results = {"source": run_scenario(main_path, bytecode=False, runs=args.runs)}
+        compileall.compile_dir(src, quiet=1)
+        results["bytecode"] = run_scenario(main_path, bytecode=True, runs=args.runs)
+
+    print(f"{'scenario':>10} {'first request':>14} {'imports':>9}")
+    for name, (first_request, imports, _) in results.items():
+        print(
+            f"{name:>10} {statistics.median(first_request) * 1000:>12.1f}ms "
+            f"{statistics.median(imports) * 1000:>7.1f}ms"
+        )
+
+    if args.top:
+        self_us = results["bytecode"][2]
+        slowest = sorted(
+            ((statistics.median(values), name) for name, values in self_us.items()),
+            reverse=True,
+        )
+        print(f"\nTop {args.top} modules by self import time (bytecode):")
+        for value, name in slowest[: args.top]:
+            print(f"  {value / 1000:>7.2f}ms  {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
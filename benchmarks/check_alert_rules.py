@@ -0,0 +1,198 @@
+"""Check that alert rules fire the same way in both history storage modes.
+
+Replays price timelines into a scratch database per storage mode, runs the
+rules before recording each price the way a run does, and checks which
+alerts fire:
+
+- ``crossing``: a target price fires for a first price below it and once
+  when the price crosses it, not again while it stays below, and again
+  after the price rose and dropped.
+- ``new_low``: a new low below the target covers the target for that drop.
+- ``average``: the N-day average weighs each price by how long it lasted,
+  so one day at a higher price does not trip a percent drop rule.
+- ``variant_baseline``: a product first seen in several variants is not a
+  new low because a variant its history never held is cheaper, but is
+  when its ``-000`` item dropped below the historical low.
+
+Also checks that rules the schema would reject, options a rule kind does
+not use, and rules for untracked products are refused with a ValueError.
+
+Exits non-zero if a check fails.
+
+Usage:
+    python benchmarks/check_alert_rules.py
+"""
+
+import io
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from alerts import (  # noqa: E402
+    RULE_NEW_LOW,
+    RULE_PERCENT_DROP,
+    RULE_TARGET_PRICE,
+    RULE_WINDOW_LOW,
+)
+from api import ProductPrice, TrackedProduct  # noqa: E402
+from db import HISTORY_MODES, PriceDatabase  # noqa: E402
+from tracker import analyze_prices  # noqa: E402
+
+PRODUCT = TrackedProduct(id="RULES0001", name="規則測試商品", brands=[])
+
+START = datetime(2026, 1, 1)
+
+# Hours between polls of the synthetic timelines
+POLL_HOURS = 6
+
+
+def _run(
+    db: PriceDatabase, price: int, at: datetime, variants: dict[str, int] | None = None
+) -> list[str]:
+    """Evaluate, analyze and record one price like a run does; return the rules fired.
+
+    With ``variants``, the product is priced at the cheapest of them.
+    """
+    observed_at = at.strftime("%Y-%m-%d %H:%M:%S")
+    if variants:
+        price = min(variants.values())
+    product_price = ProductPrice(PRODUCT.id, price, price, variants or {})
+    matches = db.evaluate_alert_rules({PRODUCT.id: price}, observed_at=observed_at)
+    analysis = analyze_prices(
+        [PRODUCT],
+        {PRODUCT.id: product_price},
+        db.get_product_stats([PRODUCT.id]),
+        matches,
+        verbose=False,
+        variant_baselines=db.get_products_without_variant_history(
+            [PRODUCT.id] if len(product_price.variants) > 1 else []
+        ),
+    )
+    db.record_prices(
+        analysis.observed_prices,
+        analysis.alerts,
+        channels=["slack"],
+        observed_at=observed_at,
+        variant_prices=analysis.observed_variants,
+    )
+    return [alert.rule for alert in analysis.alerts]
+
+
+def _timeline(db: PriceDatabase, prices: list[int]) -> list[list[str]]:
+    """Record one price per poll and return the rules fired at each."""
+    with redirect_stdout(io.StringIO()):
+        return [
+            _run(db, price, START + timedelta(hours=POLL_HOURS * i))
+            for i, price in enumerate(prices)
+        ]
+
+
+def _database(mode: str) -> PriceDatabase:
+    db = PriceDatabase(Path(tempfile.mkdtemp()) / "rules.db", history_mode=mode)
+    db.add_product(PRODUCT.id, PRODUCT.name)
+    return db
+
+
+def check_crossing(mode: str) -> tuple[bool, str]:
+    with _database(mode) as db:
+        db.add_alert_rule(RULE_TARGET_PRICE, product_id=PRODUCT.id, threshold=950)
+        fired = _timeline(db, [800, 1000, 1000, 900, 900, 900, 1000, 900, 900])
+        outbox = db.conn.execute("SELECT count(*) FROM notification_outbox").fetchone()[0]
+    target = [RULE_TARGET_PRICE]
+    expected = [target, [], [], target, [], [], [], target, []]
+    return fired == expected and outbox == 3, f"{sum(map(len, fired))} alerts, {outbox} queued"
+
+
+def check_new_low(mode: str) -> tuple[bool, str]:
+    with _database(mode) as db:
+        db.add_alert_rule(RULE_TARGET_PRICE, product_id=PRODUCT.id, threshold=950)
+        fired = _timeline(db, [1100, 1100, 900, 900, 900])
+    return fired == [[], [], [RULE_NEW_LOW], [], []], f"fired {[f for f in fired if f]}"
+
+
+def check_average(mode: str) -> tuple[bool, str]:
+    # 14 days at 1000 except one day at 1200
+    polls_per_day = 24 // POLL_HOURS
+    prices = [1200 if day == 10 else 1000 for day in range(14) for _ in range(polls_per_day)]
+    with _database(mode) as db:
+        # Only the percent drop rule, as the last price is also a new low
+        db.add_alert_rule(RULE_NEW_LOW, product_id=PRODUCT.id, enabled=False)
+        # 1000 is 2.8% below the true 7-day average of about 1029
+        db.add_alert_rule(RULE_PERCENT_DROP, product_id=PRODUCT.id, threshold=5, window_days=7)
+        fired = _timeline(db, [*prices, 1000])
+        # 970 is 5.7% below it
+        with redirect_stdout(io.StringIO()):
+            dropped = _run(db, 970, START + timedelta(days=14, hours=POLL_HOURS))
+    steady = not any(fired)
+    return steady and dropped == [RULE_PERCENT_DROP], (
+        f"{'no alert' if steady else 'alert'} at 1000, {dropped or 'no alert'} at 970"
+    )
+
+
+def check_variant_baseline(mode: str) -> tuple[bool, str]:
+    fired = []
+    # The -000 item the history was recorded from unchanged, then below its low
+    for base_price in (1000, 950):
+        with _database(mode) as db:
+            _timeline(db, [1000, 1000])
+            variants = {f"{PRODUCT.id}-000": base_price, f"{PRODUCT.id}-001": 900}
+            with redirect_stdout(io.StringIO()):
+                fired.append(_run(db, 0, START + timedelta(days=1), variants))
+    unchanged, dropped = fired
+    return unchanged == [] and dropped == [RULE_NEW_LOW], (
+        f"{unchanged or 'no alert'} with -000 unchanged, {dropped or 'no alert'} once it dropped"
+    )
+
+
+# Rules add_alert_rule must refuse, as keyword arguments
+INVALID_RULES = {
+    "zero days": {"kind": RULE_WINDOW_LOW, "window_days": 0},
+    "negative target": {"kind": RULE_TARGET_PRICE, "threshold": -5},
+    "threshold on new_low": {"kind": RULE_NEW_LOW, "threshold": 50},
+    "days on new_low": {"kind": RULE_NEW_LOW, "window_days": 3},
+    "days on target_price": {"kind": RULE_TARGET_PRICE, "threshold": 950, "window_days": 3},
+    "threshold on window_low": {"kind": RULE_WINDOW_LOW, "threshold": 50, "window_days": 3},
+    "untracked product": {"kind": RULE_TARGET_PRICE, "product_id": "NOPE", "threshold": 950},
+}
+
+
+def check_validation() -> list[tuple[str, bool, str]]:
+    results = []
+    with _database(HISTORY_MODES[0]) as db:
+        before = len(db.get_alert_rules())
+        for name, rule in INVALID_RULES.items():
+            try:
+                db.add_alert_rule(**rule)
+            except ValueError as e:
+                results.append((name, True, str(e)))
+            except Exception as e:  # noqa: BLE001
+                results.append((name, False, f"{type(e).__name__}: {e}"))
+            else:
+                results.append((name, False, "accepted"))
+        stored = len(db.get_alert_rules()) - before
+    results.append(("nothing stored", stored == 0, f"{stored} rules added"))
+    return results
+
+
+def main() -> int:
+    ok = True
+    for mode in HISTORY_MODES:
+        print(f"📦 {mode}")
+        for check in (check_crossing, check_new_low, check_average, check_variant_baseline):
+            passed, detail = check(mode)
+            ok &= passed
+            name = check.__name__.removeprefix("check_")
+            print(f"   {'✅' if passed else '❌'} {name}: {detail}")
+    print("📦 validation")
+    for name, passed, detail in check_validation():
+        ok &= passed
+        print(f"   {'✅' if passed else '❌'} {name}: {detail}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
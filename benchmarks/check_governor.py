@@ -0,0 +1,240 @@
+"""Check how the request governor handles a struggling PChome.
+
+Fetches the prices of a synthetic tracking list from ``MockServices``
+while it fails a share of requests, fails every request, or serves only a
+few requests at once, and checks that prices are still retrieved where
+possible, that an outage opens the circuit and fails fast, that the
+concurrency limit backs off to what the server can take, and that the
+circuit closes once the server recovers. Also checks that a probe ending in
+an unexpected error does not leave the circuit stuck, and that a run whose
+tracking list stops part way records what it read without removing the
+products it never saw, and that a price response that is not JSON only
+loses its own chunk. Backoff and reset times are scaled down so the
+checks run in seconds. Exits non-zero if a check fails.
+
+Usage:
+    python benchmarks/check_governor.py
+"""
+
+import contextlib
+import io
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from bench_pipeline import build_synthetic_db  # noqa: E402
+from mock_services import MockServices, product_id  # noqa: E402
+
+from api import BUTTON_API_URL, TRACE_LIST_URL, PChomeAPI  # noqa: E402
+from config import Account  # noqa: E402
+from db import PriceDatabase  # noqa: E402
+from dispatcher import NotificationDispatcher  # noqa: E402
+from governor import RequestGovernor  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from pipeline import StreamingPipeline  # noqa: E402
+from tracker import AccountClient  # noqa: E402
+
+PRODUCTS = 1000
+CHUNK_SIZE = 10
+MAX_CONCURRENCY = 8
+
+# Seconds the circuit stays open in these checks
+RESET_TIMEOUT = 0.3
+
+PRODUCT_IDS = [product_id(i) for i in range(PRODUCTS)]
+
+
+def _api(services: MockServices, transport: httpx.BaseTransport | None = None) -> PChomeAPI:
+    governor = RequestGovernor(
+        MAX_CONCURRENCY,
+        reset_timeout=RESET_TIMEOUT,
+        backoff_base=0.005,
+        backoff_cap=0.05,
+    )
+    return PChomeAPI(
+        "bench",
+        price_chunk_size=CHUNK_SIZE,
+        max_concurrency=MAX_CONCURRENCY,
+        transport=transport or services.transport(),
+        governor=governor,
+    )
+
+
+def _check(name: str, ok: bool, detail: str) -> bool:
+    print(f"   {'✅' if ok else '❌'} {name}: {detail}")
+    return ok
+
+
+def check_flaky() -> bool:
+    """Every price arrives although a fifth of the responses are 503s."""
+    services = MockServices(PRODUCTS, latency=0.002, error_rate=0.2)
+    with _api(services) as api:
+        prices = api.get_prices(PRODUCT_IDS)
+        stats = api.governor.stats()["ecapi.pchome.com.tw"]
+    return _check(
+        "flaky",
+        len(prices) == PRODUCTS and stats.retries > 0 and not stats.circuit_opened,
+        f"{len(prices)}/{PRODUCTS} prices, {stats.retries} retries, "
+        f"{services.requests['button']} requests",
+    )
+
+
+def check_outage() -> bool:
+    """A dead endpoint opens the circuit and the rest of the run fails fast."""
+    services = MockServices(PRODUCTS, latency=0.002, error_rate=1.0)
+    with _api(services) as api:
+        start = time.perf_counter()
+        prices = api.get_prices(PRODUCT_IDS)
+        elapsed = time.perf_counter() - start
+        stats = api.governor.stats()["ecapi.pchome.com.tw"]
+    chunks = PRODUCTS // CHUNK_SIZE
+    requests = services.requests["button"]
+    return _check(
+        "outage",
+        not prices and stats.circuit_opened == 1 and requests < chunks and elapsed < 1.0,
+        f"{requests} requests for {chunks} chunks, {stats.rejected} failed fast, {elapsed:.2f}s",
+    )
+
+
+def check_overload() -> bool:
+    """Concurrency backs off to what an overloaded server can take."""
+    capacity = 2
+    services = MockServices(PRODUCTS, latency=0.01, capacity=capacity)
+    with _api(services) as api:
+        prices = api.get_prices(PRODUCT_IDS)
+        stats = api.governor.stats()["ecapi.pchome.com.tw"]
+    return _check(
+        "overload",
+        len(prices) == PRODUCTS and stats.limit < MAX_CONCURRENCY and not stats.circuit_opened,
+        f"{len(prices)}/{PRODUCTS} prices, limit {MAX_CONCURRENCY} -> {stats.limit:.1f} "
+        f"for capacity {capacity}, {stats.failures} overloaded responses",
+    )
+
+
+def check_recovery() -> bool:
+    """The circuit closes again once the endpoint answers a probe."""
+    services = MockServices(PRODUCTS, latency=0.002, error_rate=1.0)
+    with _api(services) as api:
+        api.get_prices(PRODUCT_IDS)
+        services.error_rate = 0.0
+        time.sleep(RESET_TIMEOUT)
+        prices = api.get_prices(PRODUCT_IDS)
+        stats = api.governor.stats()["ecapi.pchome.com.tw"]
+    return _check(
+        "recovery",
+        len(prices) == PRODUCTS and stats.circuit_opened == 1,
+        f"{len(prices)}/{PRODUCTS} prices after {RESET_TIMEOUT}s",
+    )
+
+
+def check_probe_error() -> bool:
+    """A probe that ends in an unexpected error frees its slot and lets the next one probe."""
+    services = MockServices(PRODUCTS, latency=0.002, error_rate=1.0)
+    with _api(services) as api:
+        api.get_prices(PRODUCT_IDS)
+        services.error_rate = 0.0
+        time.sleep(RESET_TIMEOUT)
+
+        def broken() -> httpx.Response:
+            raise ValueError("broken probe")
+
+        with contextlib.suppress(ValueError):
+            api.governor.send("ecapi.pchome.com.tw", broken)
+        # A leaked probe would block every later request forever
+        probe = threading.Thread(
+            target=api.governor.send,
+            args=("ecapi.pchome.com.tw", lambda: httpx.Response(200)),
+            daemon=True,
+        )
+        probe.start()
+        probe.join(timeout=5)
+        blocked = probe.is_alive()
+        prices = {} if blocked else api.get_prices(PRODUCT_IDS)
+    return _check(
+        "probe_error",
+        not blocked and len(prices) == PRODUCTS,
+        "next request still blocked after 5s"
+        if blocked
+        else f"{len(prices)}/{PRODUCTS} prices after a failed probe",
+    )
+
+
+def check_list_outage() -> bool:
+    """A tracking list failing after its first page ends the run without removing products."""
+    services = MockServices(PRODUCTS, latency=0.002)
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        if str(request.url).startswith(TRACE_LIST_URL) and request.url.params["page"] != "1":
+            return httpx.Response(503)
+        return services.handle(request)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "outage.db"
+        build_synthetic_db(db_path, PRODUCTS, PRODUCTS)
+        with (
+            _api(services, httpx.MockTransport(handle)) as api,
+            PriceDatabase(db_path) as db,
+            NotificationDispatcher([]) as dispatcher,
+            contextlib.redirect_stdout(io.StringIO()),
+        ):
+            account = Account(1, "bench", None, None, None)
+            pipeline = StreamingPipeline(
+                db, [AccountClient(account, api, [])], dispatcher, Metrics()
+            )
+            result = pipeline.run()
+            tracked = db.conn.execute(
+                "SELECT count(*) FROM products WHERE deleted_at IS NULL"
+            ).fetchone()[0]
+    return _check(
+        "list_outage",
+        result.interrupted and 0 < result.prices < PRODUCTS and tracked == PRODUCTS,
+        f"{result.prices}/{PRODUCTS} prices recorded, {tracked}/{PRODUCTS} products kept",
+    )
+
+
+def check_bad_chunk() -> bool:
+    """A price chunk answered with HTML instead of JSON skips only that chunk."""
+    services = MockServices(PRODUCTS, latency=0.002)
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        if url.startswith(BUTTON_API_URL) and f"{PRODUCT_IDS[0]}-000" in url:
+            return httpx.Response(200, text="<html>維護中</html>")
+        return services.handle(request)
+
+    with (
+        _api(services, httpx.MockTransport(handle)) as api,
+        contextlib.redirect_stdout(io.StringIO()),
+    ):
+        prices = api.get_prices(PRODUCT_IDS)
+    expected = PRODUCTS - CHUNK_SIZE
+    return _check(
+        "bad_chunk",
+        len(prices) == expected and PRODUCT_IDS[0] not in prices,
+        f"{len(prices)}/{expected} prices from the other chunks",
+    )
+
+
+def main() -> int:
+    ok = True
+    for check in (
+        check_flaky,
+        check_outage,
+        check_overload,
+        check_recovery,
+        check_probe_error,
+        check_list_outage,
+        check_bad_chunk,
+    ):
+        ok &= check()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""Check that the notifiers wait out rate limits from Slack and Telegram.
+
+Sends one alert through each notifier to ``MockServices`` while it answers
+the first requests with a 429, and checks that the notifier waits the time
+the service asked for (Slack's ``Retry-After`` header, Telegram's
+``parameters.retry_after``) and then delivers the alert, and that it gives
+up after ``max_attempts`` while the service keeps refusing. The notifiers'
+own rate limits are lifted so only the server's wait is timed. Exits
+non-zero if a check fails.
+
+Usage:
+    python benchmarks/check_notifier_retry.py
+"""
+
+import io
+import sys
+import time
+from collections.abc import Callable
+from contextlib import redirect_stdout
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from mock_services import SLACK_WEBHOOK_URL, TELEGRAM_API_BASE, MockServices  # noqa: E402
+
+from ratelimit import TokenBucket  # noqa: E402
+from slack_notifier import SlackNotifier  # noqa: E402
+from telegram_notifier import TelegramNotifier  # noqa: E402
+
+# Seconds the mock services ask the notifiers to wait
+RETRY_AFTER = 0.2
+
+# Requests answered with a 429 before the alert goes through
+RATE_LIMITED = 2
+
+MAX_ATTEMPTS = 3
+
+# Rate limits high enough that only the server's wait is timed
+UNLIMITED = 1_000_000
+
+
+def _slack(services: MockServices) -> SlackNotifier:
+    notifier = SlackNotifier(
+        SLACK_WEBHOOK_URL, max_attempts=MAX_ATTEMPTS, transport=services.transport()
+    )
+    notifier.rate_limiter = TokenBucket(rate=UNLIMITED, capacity=UNLIMITED)
+    return notifier
+
+
+def _telegram(services: MockServices) -> TelegramNotifier:
+    notifier = TelegramNotifier(
+        "check-token",
+        "1",
+        api_base=TELEGRAM_API_BASE,
+        max_attempts=MAX_ATTEMPTS,
+        transport=services.transport(),
+    )
+    notifier.rate_limiters = [TokenBucket(rate=UNLIMITED, capacity=UNLIMITED)]
+    return notifier
+
+
+NOTIFIERS: dict[str, Callable[[MockServices], SlackNotifier | TelegramNotifier]] = {
+    "slack": _slack,
+    "telegram": _telegram,
+}
+
+
+def _send(endpoint: str, rate_limited: int) -> tuple[bool, int, float]:
+    """Send one alert; return whether it was delivered, the requests made and the seconds taken."""
+    services = MockServices(1, rate_limited=rate_limited, retry_after=RETRY_AFTER)
+    notifier = NOTIFIERS[endpoint](services)
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        sent = notifier.send_price_drop_alert("RETRY0001", "重試測試商品", 900, 1000)
+    return sent, services.requests[endpoint], time.perf_counter() - start
+
+
+def check_waits(endpoint: str) -> tuple[bool, str]:
+    sent, requests, elapsed = _send(endpoint, RATE_LIMITED)
+    waited = elapsed >= RATE_LIMITED * RETRY_AFTER
+    passed = sent and requests == RATE_LIMITED + 1 and waited
+    return passed, f"{'sent' if sent else 'not sent'} after {requests} requests in {elapsed:.2f}s"
+
+
+def check_gives_up(endpoint: str) -> tuple[bool, str]:
+    sent, requests, elapsed = _send(endpoint, MAX_ATTEMPTS + 1)
+    passed = not sent and requests == MAX_ATTEMPTS
+    return passed, f"{'sent' if sent else 'not sent'} after {requests} requests in {elapsed:.2f}s"
+
+
+def main() -> int:
+    ok = True
+    for endpoint in NOTIFIERS:
+        print(f"📦 {endpoint}")
+        for check in (check_waits, check_gives_up):
+            passed, detail = check(endpoint)
+            ok &= passed
+            name = check.__name__.removeprefix("check_")
+            print(f"   {'✅' if passed else '❌'} {name}: {detail}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""Check that history queries use the time-ordered covering index.
+
+Traces the statements that hot ``PriceDatabase`` methods actually execute
+and checks their ``EXPLAIN QUERY PLAN``: first against a database with the
+pre-migration schema, then after opening it with ``PriceDatabase`` so the
+pending migrations run. Exits non-zero if a plan does not match
+expectations.
+
+Usage:
+    python benchmarks/check_query_plans.py
+"""
+
+import shutil
+import sqlite3
+import sys
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from db import HISTORY_MODE_CHANGE_ONLY, PriceDatabase  # noqa: E402
+
+# Schema as created before versioned migrations were introduced
+LEGACY_SCHEMA = """
+    CREATE TABLE products (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE price_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id TEXT NOT NULL,
+        price INTEGER NOT NULL,
+        recorded_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+    );
+    CREATE INDEX idx_price_history_product_id ON price_history(product_id);
+"""
+
+# Product whose history the checked calls read
+PRODUCT = "P-0000"
+
+# PriceDatabase calls whose statements are checked; the writes run in
+# change_only mode so the variant lookup is among them
+CALLS: dict[str, Callable[[PriceDatabase], object]] = {
+    "latest_price": lambda db: db.get_latest_price(PRODUCT),
+    "price_history": lambda db: db.get_price_history(PRODUCT),
+    "historical_low": lambda db: db.get_historical_low(PRODUCT),
+    "product_stats": lambda db: db.get_product_stats([PRODUCT]),
+    "record_variants": lambda db: db.record_prices(
+        [(PRODUCT, 999)], variant_prices=[(PRODUCT, f"{PRODUCT}-001", 999)]
+    ),
+}
+
+# Statements that have a query plan
+PLANNED_KINDS = frozenset({"SELECT", "WITH", "INSERT", "UPDATE", "DELETE"})
+
+
+def _issued_statements(db: PriceDatabase, call: Callable[[PriceDatabase], object]) -> list[str]:
+    """Run ``call`` and return the statements it executed, with their values bound."""
+    statements: list[str] = []
+    db.conn.set_trace_callback(statements.append)
+    try:
+        call(db)
+    finally:
+        db.conn.set_trace_callback(None)
+    return [
+        statement
+        for statement in statements
+        if statement.lstrip().split(None, 1)[0].upper() in PLANNED_KINDS
+    ]
+
+
+def _plan(conn: sqlite3.Connection, statements: list[str]) -> str:
+    """Return the query plan details of the statements joined into one string."""
+    return " | ".join(
+        row[3]
+        for statement in statements
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+    )
+
+
+def _check(name: str, plan: str, expected: list[str], unexpected: list[str]) -> bool:
+    ok = all(text in plan for text in expected) and not any(text in plan for text in unexpected)
+    print(f"   {'✅' if ok else '❌'} {name}: {plan}")
+    return ok
+
+
+def main() -> int:
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "plans.db"
+
+        conn = sqlite3.connect(db_path)
+        conn.executescript(LEGACY_SCHEMA)
+        conn.executemany(
+            "INSERT INTO price_history (product_id, price, recorded_at) VALUES (?, ?, ?)",
+            [
+                (f"P-{p:04d}", 1000 + d, f"2025-{1 + d // 28:02d}-{1 + d % 28:02d} 00:00:00")
+                for p in range(200)
+                for d in range(300)
+            ],
+        )
+        conn.commit()
+        conn.execute("ANALYZE")
+
+        # The statement is captured on a migrated copy so the legacy database
+        # can be checked before it is migrated. get_price_history() also
+        # reads last_seen_at, which the legacy schema lacks.
+        traced_path = Path(tmp) / "traced.db"
+        shutil.copyfile(db_path, traced_path)
+        with PriceDatabase(traced_path) as db:
+            statements = _issued_statements(db, CALLS["latest_price"])
+
+        print("Before migration:")
+        ok &= _check(
+            "latest_price",
+            _plan(conn, statements),
+            expected=["idx_price_history_product_id", "USE TEMP B-TREE FOR ORDER BY"],
+            unexpected=[],
+        )
+        conn.close()
+
+        with PriceDatabase(db_path, history_mode=HISTORY_MODE_CHANGE_ONLY) as db:
+            db.add_product(PRODUCT, "查詢計畫測試商品")
+            plans = {
+                name: _plan(db.conn, _issued_statements(db, call)) for name, call in CALLS.items()
+            }
+
+            print("After migration:")
+            for name in ("latest_price", "price_history"):
+                ok &= _check(
+                    name,
+                    plans[name],
+                    expected=["idx_price_history_product_recorded"],
+                    unexpected=["TEMP B-TREE"],
+                )
+            ok &= _check(
+                "historical_low",
+                plans["historical_low"],
+                expected=["COVERING INDEX idx_price_history_product_recorded"],
+                unexpected=[],
+            )
+            ok &= _check(
+                "product_stats",
+                plans["product_stats"],
+                expected=["SEARCH s USING"],
+                unexpected=["SCAN s", "SCAN p"],
+            )
+            ok &= _check(
+                "record_variants",
+                plans["record_variants"],
+                # One seek to each variant's current row, not a read of its history
+                expected=[
+                    "COVERING INDEX idx_variant_price_history_variant "
+                    "(product_id=? AND variant_id=?)"
+                ],
+                unexpected=["SCAN variant_price_history", "SCAN price_history"],
+            )
+            journal_mode = db.conn.execute("PRAGMA journal_mode").fetchone()[0]
+            ok &= _check("journal_mode", journal_mode, expected=["wal"], unexpected=[])
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""Offline stand-ins for the PChome, Slack and Telegram endpoints.
+
+``MockServices.transport()`` returns an ``httpx.MockTransport`` that can be
+passed to ``PChomeAPI``, ``SlackNotifier`` and ``TelegramNotifier``. Every
+response can be delayed and a share of them replaced by server errors, the
+notification endpoints can rate limit, and the requests served are counted
+per endpoint.
+"""
+
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from api import BUTTON_API_URL, TRACE_LIST_URL  # noqa: E402
+
+# Lowest price of the synthetic history; rows are at most 96 above it
+BASE_PRICE = 1000
+
+# Current price of products that did not drop
+STEADY_PRICE = 1100
+
+# Current price of products that dropped to a new low
+DROP_PRICE = 900
+
+# Variants of multi-variant products, each priced VARIANT_STEP below the previous
+VARIANTS = 3
+VARIANT_STEP = 10
+
+SLACK_WEBHOOK_URL = "https://hooks.slack.com/services/BENCH/BENCH/BENCH"
+TELEGRAM_API_BASE = "https://api.telegram.org"
+
+
+def product_id(index: int) -> str:
+    """ID of the synthetic product with the given index."""
+    return f"BENCH{index:07d}"
+
+
+class MockServices:
+    """Serves a synthetic tracking list, its prices and the webhook endpoints.
+
+    ``drop_rate`` is the share of products whose current price is a new low.
+    ``latency`` seconds are added to every response, and ``error_rate`` of
+    the responses are replaced by a 503. With a ``capacity``, requests that
+    find that many others in flight at the same endpoint get a 503 too, like
+    an overloaded server; the most seen at once is kept in ``max_in_flight``.
+    ``variant_rate`` is the share of products sold in ``VARIANTS`` variants,
+    which the button API returns together for the product's ``-000`` item.
+    The first ``rate_limited`` requests to Slack and to Telegram are answered
+    with a 429 asking to wait ``retry_after`` seconds, the way each service
+    does: Slack in a ``Retry-After`` header, Telegram in
+    ``parameters.retry_after``.
+    """
+
+    def __init__(
+        self,
+        products: int,
+        drop_rate: float = 0.05,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        capacity: int | None = None,
+        variant_rate: float = 0.0,
+        rate_limited: int = 0,
+        retry_after: float = 1.0,
+        seed: int = 0,
+    ) -> None:
+        """Initialize the services for ``products`` tracked products."""
+        self.products = products
+        self.latency = latency
+        self.error_rate = error_rate
+        self.capacity = capacity
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+        # Requests answered with a 429 so far, per endpoint
+        self.throttled: Counter[str] = Counter()
+        self.requests: Counter[str] = Counter()
+        self.max_in_flight: Counter[str] = Counter()
+        self._in_flight: Counter[str] = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        dropped = random.Random(seed).sample(range(products), int(products * drop_rate))
+        self._dropped = {product_id(i) for i in dropped}
+        multi_variant = random.Random(seed + 1).sample(
+            range(products), int(products * variant_rate)
+        )
+        self._multi_variant = {product_id(i) for i in multi_variant}
+
+    def transport(self) -> httpx.MockTransport:
+        """A transport that routes requests to these services."""
+        return httpx.MockTransport(self.handle)
+
+    def reset_counts(self) -> Counter[str]:
+        """Return the request counts so far and start counting from zero."""
+        with self._lock:
+            counts, self.requests = self.requests, Counter()
+        return counts
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        """Answer one request like the real endpoint would."""
+        url = str(request.url)
+        if url.startswith(TRACE_LIST_URL):
+            endpoint = "trace_list"
+        elif url.startswith(BUTTON_API_URL):
+            endpoint = "button"
+        elif url.startswith(SLACK_WEBHOOK_URL):
+            endpoint = "slack"
+        elif url.startswith(TELEGRAM_API_BASE):
+            endpoint = "telegram"
+        else:
+            return httpx.Response(404)
+
+        with self._lock:
+            self.requests[endpoint] += 1
+            throttled = (
+                endpoint in ("slack", "telegram") and self.throttled[endpoint] < self.rate_limited
+            )
+            if throttled:
+                self.throttled[endpoint] += 1
+            failed = self._random.random() < self.error_rate
+            overloaded = self.capacity is not None and self._in_flight[endpoint] >= self.capacity
+            self._in_flight[endpoint] += 1
+            self.max_in_flight[endpoint] = max(
+                self.max_in_flight[endpoint], self._in_flight[endpoint]
+            )
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+        finally:
+            with self._lock:
+                self._in_flight[endpoint] -= 1
+        if throttled:
+            return self._rate_limited(endpoint)
+        if failed or overloaded:
+            return httpx.Response(503)
+
+        if endpoint == "trace_list":
+            return self._trace_list(request)
+        if endpoint == "button":
+            return self._button(url)
+        if endpoint == "telegram":
+            return httpx.Response(200, json={"ok": True})
+        return httpx.Response(200, text="ok")
+
+    def _trace_list(self, request: httpx.Request) -> httpx.Response:
+        page = int(request.url.params["page"])
+        limit = int(request.url.params["limit"])
+        start = (page - 1) * limit
+        rows = [
+            {"Id": product_id(i), "Name": f"測試商品 {i}", "BrandList": []}
+            for i in range(start, min(self.products, start + limit))
+        ]
+        return httpx.Response(
+            200,
+            json={
+                "TotalPages": max(1, -(-self.products // limit)),
+                "TotalProducts": self.products,
+                "Rows": rows,
+            },
+        )
+
+    def _rate_limited(self, endpoint: str) -> httpx.Response:
+        if endpoint == "slack":
+            return httpx.Response(
+                429, headers={"Retry-After": str(self.retry_after)}, text="rate_limited"
+            )
+        return httpx.Response(
+            429,
+            json={
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            },
+        )
+
+    def _button(self, url: str) -> httpx.Response:
+        item_ids = url.split("&id=", 1)[1].split("&", 1)[0].split(",")
+        items = []
+        for item_id in item_ids:
+            pid = item_id.rsplit("-", 1)[0]
+            price = DROP_PRICE if pid in self._dropped else STEADY_PRICE
+            variants = VARIANTS if pid in self._multi_variant else 1
+            items.extend(
+                {"Id": f"{pid}-{v:03d}", "Price": {"P": price - v * VARIANT_STEP, "Low": None}}
+                for v in range(variants)
+            )
+        return httpx.Response(200, content=json.dumps(items).encode())
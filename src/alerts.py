@@ -0,0 +1,27 @@
+"""Alert types shared by the notifiers and the dispatcher."""
+
+from dataclasses import dataclass
+
+# Alert rule kinds: a new all-time low, a price at or below a target, a drop
+# of a percentage below the N-day average, and a new N-day low
+RULE_NEW_LOW = "new_low"
+RULE_TARGET_PRICE = "target_price"
+RULE_PERCENT_DROP = "percent_drop"
+RULE_WINDOW_LOW = "window_low"
+RULE_KINDS = (RULE_NEW_LOW, RULE_TARGET_PRICE, RULE_PERCENT_DROP, RULE_WINDOW_LOW)
+
+
+@dataclass(frozen=True)
+class PriceDropAlert:
+    """A product whose price satisfied an alert rule, by default a new historical low."""
+
+    product_id: str
+    product_name: str
+    current_price: int
+    historical_low: int
+    rule: str = RULE_NEW_LOW
+    # Why a rule other than the new low fired, shown instead of the drop
+    reason: str | None = None
+    # When the price the rule's threshold was crossed from started, which
+    # tells crossings at the same price apart (None for a first price)
+    crossed_from: str | None = None
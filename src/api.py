@@ -1,9 +1,20 @@
 """PChome API client for fetching tracking list and prices."""
 
-from dataclasses import dataclass
+import hashlib
+import json
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
 
 import httpx
 
+from governor import CircuitOpenError, RequestGovernor
+from http_client import create_client
+from ratelimit import TokenBucket
+
 # API endpoints
 TRACE_LIST_URL = "https://ecvip.pchome.com.tw/fsapi/member/products/trace/list"
 BUTTON_API_URL = "https://ecapi.pchome.com.tw/ecshop/prodapi/v2/prod/button"
@@ -14,6 +25,21 @@ DEFAULT_HEADERS = {
     "User-Agent": "Mozilla/5.0 AppleWebKit/537.36",
 }
 
+# Per-attempt timeouts; failed attempts are retried by the request governor
+REQUEST_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+
+# Number of rows requested per tracking list page
+TRACKING_PAGE_SIZE = 100
+
+# Default number of product IDs sent per button API request
+DEFAULT_PRICE_CHUNK_SIZE = 50
+
+# Default number of requests allowed in flight at once
+DEFAULT_MAX_CONCURRENCY = 4
+
+# Default age in seconds after which a cached tracking list is refetched in full
+DEFAULT_TRACKING_LIST_TTL = 24 * 60 * 60
+
 
 @dataclass
 class TrackedProduct:
@@ -26,11 +52,18 @@ class TrackedProduct:
 
 @dataclass
 class ProductPrice:
-    """Price information for a product."""
+    """Price information for a product, at its cheapest variant."""
 
     product_id: str
     price: int
     original_price: int
+    # Current price of each variant the button API returned, by item ID
+    variants: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def base_price(self) -> int | None:
+        """Price of the product's ``-000`` item, the only one priced before variants."""
+        return self.variants.get(f"{self.product_id}-000")
 
 
 class PChomeAPIError(Exception):
@@ -39,16 +72,165 @@ class PChomeAPIError(Exception):
     pass
 
 
+@dataclass
+class CachedTrackingList:
+    """Header of the tracking list saved by the last full fetch."""
+
+    fingerprint: str
+    etag: str | None
+    last_modified: str | None
+    fetched_at: float
+
+
+def fingerprint_tracking_page(data: dict) -> str:
+    """Summarize tracking list page 1 so an unchanged list can be recognized.
+
+    Covers the page count, the total product count and the IDs on the first
+    page, which is where newly tracked products appear. A change that leaves
+    all of these intact is picked up by the next full refresh.
+    """
+    rows = data.get("Rows", [])
+    summary = [
+        data.get("TotalPages", 1),
+        data.get("TotalProducts"),
+        len(rows),
+        [row.get("Id") for row in rows],
+    ]
+    return hashlib.sha256(json.dumps(summary).encode()).hexdigest()
+
+
+class TrackingListCache:
+    """JSON Lines file holding the tracking list and the page-1 fingerprint it had.
+
+    The first line is a header and every further line one product, so the
+    list is written and read back a page at a time. Entries older than
+    ``ttl`` seconds are treated as missing, which forces a periodic full
+    refresh even when the fingerprint never changes.
+    """
+
+    def __init__(self, path: Path, ttl: float = DEFAULT_TRACKING_LIST_TTL) -> None:
+        """Initialize the cache at the given file path."""
+        self.path = path
+        self.ttl = ttl
+
+    def load(self) -> CachedTrackingList | None:
+        """Return the cache header, or None if it is missing, unreadable or expired."""
+        try:
+            with self.path.open(encoding="utf-8") as file:
+                data = json.loads(file.readline())
+            cached = CachedTrackingList(
+                fingerprint=data["fingerprint"],
+                etag=data.get("etag"),
+                last_modified=data.get("last_modified"),
+                fetched_at=float(data["fetched_at"]),
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        if time.time() - cached.fetched_at >= self.ttl:
+            return None
+        return cached
+
+    def iter_pages(self, page_size: int = TRACKING_PAGE_SIZE) -> Iterator[list[TrackedProduct]]:
+        """Yield the cached products in pages of ``page_size``."""
+        with self.path.open(encoding="utf-8") as file:
+            file.readline()
+            page: list[TrackedProduct] = []
+            for line in file:
+                page.append(TrackedProduct(**json.loads(line)))
+                if len(page) == page_size:
+                    yield page
+                    page = []
+            if page:
+                yield page
+
+    def writer(
+        self,
+        fingerprint: str,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> "TrackingListCacheWriter":
+        """Start replacing the cache with a freshly fetched list."""
+        header = CachedTrackingList(
+            fingerprint=fingerprint,
+            etag=etag,
+            last_modified=last_modified,
+            fetched_at=time.time(),
+        )
+        return TrackingListCacheWriter(self.path, header)
+
+
+class TrackingListCacheWriter:
+    """Writes a tracking list into the cache page by page.
+
+    The new file only replaces the cache on ``commit()``, so an interrupted
+    fetch never leaves a partial list behind.
+    """
+
+    def __init__(self, path: Path, header: CachedTrackingList) -> None:
+        """Open a temporary file next to ``path`` and write the header."""
+        self.path = path
+        self.tmp_path = path.with_suffix(path.suffix + ".tmp")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = self.tmp_path.open("w", encoding="utf-8")
+        self.file.write(json.dumps(asdict(header)) + "\n")
+
+    def write(self, products: list[TrackedProduct]) -> None:
+        """Append one page of products."""
+        self.file.writelines(
+            json.dumps(asdict(product), ensure_ascii=False) + "\n" for product in products
+        )
+
+    def commit(self) -> None:
+        """Replace the cache with the written list."""
+        self.file.close()
+        self.tmp_path.replace(self.path)
+
+    def discard(self) -> None:
+        """Drop the partially written list and keep the previous cache."""
+        self.file.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+
 class PChomeAPI:
     """Client for PChome API."""
 
-    def __init__(self, ecwebsess: str) -> None:
-        """Initialize the API client with session cookie."""
+    def __init__(
+        self,
+        ecwebsess: str,
+        price_chunk_size: int = DEFAULT_PRICE_CHUNK_SIZE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        rate_limiter: TokenBucket | None = None,
+        tracking_cache: TrackingListCache | None = None,
+        session_variable: str = "PCHOME_ECWEBSESS",
+        transport: httpx.BaseTransport | None = None,
+        governor: RequestGovernor | None = None,
+    ) -> None:
+        """Initialize the API client with session cookie.
+
+        ``session_variable`` names the setting the cookie came from, so an
+        expired session can be traced to its account. ``transport`` replaces
+        the network, e.g. with a mock PChome for offline benchmarks.
+
+        If ``rate_limiter`` is given, every request waits for one of its tokens.
+        Requests are retried and throttled by ``governor``, which clients of
+        several accounts should share; by default each client has its own.
+        If ``tracking_cache`` is given, unchanged tracking lists are served
+        from it after fetching only the first page.
+        """
         self.cookies = {"ECWEBSESS": ecwebsess}
-        self.client = httpx.Client(
+        self.rate_limiter = rate_limiter
+        self.tracking_cache = tracking_cache
+        self.session_variable = session_variable
+        self.price_chunk_size = max(1, price_chunk_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.governor = governor or RequestGovernor(self.max_concurrency)
+        self.client = create_client(
             headers=DEFAULT_HEADERS,
             cookies=self.cookies,
-            timeout=30.0,
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_connections=self.max_concurrency),
+            transport=transport,
         )
 
     def __enter__(self) -> "PChomeAPI":
@@ -57,73 +239,216 @@ class PChomeAPI:
     def __exit__(self, *args: object) -> None:
         self.client.close()
 
+    def _get(self, url: str, **kwargs: object) -> httpx.Response:
+        """Send a GET request through the governor within the client's rate budget."""
+
+        def send() -> httpx.Response:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            return self.client.get(url, **kwargs)  # type: ignore[arg-type]
+
+        return self.governor.send(httpx.URL(url).host, send)
+
     def get_tracking_list(self) -> list[TrackedProduct]:
         """Fetch all products in the tracking list."""
-        products: list[TrackedProduct] = []
-        page = 1
-        limit = 100
-
-        while True:
-            response = self.client.get(
-                TRACE_LIST_URL,
-                params={"page": page, "limit": limit},
-            )
+        return [product for page in self.iter_tracking_list() for product in page]
 
-            if response.status_code == 403:
-                raise PChomeAPIError(
-                    "Session expired or invalid. Please update PCHOME_ECWEBSESS. "
-                    "See docs/COOKIE_GUIDE.md for instructions."
-                )
+    def iter_tracking_list(self) -> Iterator[list[TrackedProduct]]:
+        """Yield the tracking list one page of products at a time.
 
-            response.raise_for_status()
-            data = response.json()
+        The first page reports ``TotalPages``; the remaining pages are then
+        fetched concurrently and yielded in page order. At most
+        ``max_concurrency`` pages are fetched ahead of the consumer, so a
+        slow consumer holds back the fetching instead of buffering pages.
+
+        With a tracking cache, the first page is requested conditionally and
+        fingerprinted. If PChome answers 304 or the fingerprint matches the
+        cached one, the cached list is yielded without paginating.
+        """
+        cached = self.tracking_cache.load() if self.tracking_cache is not None else None
+
+        headers: dict[str, str] = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        response = self._fetch_tracking_page(1, headers=headers)
+        if self.tracking_cache is not None and cached is not None:
+            if response.status_code == 304:
+                yield from self.tracking_cache.iter_pages()
+                return
+
+        first_page = response.json()
+        fingerprint = fingerprint_tracking_page(first_page)
+        if self.tracking_cache is not None and cached is not None:
+            if cached.fingerprint == fingerprint:
+                yield from self.tracking_cache.iter_pages()
+                return
+
+        writer = None
+        if self.tracking_cache is not None:
+            writer = self.tracking_cache.writer(
+                fingerprint,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            )
 
-            for row in data.get("Rows", []):
-                products.append(
+        try:
+            for data in self._iter_tracking_pages(first_page):
+                products = [
                     TrackedProduct(
                         id=row["Id"],
                         name=row["Name"],
                         brands=row.get("BrandList", []),
                     )
-                )
+                    for row in data.get("Rows", [])
+                ]
+                if writer is not None:
+                    writer.write(products)
+                yield products
+        except BaseException:
+            if writer is not None:
+                writer.discard()
+            raise
+
+        if writer is not None:
+            writer.commit()
+
+    def _iter_tracking_pages(self, first_page: dict) -> Iterator[dict]:
+        """Yield the raw tracking list pages in order, prefetching a few ahead."""
+        yield first_page
+
+        total_pages = first_page.get("TotalPages", 1)
+        if total_pages <= 1:
+            return
+
+        workers = min(self.max_concurrency, total_pages - 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending: deque[Future[httpx.Response]] = deque()
+            next_page = 2
+            while next_page <= total_pages or pending:
+                while next_page <= total_pages and len(pending) < workers:
+                    pending.append(executor.submit(self._fetch_tracking_page, next_page))
+                    next_page += 1
+                yield pending.popleft().result().json()
+
+    def _fetch_tracking_page(
+        self, page: int, headers: dict[str, str] | None = None
+    ) -> httpx.Response:
+        """Fetch a single page of the tracking list.
+
+        Returns the successful response, or a 304 response to a conditional
+        request made with ``headers``.
+        """
+        response = self._get(
+            TRACE_LIST_URL,
+            params={"page": page, "limit": TRACKING_PAGE_SIZE},
+            headers=headers,
+        )
 
-            total_pages = data.get("TotalPages", 1)
-            if page >= total_pages:
-                break
-            page += 1
+        if response.status_code == 403:
+            raise PChomeAPIError(
+                f"Session expired or invalid. Please update {self.session_variable}. "
+                "See docs/COOKIE_GUIDE.md for instructions."
+            )
 
-        return products
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
 
     def get_prices(self, product_ids: list[str]) -> dict[str, ProductPrice]:
         """Fetch prices for multiple products.
 
         Uses the button API which returns promotional prices (Price.Low)
         when available, falling back to regular price (Price.P).
+
+        Product IDs are split into chunks of ``price_chunk_size`` which are
+        fetched concurrently. A chunk that fails is reported and skipped so
+        the prices from the other chunks are still returned.
         """
-        if not product_ids:
-            return {}
+        chunks = [
+            product_ids[i : i + self.price_chunk_size]
+            for i in range(0, len(product_ids), self.price_chunk_size)
+        ]
+
+        prices: dict[str, ProductPrice] = {}
+        for _, chunk_prices in self.iter_prices(chunks):
+            for product_id, price in chunk_prices.items():
+                prices.setdefault(product_id, price)
+        return prices
 
+    def iter_prices(
+        self, chunks: Iterable[list[str]]
+    ) -> Iterator[tuple[list[str], dict[str, ProductPrice]]]:
+        """Fetch prices chunk by chunk, yielding each chunk with its prices in order.
+
+        At most ``max_concurrency`` chunks are in flight, and the next chunk
+        is only taken from ``chunks`` once the consumer has taken a result,
+        so a slow consumer holds back both the fetching and the producer of
+        ``chunks``. A chunk that fails, or whose response is not JSON, is
+        reported and yields no prices, so the prices fetched before an
+        outage are still recorded.
+        """
+        chunk_iter = iter(chunks)
+        skipped = 0
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            pending: deque[tuple[list[str], Future[dict[str, ProductPrice]]]] = deque()
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < self.max_concurrency:
+                    chunk = next(chunk_iter, None)
+                    if chunk is None:
+                        exhausted = True
+                    elif chunk:
+                        pending.append((chunk, executor.submit(self._fetch_price_chunk, chunk)))
+                if not pending:
+                    break
+
+                chunk, future = pending.popleft()
+                try:
+                    chunk_prices = future.result()
+                except CircuitOpenError:
+                    skipped += len(chunk)
+                    chunk_prices = {}
+                except httpx.HTTPError as e:
+                    print(f"   ⚠️  Failed to fetch prices for {len(chunk)} products: {e}")
+                    chunk_prices = {}
+                except ValueError as e:
+                    print(f"   ⚠️  Unreadable prices for {len(chunk)} products: {e}")
+                    chunk_prices = {}
+                yield chunk, chunk_prices
+
+        if skipped:
+            print(f"   ⚠️  Skipped prices for {skipped} products while PChome was failing")
+
+    def _fetch_price_chunk(self, product_ids: list[str]) -> dict[str, ProductPrice]:
+        """Fetch prices for a single chunk of products with one button API call.
+
+        The response can list several variants (colours, sizes) of a product.
+        They are grouped by product in the same pass over the items, and the
+        product is priced at its cheapest variant.
+        """
         # Button API requires product ID with -000 suffix
         item_ids = [f"{pid}-000" for pid in product_ids]
 
         # API accepts comma-separated list of product IDs
-        response = self.client.get(f"{BUTTON_API_URL}&id={','.join(item_ids)}&fields=Id,Price")
+        response = self._get(f"{BUTTON_API_URL}&id={','.join(item_ids)}&fields=Id,Price")
 
         if response.status_code == 403:
-            raise PChomeAPIError("Session expired or invalid. Please update PCHOME_ECWEBSESS.")
+            raise PChomeAPIError(
+                f"Session expired or invalid. Please update {self.session_variable}."
+            )
 
         response.raise_for_status()
         data = response.json()
 
         prices: dict[str, ProductPrice] = {}
         for item in data:
-            # Extract original product ID (remove suffix like -000, -001, etc.)
-            full_id = item.get("Id", "")
-            product_id = full_id.rsplit("-", 1)[0] if "-" in full_id else full_id
-
-            # Skip if we already have this product (API may return variants)
-            if product_id in prices:
-                continue
+            # Variants of a product share its ID with another suffix (-000, -001, etc.)
+            item_id = item.get("Id", "")
+            product_id = item_id.rsplit("-", 1)[0] if "-" in item_id else item_id
 
             price_info = item.get("Price", {})
             # Price.Low is the promotional price (may be null)
@@ -134,13 +459,23 @@ class PChomeAPI:
 
             # Use promotional price if available, otherwise use regular price
             current_price = promo_price if promo_price else regular_price
-            original_price = regular_price
+            if not current_price:
+                continue
+            current_price = int(current_price)
 
-            if current_price:
+            product_price = prices.get(product_id)
+            if product_price is None:
                 prices[product_id] = ProductPrice(
                     product_id=product_id,
-                    price=int(current_price),
-                    original_price=int(original_price),
+                    price=current_price,
+                    original_price=int(regular_price),
+                    variants={item_id: current_price},
                 )
+                continue
+            # Group the variant with its product, which is priced at its cheapest one
+            product_price.variants[item_id] = current_price
+            if current_price < product_price.price:
+                product_price.price = current_price
+                product_price.original_price = int(regular_price)
 
         return prices
@@ -1,10 +1,102 @@
 """Configuration module for loading environment variables."""
 
 import os
-from dataclasses import dataclass
+import re
+from dataclasses import dataclass, field
 from pathlib import Path
 
-from dotenv import load_dotenv
+from api import DEFAULT_MAX_CONCURRENCY, DEFAULT_PRICE_CHUNK_SIZE
+from db import HISTORY_MODE_APPEND, HISTORY_MODES, VACUUM_INCREMENTAL, VACUUM_MODES
+from dispatcher import DEFAULT_CHANNEL_CONCURRENCY, DEFAULT_DIGEST_THRESHOLD
+from governor import DEFAULT_MAX_ATTEMPTS
+
+
+def _get_int_env(name: str, default: int) -> int:
+    """Read a positive integer from an environment variable."""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        parsed = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {value!r}") from None
+    if parsed < 1:
+        raise ValueError(f"{name} must be at least 1, got {parsed}")
+    return parsed
+
+
+def _get_non_negative_int_env(name: str, default: int) -> int:
+    """Read a non-negative integer, where 0 disables a feature."""
+    value = os.getenv(name)
+    if value is not None and value.strip() == "0":
+        return 0
+    return _get_int_env(name, default)
+
+
+def _get_bool_env(name: str, default: bool) -> bool:
+    """Read a boolean flag from an environment variable."""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _get_choice_env(name: str, choices: tuple[str, ...], default: str) -> str:
+    """Read one of a fixed set of values from an environment variable."""
+    value = os.getenv(name) or default
+    if value not in choices:
+        raise ValueError(f"{name} must be one of {', '.join(choices)}, got {value!r}")
+    return value
+
+
+@dataclass
+class Account:
+    """A PChome account and the destinations its alerts are sent to.
+
+    Account 1 is configured by the unnumbered variables; account N by the
+    same variables with an ``_N`` suffix (e.g. ``PCHOME_ECWEBSESS_2``).
+    """
+
+    index: int
+    ecwebsess: str
+    slack_webhook_url: str | None
+    telegram_bot_token: str | None
+    telegram_chat_id: str | None
+
+    @property
+    def env_suffix(self) -> str:
+        """Suffix of this account's environment variables."""
+        return "" if self.index == 1 else f"_{self.index}"
+
+    @property
+    def session_variable(self) -> str:
+        """Name of the variable holding this account's session cookie."""
+        return f"PCHOME_ECWEBSESS{self.env_suffix}"
+
+    def channel_name(self, channel: str) -> str:
+        """Outbox channel name of one of this account's destinations."""
+        return channel if self.index == 1 else f"{channel}-{self.index}"
+
+
+def _load_additional_accounts() -> list[Account]:
+    """Read accounts 2, 3, ... until a PCHOME_ECWEBSESS_N is missing."""
+    accounts: list[Account] = []
+    index = 2
+    while ecwebsess := os.getenv(f"PCHOME_ECWEBSESS_{index}"):
+        accounts.append(
+            Account(
+                index=index,
+                ecwebsess=ecwebsess,
+                slack_webhook_url=os.getenv(f"SLACK_WEBHOOK_URL_{index}"),
+                # A single bot can serve every account's chat
+                telegram_bot_token=(
+                    os.getenv(f"TELEGRAM_BOT_TOKEN_{index}") or os.getenv("TELEGRAM_BOT_TOKEN")
+                ),
+                telegram_chat_id=os.getenv(f"TELEGRAM_CHAT_ID_{index}"),
+            )
+        )
+        index += 1
+    return accounts
 
 
 @dataclass
@@ -16,25 +108,131 @@ class Config:
     telegram_bot_token: str | None
     telegram_chat_id: str | None
     db_path: Path
+    tracking_cache_path: Path | None = None
+    tracking_list_ttl_minutes: int = 24 * 60
+    price_chunk_size: int = DEFAULT_PRICE_CHUNK_SIZE
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    write_batch_size: int = 500
+    history_mode: str = HISTORY_MODE_APPEND
+    history_compaction: bool = False
+    history_full_resolution_days: int = 30
+    history_daily_resolution_days: int = 365
+    history_vacuum: str = VACUUM_INCREMENTAL
+    notify_concurrency: int = DEFAULT_CHANNEL_CONCURRENCY
+    digest_threshold: int = DEFAULT_DIGEST_THRESHOLD
+    # None uses the public Bot API
+    telegram_api_base: str | None = None
+    daemon_min_interval_minutes: int = 10
+    daemon_max_interval_minutes: int = 360
+    daemon_requests_per_minute: int = 6
+    daemon_refresh_minutes: int = 60
+    additional_accounts: list[Account] = field(default_factory=list)
+    metrics_textfile: Path | None = None
+    metrics_pushgateway_url: str | None = None
+    metrics_json_logs: bool = False
+    # Directory PChome responses are recorded to for replay, None disables
+    recordings_dir: Path | None = None
+    # Sharded runs: number of shards (1 disables sharding), this process's
+    # 0-based shard, and an ID shared by the shards of one run
+    shard_count: int = 1
+    shard_index: int = 0
+    shard_run_id: str = ""
+
+    @property
+    def accounts(self) -> list[Account]:
+        """Every configured account, starting with the primary one."""
+        primary = Account(
+            index=1,
+            ecwebsess=self.pchome_ecwebsess,
+            slack_webhook_url=self.slack_webhook_url,
+            telegram_bot_token=self.telegram_bot_token,
+            telegram_chat_id=self.telegram_chat_id,
+        )
+        return [primary, *self.additional_accounts]
+
+    @property
+    def shard_dir(self) -> Path:
+        """Directory of the shard files of sharded runs, next to the database."""
+        return self.db_path.parent / "shards"
 
     @classmethod
-    def load(cls) -> "Config":
-        """Load configuration from environment variables."""
-        # Load .env file from project root
+    def load(cls, require_session: bool = True) -> "Config":
+        """Load configuration from environment variables.
+
+        Replays don't talk to PChome, so they pass ``require_session=False``.
+        """
+        # Load .env file from project root; containers pass the environment
+        # directly, so python-dotenv is only imported when there is a file
         project_root = Path(__file__).parent.parent
-        load_dotenv(project_root / ".env")
+        env_file = project_root / ".env"
+        if env_file.exists():
+            from dotenv import load_dotenv
+
+            load_dotenv(env_file)
 
         ecwebsess = os.getenv("PCHOME_ECWEBSESS")
-        if not ecwebsess:
+        if not ecwebsess and require_session:
             raise ValueError(
                 "PCHOME_ECWEBSESS environment variable is required. "
                 "See docs/COOKIE_GUIDE.md for instructions."
             )
 
+        metrics_textfile = os.getenv("METRICS_TEXTFILE")
+
+        # An Indexed Job tells each pod its shard in JOB_COMPLETION_INDEX
+        shard_count = _get_int_env("SHARD_COUNT", 1)
+        shard_index = _get_non_negative_int_env(
+            "SHARD_INDEX" if os.getenv("SHARD_INDEX") else "JOB_COMPLETION_INDEX", 0
+        )
+        if shard_index >= shard_count:
+            raise ValueError(f"Shard index {shard_index} is out of range for {shard_count} shards")
+        # Names the run's shard files, so it must tell runs apart and be safe in a file name
+        shard_run_id = os.getenv("SHARD_RUN_ID", "")
+        if shard_count > 1 and not re.fullmatch(r"[A-Za-z0-9._-]+", shard_run_id):
+            raise ValueError(
+                "SHARD_RUN_ID must be set to an ID of letters, digits, '.', '_' or '-' "
+                "shared by the shards of one run"
+            )
+
         return cls(
-            pchome_ecwebsess=ecwebsess,
+            pchome_ecwebsess=ecwebsess or "",
             slack_webhook_url=os.getenv("SLACK_WEBHOOK_URL"),
             telegram_bot_token=os.getenv("TELEGRAM_BOT_TOKEN"),
             telegram_chat_id=os.getenv("TELEGRAM_CHAT_ID"),
             db_path=project_root / "db" / "prices.db",
+            tracking_cache_path=project_root / "db" / "tracking_list.jsonl",
+            tracking_list_ttl_minutes=_get_non_negative_int_env(
+                "TRACKING_LIST_TTL_MINUTES", 24 * 60
+            ),
+            price_chunk_size=_get_int_env("PCHOME_PRICE_CHUNK_SIZE", DEFAULT_PRICE_CHUNK_SIZE),
+            max_concurrency=_get_int_env("PCHOME_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY),
+            max_attempts=_get_int_env("PCHOME_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS),
+            write_batch_size=_get_int_env("PIPELINE_WRITE_BATCH_SIZE", 500),
+            history_mode=_get_choice_env("PRICE_HISTORY_MODE", HISTORY_MODES, HISTORY_MODE_APPEND),
+            history_compaction=_get_bool_env("HISTORY_COMPACTION", False),
+            history_full_resolution_days=_get_int_env("HISTORY_FULL_RESOLUTION_DAYS", 30),
+            history_daily_resolution_days=_get_int_env("HISTORY_DAILY_RESOLUTION_DAYS", 365),
+            history_vacuum=_get_choice_env("HISTORY_VACUUM", VACUUM_MODES, VACUUM_INCREMENTAL),
+            notify_concurrency=_get_int_env("NOTIFY_CONCURRENCY", DEFAULT_CHANNEL_CONCURRENCY),
+            digest_threshold=_get_non_negative_int_env(
+                "NOTIFY_DIGEST_THRESHOLD", DEFAULT_DIGEST_THRESHOLD
+            ),
+            telegram_api_base=os.getenv("TELEGRAM_API_BASE") or None,
+            daemon_min_interval_minutes=_get_int_env("DAEMON_MIN_INTERVAL_MINUTES", 10),
+            daemon_max_interval_minutes=_get_int_env("DAEMON_MAX_INTERVAL_MINUTES", 360),
+            daemon_requests_per_minute=_get_int_env("DAEMON_REQUESTS_PER_MINUTE", 6),
+            daemon_refresh_minutes=_get_int_env("DAEMON_REFRESH_MINUTES", 60),
+            additional_accounts=_load_additional_accounts(),
+            metrics_textfile=Path(metrics_textfile) if metrics_textfile else None,
+            metrics_pushgateway_url=os.getenv("METRICS_PUSHGATEWAY_URL") or None,
+            metrics_json_logs=_get_bool_env("METRICS_JSON_LOGS", False),
+            recordings_dir=(
+                project_root / "db" / "recordings"
+                if _get_bool_env("RECORD_RESPONSES", False)
+                else None
+            ),
+            shard_count=shard_count,
+            shard_index=shard_index,
+            shard_run_id=shard_run_id,
         )
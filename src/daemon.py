@@ -0,0 +1,236 @@
+"""Long-running mode that polls prices on an adaptive per-product schedule."""
+
+import heapq
+import signal
+import threading
+import time
+from contextlib import ExitStack
+from datetime import datetime
+
+import httpx
+
+from api import TrackedProduct
+from config import Config
+from db import PriceDatabase
+from dispatcher import NotificationDispatcher, Notifier
+from ratelimit import TokenBucket
+from tracker import (
+    AccountClient,
+    analyze_prices,
+    deliver_notifications,
+    fetch_tracking_lists,
+    open_account_clients,
+    sync_products,
+)
+
+
+class AdaptiveScheduler:
+    """Priority queue of per-product price checks.
+
+    Every product has its own polling interval between ``min_interval`` and
+    ``max_interval`` seconds. The interval halves when a check sees the price
+    move and grows by half when it does not, so volatile products are polled
+    often and stable ones rarely.
+    """
+
+    def __init__(self, min_interval: float, max_interval: float) -> None:
+        """Initialize an empty schedule."""
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self._heap: list[tuple[float, str]] = []
+        self._due: dict[str, float] = {}
+        self._interval: dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def sync(self, product_ids: set[str], now: float) -> None:
+        """Schedule new products immediately and forget removed ones."""
+        for product_id in product_ids - self._due.keys():
+            self._interval[product_id] = self.min_interval
+            self._push(product_id, now)
+        for product_id in self._due.keys() - product_ids:
+            # Stale heap entries are skipped when popped
+            del self._due[product_id]
+            del self._interval[product_id]
+
+    def next_due(self) -> float | None:
+        """Time of the earliest scheduled check, if any."""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float, limit: int) -> list[str]:
+        """Remove and return up to ``limit`` products whose check is due."""
+        due: list[str] = []
+        while len(due) < limit:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            _, product_id = heapq.heappop(self._heap)
+            del self._due[product_id]
+            due.append(product_id)
+        return due
+
+    def reschedule(self, product_id: str, changed: bool, now: float) -> None:
+        """Schedule a product's next check based on whether its price moved."""
+        if product_id not in self._interval:
+            return
+        interval = self._interval[product_id]
+        interval = interval / 2 if changed else interval * 1.5
+        interval = min(self.max_interval, max(self.min_interval, interval))
+        self._interval[product_id] = interval
+        self._push(product_id, now + interval)
+
+    def _push(self, product_id: str, due: float) -> None:
+        self._due[product_id] = due
+        heapq.heappush(self._heap, (due, product_id))
+
+    def _drop_stale(self) -> None:
+        """Discard heap entries that were rescheduled or removed."""
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+
+class PriceDaemon:
+    """Keeps the API client and database open and polls prices continuously."""
+
+    def __init__(
+        self,
+        config: Config,
+        clients: list[AccountClient],
+        db: PriceDatabase,
+        dispatcher: NotificationDispatcher,
+    ) -> None:
+        """Initialize the daemon with already-open components."""
+        self.config = config
+        self.clients = clients
+        # Prices are public, so one account fetches them for all
+        self.api = clients[0].api
+        self.db = db
+        self.dispatcher = dispatcher
+        self.scheduler = AdaptiveScheduler(
+            min_interval=config.daemon_min_interval_minutes * 60,
+            max_interval=config.daemon_max_interval_minutes * 60,
+        )
+        self.products: dict[str, TrackedProduct] = {}
+        self.product_channels: dict[str, list[str]] = {}
+        self._next_refresh = 0.0
+        self._stop = threading.Event()
+
+    def stop(self, *args: object) -> None:
+        """Ask the main loop to exit after the current step."""
+        self._stop.set()
+
+    def run(self) -> None:
+        """Poll until stopped by ``stop()`` or SIGTERM/SIGINT."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= self._next_refresh:
+                self._refresh_tracking_list(now)
+                continue
+
+            due = self.scheduler.pop_due(now, self.config.price_chunk_size)
+            if due:
+                self._check_prices(due)
+                continue
+
+            next_due = self.scheduler.next_due()
+            wake_at = self._next_refresh if next_due is None else min(next_due, self._next_refresh)
+            self._stop.wait(max(0.0, wake_at - now))
+
+        print("👋 Daemon stopped")
+
+    def _refresh_tracking_list(self, now: float) -> None:
+        """Re-sync the tracking list and retry any undelivered alerts."""
+        print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] 📥 Refreshing tracking list...")
+        try:
+            tracking = fetch_tracking_lists(self.clients)
+        except httpx.HTTPError as e:
+            print(f"   ⚠️  Failed to refresh tracking list: {e}")
+            self._next_refresh = now + self.scheduler.min_interval
+            return
+        # An empty list more likely means a PChome hiccup than an emptied list
+        if not tracking.products:
+            print("   ⚠️  Tracking list came back empty; keeping the current products")
+            self._next_refresh = now + self.scheduler.min_interval
+            return
+
+        sync_products(self.db, tracking.products)
+        self.products = {p.id: p for p in tracking.products}
+        self.product_channels = tracking.product_channels
+        self.scheduler.sync(set(self.products), now)
+        self._next_refresh = now + self.config.daemon_refresh_minutes * 60
+        print(f"   Tracking {len(self.products)} products\n")
+
+        deliver_notifications(self.db, self.dispatcher)
+
+    def _check_prices(self, product_ids: list[str]) -> None:
+        """Fetch, analyze and record prices for one batch of due products."""
+        prices = self.api.get_prices(product_ids)
+        stats = self.db.get_product_stats(product_ids)
+        products = [self.products[pid] for pid in product_ids if pid in self.products]
+
+        matches = self.db.evaluate_alert_rules(
+            {product_id: price.price for product_id, price in prices.items()}
+        )
+        baselines = self.db.get_products_without_variant_history(
+            [product_id for product_id, price in prices.items() if len(price.variants) > 1]
+        )
+        analysis = analyze_prices(
+            products, prices, stats, matches, verbose=False, variant_baselines=baselines
+        )
+        self.db.record_prices(
+            analysis.observed_prices,
+            analysis.alerts,
+            product_channels=self.product_channels,
+            variant_prices=analysis.observed_variants,
+        )
+
+        now = time.monotonic()
+        for product_id in product_ids:
+            price_info = prices.get(product_id)
+            previous = stats.get(product_id)
+            changed = (
+                price_info is not None
+                and previous is not None
+                and price_info.price != previous.latest_price
+            )
+            self.scheduler.reschedule(product_id, changed, now)
+
+        print(
+            f"[{datetime.now():%Y-%m-%d %H:%M:%S}] 💰 Checked {len(product_ids)} products, "
+            f"{len(prices)} prices, {analysis.new_lows} new lows"
+        )
+        if analysis.alerts:
+            deliver_notifications(self.db, self.dispatcher)
+
+
+def run_daemon(
+    config: Config,
+    notifiers: list[Notifier],
+    account_channels: dict[int, list[str]],
+) -> int:
+    """Run the tracker as a long-lived process."""
+    print("🔁 Daemon mode")
+    print(
+        f"   Poll interval: {config.daemon_min_interval_minutes}-"
+        f"{config.daemon_max_interval_minutes} min per product"
+    )
+    print(f"   Request budget: {config.daemon_requests_per_minute} requests/min\n")
+
+    rate_limiter = TokenBucket(rate=config.daemon_requests_per_minute / 60)
+    with (
+        ExitStack() as stack,
+        PriceDatabase(config.db_path, history_mode=config.history_mode) as db,
+        NotificationDispatcher(
+            notifiers,
+            channel_concurrency=config.notify_concurrency,
+            digest_threshold=config.digest_threshold,
+        ) as dispatcher,
+    ):
+        clients = open_account_clients(stack, config, account_channels, rate_limiter)
+        PriceDaemon(config, clients, db, dispatcher).run()
+    return 0
@@ -1,10 +1,43 @@
 """Database module for managing price history with SQLite."""
 
+import json
 import sqlite3
-from dataclasses import dataclass
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
 
+from alerts import (
+    RULE_KINDS,
+    RULE_NEW_LOW,
+    RULE_PERCENT_DROP,
+    RULE_TARGET_PRICE,
+    RULE_WINDOW_LOW,
+    PriceDropAlert,
+)
+
+# History storage modes: append a row on every run, or only when the price changes
+HISTORY_MODE_APPEND = "append"
+HISTORY_MODE_CHANGE_ONLY = "change_only"
+HISTORY_MODES = (HISTORY_MODE_APPEND, HISTORY_MODE_CHANGE_ONLY)
+
+# Space reclamation after compaction
+VACUUM_NONE = "none"
+VACUUM_INCREMENTAL = "incremental"
+VACUUM_FULL = "full"
+VACUUM_MODES = (VACUUM_NONE, VACUUM_INCREMENTAL, VACUUM_FULL)
+
+# Price histories kept by compaction and collapse: (history table, rollup
+# table, columns identifying one price series)
+HISTORY_TABLES = (
+    ("price_history", "price_rollups", "product_id"),
+    ("variant_price_history", "variant_price_rollups", "product_id, variant_id"),
+)
+
+# Connection tuning, sized for the CronJob's 128Mi memory limit
+CACHE_SIZE_KIB = 8 * 1024
+MMAP_SIZE_BYTES = 32 * 1024 * 1024
+
 
 @dataclass
 class PriceRecord:
@@ -13,19 +46,107 @@ class PriceRecord:
     product_id: str
     price: int
     recorded_at: datetime
+    last_seen_at: datetime
+
+
+@dataclass
+class ProductStats:
+    """Summary of a product's price history."""
+
+    product_id: str
+    low_price: int
+    latest_price: int
+    last_changed_at: datetime
+    sample_count: int
+
+
+@dataclass
+class CompactionResult:
+    """Outcome of a price history compaction."""
+
+    history_rows_removed: int = 0
+    daily_rows_removed: int = 0
+    batches: int = 0
+
+
+@dataclass
+class ProductSync:
+    """Products added, revived and soft-deleted by a tracking list sync."""
+
+    added: list[str] = field(default_factory=list)
+    # Soft-deleted products tracked again, with their history intact
+    revived: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+
+
+@dataclass
+class AlertRule:
+    """A stored alert rule.
+
+    A rule without ``product_id`` applies to every product, unless the
+    product has a rule of the same kind of its own, which overrides it even
+    when disabled.
+    """
+
+    id: int
+    kind: str
+    product_id: str | None
+    # Target price for target_price rules, percentage for percent_drop rules
+    threshold: int | None
+    # Days of history for percent_drop and window_low rules
+    window_days: int | None
+    enabled: bool
+
+
+@dataclass
+class RuleMatch:
+    """The alert rule a fetched price satisfied, with the price it was compared to."""
+
+    product_id: str
+    rule_id: int
+    kind: str
+    current_price: int
+    # All-time low, target price, N-day average or N-day low, by kind
+    reference_price: int
+    historical_low: int | None
+    threshold: int | None
+    window_days: int | None
+    # When the product's previous price started, None for a first price
+    previous_changed_at: str | None = None
+
+
+@dataclass
+class OutboxEntry:
+    """A notification waiting in the outbox for delivery on one channel."""
+
+    id: int
+    idempotency_key: str
+    channel: str
+    alert: PriceDropAlert
+    attempts: int
 
 
 class PriceDatabase:
     """SQLite database for tracking product prices."""
 
-    def __init__(self, db_path: Path) -> None:
-        """Initialize the database connection."""
+    def __init__(self, db_path: Path, history_mode: str = HISTORY_MODE_APPEND) -> None:
+        """Initialize the database connection.
+
+        In ``change_only`` history mode a new price_history row is written only
+        when a product's price changes; otherwise the current row's
+        ``last_seen_at`` is extended.
+        """
+        if history_mode not in HISTORY_MODES:
+            raise ValueError(f"Unknown history mode: {history_mode}")
+
         # Ensure parent directory exists
         db_path.parent.mkdir(parents=True, exist_ok=True)
 
         self.db_path = db_path
+        self.history_mode = history_mode
         self.conn = sqlite3.connect(db_path)
         self.conn.row_factory = sqlite3.Row
+        self._configure_connection()
         self._init_tables()
 
     def __enter__(self) -> "PriceDatabase":
@@ -38,10 +159,56 @@ class PriceDatabase:
         """Close the database connection."""
         self.conn.close()
 
+    def _configure_connection(self) -> None:
+        """Apply per-connection performance settings."""
+        cursor = self.conn.cursor()
+        # Only takes effect on new databases (or after a full VACUUM)
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # WAL is persistent; the remaining pragmas apply to this connection only
+        cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.execute("PRAGMA synchronous = NORMAL")
+        cursor.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+        cursor.execute(f"PRAGMA mmap_size = {MMAP_SIZE_BYTES}")
+
     def _init_tables(self) -> None:
-        """Initialize database tables."""
+        """Bring the schema up to date by applying pending migrations.
+
+        The applied schema version is stored in ``PRAGMA user_version``. Each
+        migration runs in its own transaction together with the version bump,
+        so a failed step leaves the database at the previous version.
+        """
+        migrations = [
+            self._migrate_initial_schema,
+            self._migrate_price_rollups,
+            self._migrate_product_stats,
+            self._migrate_price_history_covering_index,
+            self._migrate_notification_outbox,
+            self._migrate_product_soft_delete,
+            self._migrate_alert_rules,
+            self._migrate_variant_price_history,
+            self._migrate_variant_price_rollups,
+        ]
+
         cursor = self.conn.cursor()
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+
+        for number, migration in enumerate(migrations[version:], start=version + 1):
+            cursor.execute("BEGIN")
+            try:
+                migration(cursor)
+                cursor.execute(f"PRAGMA user_version = {number}")
+            except Exception:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+
+    def _migrate_initial_schema(self, cursor: sqlite3.Cursor) -> None:
+        """Create the products and price_history tables.
 
+        Uses IF NOT EXISTS because databases created before versioning
+        already have these tables at ``user_version`` 0.
+        """
         # Products table
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS products (
@@ -59,43 +226,306 @@ class PriceDatabase:
                 product_id TEXT NOT NULL,
                 price INTEGER NOT NULL,
                 recorded_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                last_seen_at DATETIME,
                 FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
             )
         """)
 
+        # Databases created before change-only storage lack last_seen_at
+        cursor.execute("PRAGMA table_info(price_history)")
+        if "last_seen_at" not in {row["name"] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE price_history ADD COLUMN last_seen_at DATETIME")
+
         # Index for faster queries
         cursor.execute("""
             CREATE INDEX IF NOT EXISTS idx_price_history_product_id
             ON price_history(product_id)
         """)
 
-        self.conn.commit()
+    def _migrate_price_rollups(self, cursor: sqlite3.Cursor) -> None:
+        """Add the table holding downsampled price history."""
+        # Downsampled history: daily and weekly min/max/close per product
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS price_rollups (
+                product_id TEXT NOT NULL,
+                resolution TEXT NOT NULL CHECK (resolution IN ('day', 'week')),
+                bucket_start DATE NOT NULL,
+                min_price INTEGER NOT NULL,
+                max_price INTEGER NOT NULL,
+                close_price INTEGER NOT NULL,
+                sample_count INTEGER NOT NULL,
+                PRIMARY KEY (product_id, resolution, bucket_start),
+                FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+            )
+        """)
+
+    def _migrate_product_stats(self, cursor: sqlite3.Cursor) -> None:
+        """Add the per-product summary and backfill it from price_history."""
+        # Per-product summary, maintained alongside price_history writes
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS product_stats (
+                product_id TEXT PRIMARY KEY,
+                low_price INTEGER NOT NULL,
+                latest_price INTEGER NOT NULL,
+                last_changed_at DATETIME NOT NULL,
+                sample_count INTEGER NOT NULL,
+                FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+            )
+        """)
+
+        # Backfill the summary for databases created before it existed
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM product_stats) AS has_stats")
+        has_stats = cursor.fetchone()["has_stats"]
+        if not has_stats:
+            self._rebuild_product_stats(cursor)
+
+    def _migrate_price_history_covering_index(self, cursor: sqlite3.Cursor) -> None:
+        """Replace the product_id index with a time-ordered covering index.
+
+        Latest-price and history lookups read rows in index order instead of
+        sorting a product's whole history, and MIN(price) never touches the
+        table. The old index is a prefix of the new one, so it is dropped.
+        """
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_price_history_product_recorded
+            ON price_history(product_id, recorded_at DESC, price)
+        """)
+        cursor.execute("DROP INDEX IF EXISTS idx_price_history_product_id")
+
+    def _migrate_notification_outbox(self, cursor: sqlite3.Cursor) -> None:
+        """Add the outbox that decouples alert delivery from price recording."""
+        cursor.execute("""
+            CREATE TABLE notification_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                channel TEXT NOT NULL,
+                product_id TEXT NOT NULL,
+                product_name TEXT NOT NULL,
+                current_price INTEGER NOT NULL,
+                historical_low INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending'
+                    CHECK (status IN ('pending', 'sent', 'dead')),
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                last_error TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                sent_at DATETIME
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX idx_notification_outbox_pending
+            ON notification_outbox(status, next_attempt_at)
+        """)
+
+    def _migrate_product_soft_delete(self, cursor: sqlite3.Cursor) -> None:
+        """Mark untracked products as deleted instead of dropping their history."""
+        cursor.execute("ALTER TABLE products ADD COLUMN deleted_at DATETIME")
+
+    def _migrate_alert_rules(self, cursor: sqlite3.Cursor) -> None:
+        """Store alert rules in the database, starting with the historical low rule."""
+        cursor.execute("""
+            CREATE TABLE alert_rules (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL
+                    CHECK (kind IN ('new_low', 'target_price', 'percent_drop', 'window_low')),
+                product_id TEXT,
+                threshold INTEGER CHECK (threshold > 0),
+                window_days INTEGER CHECK (window_days > 0),
+                enabled INTEGER NOT NULL DEFAULT 1,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                CHECK (kind != 'target_price' OR threshold IS NOT NULL),
+                CHECK (kind != 'percent_drop' OR (threshold < 100 AND window_days IS NOT NULL)),
+                CHECK (kind != 'window_low' OR window_days IS NOT NULL),
+                FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+            )
+        """)
+        cursor.execute("CREATE INDEX idx_alert_rules_product ON alert_rules(product_id, kind)")
+        # The rule every product had before rules were configurable
+        cursor.execute("INSERT INTO alert_rules (kind) VALUES ('new_low')")
+        # Alerts of other rules are delivered with their kind and reason
+        cursor.execute(
+            "ALTER TABLE notification_outbox ADD COLUMN rule TEXT NOT NULL DEFAULT 'new_low'"
+        )
+        cursor.execute("ALTER TABLE notification_outbox ADD COLUMN reason TEXT")
+
+    def _migrate_variant_price_history(self, cursor: sqlite3.Cursor) -> None:
+        """Add the price history of each variant of products sold in several."""
+        cursor.execute("""
+            CREATE TABLE variant_price_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                product_id TEXT NOT NULL,
+                variant_id TEXT NOT NULL,
+                price INTEGER NOT NULL,
+                recorded_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                last_seen_at DATETIME,
+                FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX idx_variant_price_history_variant
+            ON variant_price_history(product_id, variant_id, recorded_at DESC, price)
+        """)
+
+    def _migrate_variant_price_rollups(self, cursor: sqlite3.Cursor) -> None:
+        """Add the downsampled price history of each variant."""
+        cursor.execute("""
+            CREATE TABLE variant_price_rollups (
+                product_id TEXT NOT NULL,
+                variant_id TEXT NOT NULL,
+                resolution TEXT NOT NULL CHECK (resolution IN ('day', 'week')),
+                bucket_start DATE NOT NULL,
+                min_price INTEGER NOT NULL,
+                max_price INTEGER NOT NULL,
+                close_price INTEGER NOT NULL,
+                sample_count INTEGER NOT NULL,
+                PRIMARY KEY (product_id, variant_id, resolution, bucket_start),
+                FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+            )
+        """)
 
     def get_tracked_product_ids(self) -> set[str]:
-        """Get all product IDs currently in the database."""
+        """Get the IDs of all products that are currently tracked."""
         cursor = self.conn.cursor()
-        cursor.execute("SELECT id FROM products")
+        cursor.execute("SELECT id FROM products WHERE deleted_at IS NULL")
         return {row["id"] for row in cursor.fetchall()}
 
     def add_product(self, product_id: str, name: str) -> None:
-        """Add a new product to the database."""
+        """Add a product to the database, reviving it if it was removed."""
+        self._upsert_products(self.conn.cursor(), json.dumps([(product_id, name)]))
+        self.conn.commit()
+
+    def remove_product(self, product_id: str) -> None:
+        """Soft-delete a product, keeping its price history for a later revival."""
         cursor = self.conn.cursor()
         cursor.execute(
             """
-            INSERT OR REPLACE INTO products (id, name, updated_at)
-            VALUES (?, ?, CURRENT_TIMESTAMP)
+            UPDATE products SET deleted_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND deleted_at IS NULL
             """,
-            (product_id, name),
+            (product_id,),
         )
         self.conn.commit()
 
-    def remove_product(self, product_id: str) -> None:
-        """Remove a product and its price history from the database."""
+    def sync_products(self, products: Sequence[tuple[str, str]]) -> ProductSync:
+        """Sync the products table with the complete tracking list in one transaction.
+
+        ``products`` are ``(id, name)`` pairs. New products are added,
+        removed ones that are tracked again are revived, and products no
+        longer tracked are soft-deleted, using the same few statements
+        however long the list is.
+        """
         cursor = self.conn.cursor()
-        # Delete price history first (foreign key)
-        cursor.execute("DELETE FROM price_history WHERE product_id = ?", (product_id,))
-        cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
+        self._reset_synced_products(cursor)
+        result = self._stage_products(cursor, products)
+        result.removed = self._soft_delete_unsynced(cursor)
         self.conn.commit()
+        return result
+
+    def start_product_sync(self) -> None:
+        """Start syncing a tracking list that arrives in batches.
+
+        Each batch is passed to ``stage_products()``, then
+        ``finish_product_sync()`` soft-deletes the products that were in none
+        of them. The IDs staged so far are kept in a temporary table rather
+        than in memory.
+        """
+        self._reset_synced_products(self.conn.cursor())
+        self.conn.commit()
+
+    def stage_products(self, products: Sequence[tuple[str, str]]) -> ProductSync:
+        """Add and revive the products of one batch in a single transaction.
+
+        Returns the IDs of the products added and revived.
+        """
+        result = self._stage_products(self.conn.cursor(), products)
+        self.conn.commit()
+        return result
+
+    def finish_product_sync(self) -> list[str]:
+        """Soft-delete the tracked products missing from every staged batch.
+
+        Returns the IDs of the removed products.
+        """
+        removed = self._soft_delete_unsynced(self.conn.cursor())
+        self.conn.commit()
+        return removed
+
+    def get_synced_products(self, product_ids: Sequence[str]) -> set[str]:
+        """Get the products among ``product_ids`` already staged in the current sync."""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            """
+            SELECT id FROM temp.synced_products
+            WHERE id IN (SELECT value FROM json_each(?))
+            """,
+            (json.dumps(list(product_ids)),),
+        )
+        return {row["id"] for row in cursor.fetchall()}
+
+    def _reset_synced_products(self, cursor: sqlite3.Cursor) -> None:
+        """Create or empty the temporary table of the IDs seen by a sync."""
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS synced_products (id TEXT PRIMARY KEY)")
+        cursor.execute("DELETE FROM temp.synced_products")
+
+    def _stage_products(
+        self, cursor: sqlite3.Cursor, products: Sequence[tuple[str, str]]
+    ) -> ProductSync:
+        """Note a batch's IDs as seen and upsert its products without committing."""
+        if not products:
+            return ProductSync()
+        batch = json.dumps(products, ensure_ascii=False)
+        cursor.execute(
+            """
+            INSERT OR IGNORE INTO temp.synced_products (id)
+            SELECT value ->> 0 FROM json_each(?)
+            """,
+            (batch,),
+        )
+        return self._upsert_products(cursor, batch)
+
+    def _upsert_products(self, cursor: sqlite3.Cursor, batch: str) -> ProductSync:
+        """Add new and revive soft-deleted products from a JSON list of (id, name).
+
+        A revived product keeps its price history and so its historical low.
+        Tracked products are only written when their name changed.
+        """
+        result = ProductSync()
+        cursor.execute(
+            """
+            SELECT batch.value ->> 0 AS id, products.id IS NULL AS is_new
+            FROM json_each(?) AS batch
+            LEFT JOIN products ON products.id = batch.value ->> 0
+            WHERE products.id IS NULL OR products.deleted_at IS NOT NULL
+            """,
+            (batch,),
+        )
+        for row in cursor.fetchall():
+            (result.added if row["is_new"] else result.revived).append(row["id"])
+        cursor.execute(
+            """
+            INSERT INTO products (id, name, updated_at)
+            SELECT value ->> 0, value ->> 1, CURRENT_TIMESTAMP FROM json_each(?) WHERE true
+            ON CONFLICT (id) DO UPDATE SET
+                name = excluded.name,
+                updated_at = excluded.updated_at,
+                deleted_at = NULL
+            WHERE products.deleted_at IS NOT NULL OR products.name IS NOT excluded.name
+            """,
+            (batch,),
+        )
+        return result
+
+    def _soft_delete_unsynced(self, cursor: sqlite3.Cursor) -> list[str]:
+        """Soft-delete tracked products whose IDs no sync batch contained."""
+        cursor.execute("""
+            UPDATE products SET deleted_at = CURRENT_TIMESTAMP
+            WHERE deleted_at IS NULL
+              AND id NOT IN (SELECT id FROM temp.synced_products)
+            RETURNING id
+        """)
+        removed = [row["id"] for row in cursor.fetchall()]
+        cursor.execute("DELETE FROM temp.synced_products")
+        return removed
 
     def get_historical_low(self, product_id: str) -> int | None:
         """Get the historical lowest price for a product."""
@@ -103,8 +533,11 @@ class PriceDatabase:
         cursor.execute(
             """
             SELECT MIN(price) as min_price
-            FROM price_history
-            WHERE product_id = ?
+            FROM (
+                SELECT MIN(price) AS price FROM price_history WHERE product_id = ?1
+                UNION ALL
+                SELECT MIN(min_price) FROM price_rollups WHERE product_id = ?1
+            )
             """,
             (product_id,),
         )
@@ -129,30 +562,712 @@ class PriceDatabase:
 
     def record_price(self, product_id: str, price: int) -> None:
         """Record a new price for a product."""
+        self.record_prices([(product_id, price)])
+
+    def record_prices(
+        self,
+        prices: list[tuple[str, int]],
+        alerts: Sequence[PriceDropAlert] = (),
+        channels: Sequence[str] = (),
+        product_channels: Mapping[str, Sequence[str]] | None = None,
+        observed_at: str | None = None,
+        variant_prices: Sequence[tuple[str, str, int]] = (),
+    ) -> None:
+        """Record new prices for many products in a single transaction.
+
+        ``variant_prices`` are ``(product_id, variant_id, price)`` rows of
+        products sold in several variants, kept in ``variant_price_history``
+        alongside the product's price, which is its cheapest variant's.
+
+        Each alert is enqueued in the notification outbox once per channel in
+        the same transaction, so a recorded new low always has its alerts.
+        With ``product_channels``, an alert goes only to the channels listed
+        for its product instead of to every channel in ``channels``.
+
+        Prices are timestamped now, or at ``observed_at`` (UTC, in SQLite's
+        ``YYYY-MM-DD HH:MM:SS`` format) when replaying a recorded run.
+        """
+        if not prices and not alerts:
+            return
+
         cursor = self.conn.cursor()
-        cursor.execute(
+
+        inserts = prices
+        extends: list[str] = []
+        if self.history_mode == HISTORY_MODE_CHANGE_ONLY:
+            cursor.execute(
+                """
+                SELECT product_id, latest_price FROM product_stats
+                WHERE product_id IN (SELECT value FROM json_each(?))
+                """,
+                (json.dumps([pid for pid, _ in prices]),),
+            )
+            latest = {row["product_id"]: row["latest_price"] for row in cursor.fetchall()}
+            inserts = [(pid, price) for pid, price in prices if latest.get(pid) != price]
+            extends = [pid for pid, price in prices if latest.get(pid) == price]
+
+        cursor.executemany(
+            """
+            INSERT INTO price_history (product_id, price, recorded_at, last_seen_at)
+            VALUES (?1, ?2, COALESCE(?3, CURRENT_TIMESTAMP), COALESCE(?3, CURRENT_TIMESTAMP))
+            """,
+            [(pid, price, observed_at) for pid, price in inserts],
+        )
+        # Unchanged prices only extend the product's current row
+        cursor.executemany(
+            """
+            UPDATE price_history SET last_seen_at = COALESCE(?2, CURRENT_TIMESTAMP)
+            WHERE id = (
+                SELECT id FROM price_history
+                WHERE product_id = ?1
+                ORDER BY recorded_at DESC
+                LIMIT 1
+            )
+            """,
+            [(pid, observed_at) for pid in extends],
+        )
+        # Update products' updated_at timestamp
+        cursor.executemany(
+            """
+            UPDATE products SET updated_at = COALESCE(?2, CURRENT_TIMESTAMP)
+            WHERE id = ?1
+            """,
+            [(product_id, observed_at) for product_id, _ in prices],
+        )
+        # Keep the per-product summary in step with price_history
+        cursor.executemany(
             """
-            INSERT INTO price_history (product_id, price)
-            VALUES (?, ?)
+            INSERT INTO product_stats
+                (product_id, low_price, latest_price, last_changed_at, sample_count)
+            VALUES (?1, ?2, ?2, COALESCE(?3, CURRENT_TIMESTAMP), 1)
+            ON CONFLICT (product_id) DO UPDATE SET
+                low_price = MIN(low_price, excluded.low_price),
+                last_changed_at = CASE
+                    WHEN latest_price = excluded.latest_price THEN last_changed_at
+                    ELSE excluded.last_changed_at
+                END,
+                latest_price = excluded.latest_price,
+                sample_count = sample_count + 1
             """,
-            (product_id, price),
+            [(pid, price, observed_at) for pid, price in prices],
         )
-        # Update product's updated_at timestamp
+        self._record_variant_prices(cursor, variant_prices, observed_at)
+        self._enqueue_alerts(cursor, alerts, channels, product_channels)
+        self.conn.commit()
+
+    def _record_variant_prices(
+        self,
+        cursor: sqlite3.Cursor,
+        variant_prices: Sequence[tuple[str, str, int]],
+        observed_at: str | None,
+    ) -> None:
+        """Add variant prices to their history, following the history mode."""
+        if not variant_prices:
+            return
+
+        inserts = variant_prices
+        extends: list[int] = []
+        if self.history_mode == HISTORY_MODE_CHANGE_ONLY:
+            # One index seek per variant for its current row, like product_stats
+            # gives for products, instead of reading each variant's history
+            cursor.execute(
+                """
+                SELECT
+                    v.value ->> 0 AS product_id,
+                    v.value ->> 1 AS variant_id,
+                    h.id,
+                    h.price
+                FROM json_each(?) v
+                JOIN variant_price_history h ON h.id = (
+                    SELECT id FROM variant_price_history
+                    WHERE product_id = v.value ->> 0 AND variant_id = v.value ->> 1
+                    ORDER BY recorded_at DESC
+                    LIMIT 1
+                )
+                """,
+                (json.dumps([[pid, variant_id] for pid, variant_id, _ in variant_prices]),),
+            )
+            latest = {
+                (row["product_id"], row["variant_id"]): (row["id"], row["price"])
+                for row in cursor.fetchall()
+            }
+            changed: list[tuple[str, str, int]] = []
+            for pid, variant_id, price in variant_prices:
+                current = latest.get((pid, variant_id))
+                if current is not None and current[1] == price:
+                    extends.append(current[0])
+                else:
+                    changed.append((pid, variant_id, price))
+            inserts = changed
+
+        cursor.executemany(
+            """
+            INSERT INTO variant_price_history
+                (product_id, variant_id, price, recorded_at, last_seen_at)
+            VALUES (?1, ?2, ?3, COALESCE(?4, CURRENT_TIMESTAMP), COALESCE(?4, CURRENT_TIMESTAMP))
+            """,
+            [(pid, variant_id, price, observed_at) for pid, variant_id, price in inserts],
+        )
+        # Unchanged prices only extend the variant's current row
+        cursor.executemany(
+            """
+            UPDATE variant_price_history SET last_seen_at = COALESCE(?2, CURRENT_TIMESTAMP)
+            WHERE id = ?1
+            """,
+            [(row_id, observed_at) for row_id in extends],
+        )
+
+    def enqueue_alerts(self, alerts: Sequence[PriceDropAlert], channels: Sequence[str]) -> None:
+        """Add alerts to the outbox for the given channels in one transaction."""
+        self._enqueue_alerts(self.conn.cursor(), alerts, channels)
+        self.conn.commit()
+
+    def get_last_outbox_id(self) -> int:
+        """Get the ID of the newest outbox entry, or 0 if there is none."""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM notification_outbox")
+        return cursor.fetchone()[0]
+
+    def enqueue_late_channels(
+        self, product_channels: Mapping[str, Sequence[str]], after_id: int
+    ) -> None:
+        """Copy the outbox entries above ``after_id`` of each product to more channels.
+
+        For accounts whose tracking list reaches a product after its alerts
+        were enqueued. The copies keep their entry's idempotency key under
+        the new channel, so a channel that already has the alert is skipped.
+        """
+        self.conn.execute(
+            """
+            INSERT OR IGNORE INTO notification_outbox
+                (idempotency_key, channel, product_id, product_name,
+                 current_price, historical_low, rule, reason)
+            SELECT late.value || substr(o.idempotency_key, length(o.channel) + 1),
+                   late.value, o.product_id, o.product_name,
+                   o.current_price, o.historical_low, o.rule, o.reason
+            FROM json_each(?2) AS product
+            JOIN json_each(product.value) AS late
+            JOIN notification_outbox o ON o.product_id = product.key
+            WHERE o.id > ?1
+            """,
+            (after_id, json.dumps(product_channels)),
+        )
+        self.conn.commit()
+
+    def _enqueue_alerts(
+        self,
+        cursor: sqlite3.Cursor,
+        alerts: Sequence[PriceDropAlert],
+        channels: Sequence[str],
+        product_channels: Mapping[str, Sequence[str]] | None = None,
+    ) -> None:
+        """Add alerts to the outbox without committing.
+
+        The idempotency key identifies a (channel, product, new low) so the
+        same drop is never queued twice for a channel. Alerts of other rules
+        fire when the price crosses their threshold and add the rule's kind
+        and the start of the price crossed from, so a retried batch queues a
+        crossing once while a later crossing at the same price is new.
+        """
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO notification_outbox
+                (idempotency_key, channel, product_id, product_name,
+                 current_price, historical_low, rule, reason)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    f"{channel}:{alert.product_id}:{alert.current_price}:{alert.historical_low}"
+                    + (
+                        ""
+                        if alert.rule == RULE_NEW_LOW
+                        else f":{alert.rule}:{alert.crossed_from or 'first'}"
+                    ),
+                    channel,
+                    alert.product_id,
+                    alert.product_name,
+                    alert.current_price,
+                    alert.historical_low,
+                    alert.rule,
+                    alert.reason,
+                )
+                for alert in alerts
+                for channel in (
+                    channels
+                    if product_channels is None
+                    else product_channels.get(alert.product_id, ())
+                )
+            ],
+        )
+
+    def get_due_outbox_entries(
+        self, channels: Sequence[str], limit: int, after_id: int = 0
+    ) -> list[OutboxEntry]:
+        """Get pending outbox entries for the given channels that are due for delivery.
+
+        Only entries with IDs above ``after_id`` are returned, so a caller can
+        page through entries it has already queued but not yet completed.
+        """
+        if not channels:
+            return []
+
+        placeholders = ",".join("?" * len(channels))
+        cursor = self.conn.cursor()
         cursor.execute(
+            f"""
+            SELECT id, idempotency_key, channel, product_id, product_name,
+                   current_price, historical_low, rule, reason, attempts
+            FROM notification_outbox
+            WHERE status = 'pending'
+              AND next_attempt_at <= CURRENT_TIMESTAMP
+              AND channel IN ({placeholders})
+              AND id > ?
+            ORDER BY id
+            LIMIT ?
+            """,
+            (*channels, after_id, limit),
+        )
+        return [
+            OutboxEntry(
+                id=row["id"],
+                idempotency_key=row["idempotency_key"],
+                channel=row["channel"],
+                alert=PriceDropAlert(
+                    product_id=row["product_id"],
+                    product_name=row["product_name"],
+                    current_price=row["current_price"],
+                    historical_low=row["historical_low"],
+                    rule=row["rule"],
+                    reason=row["reason"],
+                ),
+                attempts=row["attempts"],
+            )
+            for row in cursor.fetchall()
+        ]
+
+    def complete_outbox_entries(
+        self,
+        sent_ids: Sequence[int],
+        failed_ids: Sequence[int],
+        max_attempts: int,
+        retry_delay_minutes: int = 5,
+    ) -> int:
+        """Record a delivery batch's outcome in one transaction.
+
+        Failed entries are retried with exponential backoff starting at
+        ``retry_delay_minutes``; after ``max_attempts`` they are dead-lettered.
+        Returns the number of entries dead-lettered.
+        """
+        cursor = self.conn.cursor()
+        cursor.executemany(
             """
-            UPDATE products SET updated_at = CURRENT_TIMESTAMP
+            UPDATE notification_outbox
+            SET status = 'sent', attempts = attempts + 1, sent_at = CURRENT_TIMESTAMP
             WHERE id = ?
             """,
-            (product_id,),
+            [(entry_id,) for entry_id in sent_ids],
         )
+        cursor.executemany(
+            """
+            UPDATE notification_outbox
+            SET attempts = attempts + 1,
+                last_error = 'delivery failed',
+                next_attempt_at = datetime(
+                    'now', '+' || (?2 * (1 << MIN(attempts, 10))) || ' minutes'
+                )
+            WHERE id = ?1
+            """,
+            [(entry_id, retry_delay_minutes) for entry_id in failed_ids],
+        )
+        dead = 0
+        if failed_ids:
+            placeholders = ",".join("?" * len(failed_ids))
+            cursor.execute(
+                f"""
+                UPDATE notification_outbox SET status = 'dead'
+                WHERE id IN ({placeholders}) AND attempts >= ?
+                """,
+                (*failed_ids, max_attempts),
+            )
+            dead = cursor.rowcount
         self.conn.commit()
+        return dead
+
+    def prune_outbox(self, days: int = 30) -> int:
+        """Delete delivered outbox entries older than ``days``."""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            """
+            DELETE FROM notification_outbox
+            WHERE status = 'sent' AND sent_at < datetime('now', ?)
+            """,
+            (f"-{days} days",),
+        )
+        self.conn.commit()
+        return cursor.rowcount
+
+    def add_alert_rule(
+        self,
+        kind: str,
+        product_id: str | None = None,
+        threshold: int | None = None,
+        window_days: int | None = None,
+        enabled: bool = True,
+    ) -> int:
+        """Store an alert rule and return its ID.
+
+        Without ``product_id`` the rule applies to every product. A disabled
+        product rule switches the global rules of its kind off for that
+        product.
+        """
+        if kind not in RULE_KINDS:
+            raise ValueError(f"Unknown alert rule kind: {kind}")
+        if threshold is not None and threshold <= 0:
+            raise ValueError("An alert rule threshold must be positive")
+        if window_days is not None and window_days <= 0:
+            raise ValueError("An alert rule needs at least 1 day")
+        if kind == RULE_TARGET_PRICE and threshold is None:
+            raise ValueError("A target_price rule needs a target price threshold")
+        if kind == RULE_PERCENT_DROP and (threshold is None or not 0 < threshold < 100):
+            raise ValueError("A percent_drop rule needs a threshold between 1 and 99 percent")
+        if kind in (RULE_PERCENT_DROP, RULE_WINDOW_LOW) and window_days is None:
+            raise ValueError(f"A {kind} rule needs a number of days")
+        if threshold is not None and kind not in (RULE_TARGET_PRICE, RULE_PERCENT_DROP):
+            raise ValueError(f"A {kind} rule does not take a threshold")
+        if window_days is not None and kind not in (RULE_PERCENT_DROP, RULE_WINDOW_LOW):
+            raise ValueError(f"A {kind} rule does not take a number of days")
+
+        cursor = self.conn.cursor()
+        if product_id is not None:
+            cursor.execute(
+                "SELECT 1 FROM products WHERE id = ? AND deleted_at IS NULL", (product_id,)
+            )
+            if cursor.fetchone() is None:
+                raise ValueError(f"Product {product_id} is not tracked")
+        cursor.execute(
+            """
+            INSERT INTO alert_rules (kind, product_id, threshold, window_days, enabled)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (kind, product_id, threshold, window_days, enabled),
+        )
+        self.conn.commit()
+        return cursor.lastrowid  # type: ignore[return-value]
+
+    def get_alert_rules(self) -> list[AlertRule]:
+        """Get every stored alert rule, global rules first."""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            """
+            SELECT id, kind, product_id, threshold, window_days, enabled
+            FROM alert_rules
+            ORDER BY product_id IS NOT NULL, product_id, id
+            """
+        )
+        return [
+            AlertRule(
+                id=row["id"],
+                kind=row["kind"],
+                product_id=row["product_id"],
+                threshold=row["threshold"],
+                window_days=row["window_days"],
+                enabled=bool(row["enabled"]),
+            )
+            for row in cursor.fetchall()
+        ]
+
+    def remove_alert_rule(self, rule_id: int) -> bool:
+        """Delete an alert rule, returning whether it existed."""
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM alert_rules WHERE id = ?", (rule_id,))
+        self.conn.commit()
+        return cursor.rowcount > 0
+
+    def evaluate_alert_rules(
+        self, prices: Mapping[str, int], observed_at: str | None = None
+    ) -> dict[str, RuleMatch]:
+        """Evaluate every enabled alert rule against fetched prices in one query.
+
+        The prices are loaded into a temporary table and joined with the
+        rules that apply to each product, the product's summary and, for
+        rules with a window, the average and low of its history over the
+        window's days before ``observed_at`` (default now). The average is
+        weighted by how long each price lasted, so it is the same whether
+        history is stored per run or per change.
+
+        A rule only matches when the price crosses it: the product's previous
+        price must not have satisfied it, so a price that stays below a target
+        alerts once. When a product satisfies several rules, the first of new
+        low, target price, N-day low and percent drop wins, so each product
+        gets at most one match; a new low thereby also covers the others.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(
+            """
+            CREATE TEMP TABLE IF NOT EXISTS run_prices (
+                product_id TEXT PRIMARY KEY,
+                price INTEGER NOT NULL
+            )
+            """
+        )
+        cursor.execute("DELETE FROM temp.run_prices")
+        if not prices:
+            return {}
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO temp.run_prices (product_id, price)
+            SELECT value ->> 0, value ->> 1 FROM json_each(?)
+            """,
+            (json.dumps(list(prices.items())),),
+        )
+        cursor.execute(
+            """
+            WITH applicable AS (
+                SELECT r.id AS rule_id, r.kind, r.threshold, r.window_days,
+                       rp.product_id, rp.price
+                FROM temp.run_prices rp
+                JOIN alert_rules r
+                  ON r.product_id = rp.product_id
+                  OR (r.product_id IS NULL AND NOT EXISTS (
+                        SELECT 1 FROM alert_rules o
+                        WHERE o.product_id = rp.product_id AND o.kind = r.kind
+                  ))
+                WHERE r.enabled
+            ),
+            windows AS (
+                SELECT DISTINCT product_id, window_days,
+                       datetime(COALESCE(?1, 'now'), '-' || window_days || ' days') AS since
+                FROM applicable
+                WHERE window_days IS NOT NULL
+            ),
+            window_rows AS (
+                -- Rows recorded in the window
+                SELECT w.product_id, w.window_days, h.price, h.recorded_at AS started_at
+                FROM windows w
+                JOIN price_history h
+                  ON h.product_id = w.product_id AND h.recorded_at >= w.since
+                UNION ALL
+                -- The row current when the window started, from the window's start,
+                -- if it was still seen in the window or a later row followed it
+                SELECT w.product_id, w.window_days, h.price, w.since
+                FROM windows w
+                JOIN price_history h ON h.id = (
+                    SELECT id FROM price_history
+                    WHERE product_id = w.product_id AND recorded_at < w.since
+                    ORDER BY recorded_at DESC
+                    LIMIT 1
+                )
+                WHERE COALESCE(h.last_seen_at, h.recorded_at) >= w.since
+                   OR EXISTS (
+                        SELECT 1 FROM price_history
+                        WHERE product_id = w.product_id AND recorded_at >= w.since
+                   )
+            ),
+            window_samples AS (
+                -- Each price lasted until the next row, the latest until now, so a
+                -- change-only row counts as long as an append row per poll would
+                SELECT product_id, window_days, price, price AS low,
+                       MAX(0, julianday(COALESCE(
+                           LEAD(started_at) OVER (
+                               PARTITION BY product_id, window_days ORDER BY started_at
+                           ),
+                           datetime(COALESCE(?1, 'now'))
+                       )) - julianday(started_at)) AS days
+                FROM window_rows
+                UNION ALL
+                -- Downsampled history, each bucket as long as its resolution
+                SELECT w.product_id, w.window_days, r.close_price, r.min_price,
+                       CASE r.resolution WHEN 'week' THEN 7 ELSE 1 END
+                FROM windows w
+                JOIN price_rollups r
+                  ON r.product_id = w.product_id AND r.bucket_start >= date(w.since)
+            ),
+            window_stats AS (
+                SELECT product_id, window_days,
+                       COALESCE(SUM(price * days) / NULLIF(SUM(days), 0), AVG(price))
+                           AS average_price,
+                       MIN(low) AS low_price
+                FROM window_samples
+                GROUP BY product_id, window_days
+            ),
+            matches AS (
+                SELECT
+                    a.product_id,
+                    a.rule_id,
+                    a.kind,
+                    a.price,
+                    CASE a.kind
+                        WHEN 'new_low' THEN s.low_price
+                        WHEN 'target_price' THEN a.threshold
+                        WHEN 'percent_drop' THEN CAST(ROUND(w.average_price) AS INTEGER)
+                        ELSE w.low_price
+                    END AS reference_price,
+                    s.low_price AS historical_low,
+                    a.threshold,
+                    a.window_days,
+                    s.last_changed_at AS previous_changed_at,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY a.product_id
+                        ORDER BY
+                            CASE a.kind
+                                WHEN 'new_low' THEN 0
+                                WHEN 'target_price' THEN 1
+                                WHEN 'window_low' THEN 2
+                                ELSE 3
+                            END,
+                            a.rule_id
+                    ) AS preference
+                FROM applicable a
+                LEFT JOIN product_stats s ON s.product_id = a.product_id
+                LEFT JOIN window_stats w
+                  ON w.product_id = a.product_id AND w.window_days = a.window_days
+                WHERE CASE a.kind
+                    WHEN 'new_low' THEN a.price < s.low_price
+                    WHEN 'target_price' THEN a.price <= a.threshold
+                        AND (s.latest_price IS NULL OR s.latest_price > a.threshold)
+                    WHEN 'percent_drop' THEN a.price * 100 <= w.average_price * (100 - a.threshold)
+                        AND s.latest_price * 100 > w.average_price * (100 - a.threshold)
+                    -- The window's low includes the previous price, so this is a crossing
+                    ELSE a.price < w.low_price
+                END
+            )
+            SELECT product_id, rule_id, kind, price, reference_price, historical_low,
+                   threshold, window_days, previous_changed_at
+            FROM matches
+            WHERE preference = 1
+            """,
+            (observed_at,),
+        )
+        return {
+            row["product_id"]: RuleMatch(
+                product_id=row["product_id"],
+                rule_id=row["rule_id"],
+                kind=row["kind"],
+                current_price=row["price"],
+                reference_price=row["reference_price"],
+                historical_low=row["historical_low"],
+                threshold=row["threshold"],
+                window_days=row["window_days"],
+                previous_changed_at=row["previous_changed_at"],
+            )
+            for row in cursor.fetchall()
+        }
+
+    def get_product_stats(
+        self, product_ids: Sequence[str] | None = None
+    ) -> dict[str, ProductStats]:
+        """Get the price summary of tracked products in one query.
+
+        Covers every tracked product, or only ``product_ids`` when given.
+        """
+        cursor = self.conn.cursor()
+        if product_ids is None:
+            cursor.execute(
+                """
+                SELECT s.product_id, s.low_price, s.latest_price, s.last_changed_at,
+                       s.sample_count
+                FROM product_stats s
+                JOIN products p ON p.id = s.product_id
+                """
+            )
+        else:
+            cursor.execute(
+                """
+                SELECT s.product_id, s.low_price, s.latest_price, s.last_changed_at,
+                       s.sample_count
+                FROM product_stats s
+                JOIN products p ON p.id = s.product_id
+                WHERE s.product_id IN (SELECT value FROM json_each(?))
+                """,
+                (json.dumps(list(product_ids)),),
+            )
+        return {
+            row["product_id"]: ProductStats(
+                product_id=row["product_id"],
+                low_price=row["low_price"],
+                latest_price=row["latest_price"],
+                last_changed_at=datetime.fromisoformat(row["last_changed_at"]),
+                sample_count=row["sample_count"],
+            )
+            for row in cursor.fetchall()
+        }
+
+    def get_products_without_variant_history(self, product_ids: Sequence[str]) -> set[str]:
+        """Get the products among ``product_ids`` with no variant prices recorded yet."""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            """
+            SELECT value FROM json_each(?)
+            WHERE NOT EXISTS (
+                SELECT 1 FROM variant_price_history WHERE product_id = value
+            )
+            """,
+            (json.dumps(list(product_ids)),),
+        )
+        return {row["value"] for row in cursor.fetchall()}
+
+    def rebuild_product_stats(self) -> int:
+        """Rebuild the per-product summary from price_history.
+
+        Returns the number of products summarized.
+        """
+        cursor = self.conn.cursor()
+        count = self._rebuild_product_stats(cursor)
+        self.conn.commit()
+        return count
+
+    def _rebuild_product_stats(self, cursor: sqlite3.Cursor) -> int:
+        """Rebuild the per-product summary without committing."""
+        cursor.execute("DELETE FROM product_stats")
+        cursor.execute(
+            """
+            INSERT INTO product_stats
+                (product_id, low_price, latest_price, last_changed_at, sample_count)
+            WITH samples AS (
+                SELECT id, product_id, price, price AS low, recorded_at, 1 AS samples
+                FROM price_history
+                UNION ALL
+                SELECT 0, product_id, close_price, min_price, bucket_start, sample_count
+                FROM price_rollups
+            ),
+            ordered AS (
+                SELECT
+                    product_id,
+                    price,
+                    low,
+                    recorded_at,
+                    samples,
+                    LAG(price) OVER (
+                        PARTITION BY product_id ORDER BY recorded_at, id
+                    ) AS prev_price,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY product_id ORDER BY recorded_at DESC, id DESC
+                    ) AS recency
+                FROM samples
+            )
+            SELECT
+                product_id,
+                MIN(low),
+                MAX(CASE WHEN recency = 1 THEN price END),
+                MAX(CASE WHEN prev_price IS NULL OR prev_price != price THEN recorded_at END),
+                SUM(samples)
+            FROM ordered
+            GROUP BY product_id
+            """
+        )
+        return cursor.rowcount
 
     def get_price_history(self, product_id: str, limit: int = 10) -> list[PriceRecord]:
         """Get price history for a product."""
         cursor = self.conn.cursor()
         cursor.execute(
             """
-            SELECT product_id, price, recorded_at
+            SELECT
+                product_id,
+                price,
+                recorded_at,
+                COALESCE(last_seen_at, recorded_at) AS last_seen_at
             FROM price_history
             WHERE product_id = ?
             ORDER BY recorded_at DESC
@@ -165,6 +1280,238 @@ class PriceDatabase:
                 product_id=row["product_id"],
                 price=row["price"],
                 recorded_at=datetime.fromisoformat(row["recorded_at"]),
+                last_seen_at=datetime.fromisoformat(row["last_seen_at"]),
             )
             for row in cursor.fetchall()
         ]
+
+    def collapse_price_history(self) -> int:
+        """Collapse runs of repeated prices into single change-only rows.
+
+        Each run of consecutive identical prices of a product, or of one of
+        its variants, is reduced to its first row, whose ``last_seen_at`` is
+        extended to the end of the run. Returns the number of rows removed.
+        """
+        cursor = self.conn.cursor()
+        removed = sum(
+            self._collapse_history(cursor, history, key) for history, _, key in HISTORY_TABLES
+        )
+        self.conn.commit()
+        return removed
+
+    def _collapse_history(self, cursor: sqlite3.Cursor, history: str, key: str) -> int:
+        """Collapse the repeated prices of each ``key`` series in ``history`` without committing."""
+        cursor.execute("DROP TABLE IF EXISTS temp.history_runs")
+        cursor.execute(
+            f"""
+            CREATE TEMP TABLE history_runs AS
+            WITH ordered AS (
+                SELECT
+                    id,
+                    {key},
+                    recorded_at,
+                    COALESCE(last_seen_at, recorded_at) AS seen_at,
+                    CASE WHEN price = LAG(price) OVER w THEN 0 ELSE 1 END AS is_change
+                FROM {history}
+                WINDOW w AS (PARTITION BY {key} ORDER BY recorded_at, id)
+            ),
+            numbered AS (
+                SELECT
+                    id,
+                    {key},
+                    seen_at,
+                    is_change,
+                    SUM(is_change) OVER (
+                        PARTITION BY {key} ORDER BY recorded_at, id
+                    ) AS run
+                FROM ordered
+            )
+            SELECT
+                MIN(CASE WHEN is_change = 1 THEN id END) AS head_id,
+                MAX(seen_at) AS last_seen_at
+            FROM numbered
+            GROUP BY {key}, run
+            """
+        )
+        cursor.execute("CREATE UNIQUE INDEX temp.idx_history_runs_head ON history_runs(head_id)")
+        cursor.execute(
+            f"""
+            UPDATE {history}
+            SET last_seen_at = (
+                SELECT r.last_seen_at FROM history_runs r WHERE r.head_id = {history}.id
+            )
+            WHERE id IN (SELECT head_id FROM history_runs)
+            """
+        )
+        cursor.execute(f"DELETE FROM {history} WHERE id NOT IN (SELECT head_id FROM history_runs)")
+        removed = cursor.rowcount
+        cursor.execute("DROP TABLE temp.history_runs")
+        return removed
+
+    def compact_price_history(
+        self,
+        full_resolution_days: int = 30,
+        daily_resolution_days: int = 365,
+        batch_size: int = 100,
+    ) -> CompactionResult:
+        """Downsample old price history into daily and then weekly rollups.
+
+        Rows older than ``full_resolution_days`` are folded into daily
+        min/max/close rollups, and daily rollups older than
+        ``daily_resolution_days`` into weekly ones, for products and for each
+        of their variants alike. The latest history row of a product or
+        variant is always kept. Products are processed ``batch_size`` at a time,
+        one transaction per batch, so memory use stays bounded.
+        """
+        result = CompactionResult()
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT date('now', ?) AS full_cutoff, date('now', ?) AS daily_cutoff",
+            (f"-{full_resolution_days} days", f"-{daily_resolution_days} days"),
+        )
+        cutoffs = cursor.fetchone()
+
+        last_id = ""
+        while True:
+            cursor.execute(
+                "SELECT id FROM products WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size),
+            )
+            batch = [row["id"] for row in cursor.fetchall()]
+            if not batch:
+                break
+            last_id = batch[-1]
+
+            history_removed, daily_removed = self._compact_batch(
+                batch, cutoffs["full_cutoff"], cutoffs["daily_cutoff"]
+            )
+            result.history_rows_removed += history_removed
+            result.daily_rows_removed += daily_removed
+            result.batches += 1
+
+        return result
+
+    def _compact_batch(
+        self, product_ids: list[str], full_cutoff: str, daily_cutoff: str
+    ) -> tuple[int, int]:
+        """Compact one batch of products and their variants in a single transaction."""
+        cursor = self.conn.cursor()
+        removed = [
+            self._compact_history(
+                cursor, history, rollups, key, product_ids, full_cutoff, daily_cutoff
+            )
+            for history, rollups, key in HISTORY_TABLES
+        ]
+        self.conn.commit()
+        return sum(rows for rows, _ in removed), sum(days for _, days in removed)
+
+    def _compact_history(
+        self,
+        cursor: sqlite3.Cursor,
+        history: str,
+        rollups: str,
+        key: str,
+        product_ids: list[str],
+        full_cutoff: str,
+        daily_cutoff: str,
+    ) -> tuple[int, int]:
+        """Fold a batch's old ``history`` rows into ``rollups`` without committing.
+
+        ``key`` lists the columns identifying one price series in both tables.
+        """
+        placeholders = ",".join("?" * len(product_ids))
+
+        # Old full-resolution rows, excluding each series' current row
+        old_rows = f"""
+            FROM {history}
+            WHERE product_id IN ({placeholders})
+              AND recorded_at < ?
+              AND id NOT IN (
+                  SELECT MAX(id) FROM {history}
+                  WHERE product_id IN ({placeholders})
+                  GROUP BY {key}
+              )
+        """
+        old_rows_params = (*product_ids, full_cutoff, *product_ids)
+
+        cursor.execute(
+            f"""
+            INSERT INTO {rollups}
+                ({key}, resolution, bucket_start, min_price, max_price,
+                 close_price, sample_count)
+            SELECT {key}, 'day', bucket, MIN(price), MAX(price), close, COUNT(*)
+            FROM (
+                SELECT
+                    {key},
+                    price,
+                    date(recorded_at) AS bucket,
+                    LAST_VALUE(price) OVER (
+                        PARTITION BY {key}, date(recorded_at)
+                        ORDER BY recorded_at, id
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+                    ) AS close
+                {old_rows}
+            )
+            GROUP BY {key}, bucket
+            ON CONFLICT ({key}, resolution, bucket_start) DO UPDATE SET
+                min_price = MIN(min_price, excluded.min_price),
+                max_price = MAX(max_price, excluded.max_price),
+                close_price = excluded.close_price,
+                sample_count = sample_count + excluded.sample_count
+            """,
+            old_rows_params,
+        )
+        cursor.execute(f"DELETE {old_rows}", old_rows_params)
+        history_removed = cursor.rowcount
+
+        # Old daily rollups fold into weeks starting on Monday
+        old_days = f"""
+            FROM {rollups}
+            WHERE product_id IN ({placeholders})
+              AND resolution = 'day'
+              AND bucket_start < ?
+        """
+        old_days_params = (*product_ids, daily_cutoff)
+
+        cursor.execute(
+            f"""
+            INSERT INTO {rollups}
+                ({key}, resolution, bucket_start, min_price, max_price,
+                 close_price, sample_count)
+            SELECT {key}, 'week', bucket, MIN(min_price), MAX(max_price), close,
+                   SUM(sample_count)
+            FROM (
+                SELECT
+                    {key},
+                    min_price,
+                    max_price,
+                    sample_count,
+                    date(bucket_start, '-6 days', 'weekday 1') AS bucket,
+                    LAST_VALUE(close_price) OVER (
+                        PARTITION BY {key}, date(bucket_start, '-6 days', 'weekday 1')
+                        ORDER BY bucket_start
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+                    ) AS close
+                {old_days}
+            )
+            GROUP BY {key}, bucket
+            ON CONFLICT ({key}, resolution, bucket_start) DO UPDATE SET
+                min_price = MIN(min_price, excluded.min_price),
+                max_price = MAX(max_price, excluded.max_price),
+                close_price = excluded.close_price,
+                sample_count = sample_count + excluded.sample_count
+            """,
+            old_days_params,
+        )
+        cursor.execute(f"DELETE {old_days}", old_days_params)
+        return history_removed, cursor.rowcount
+
+    def vacuum(self, mode: str = VACUUM_FULL) -> None:
+        """Reclaim free pages, either by rebuilding the file or incrementally."""
+        if mode not in VACUUM_MODES:
+            raise ValueError(f"Unknown vacuum mode: {mode}")
+        if mode == VACUUM_FULL:
+            self.conn.execute("VACUUM")
+        elif mode == VACUUM_INCREMENTAL:
+            # incremental_vacuum frees pages one step per returned row
+            self.conn.execute("PRAGMA incremental_vacuum").fetchall()
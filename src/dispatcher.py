@@ -0,0 +1,201 @@
+"""Concurrent delivery of price alerts to the notification channels."""
+
+from collections.abc import Hashable
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Protocol
+
+from alerts import PriceDropAlert
+
+# Default number of alerts in flight per channel
+DEFAULT_CHANNEL_CONCURRENCY = 2
+
+# Default number of alerts in one run at which they are sent as a digest
+DEFAULT_DIGEST_THRESHOLD = 5
+
+
+class Notifier(Protocol):
+    """A notification channel that can deliver price drop alerts."""
+
+    name: str
+
+    def send_price_drop_alert(
+        self,
+        product_id: str,
+        product_name: str,
+        current_price: int,
+        historical_low: int,
+        reason: str | None = None,
+    ) -> bool: ...
+
+    def send_price_drop_digest(self, alerts: list[PriceDropAlert]) -> list[bool]: ...
+
+    def close(self) -> None: ...
+
+
+@dataclass
+class DeliveryResults:
+    """Delivery outcome of the alerts sent through a dispatcher."""
+
+    sent: dict[str, int] = field(default_factory=dict)
+    failed: dict[str, int] = field(default_factory=dict)
+    # Outcome per key passed to ``submit``
+    outcomes: dict[Hashable, bool] = field(default_factory=dict)
+
+    @property
+    def total_sent(self) -> int:
+        """Number of alerts delivered across all channels."""
+        return sum(self.sent.values())
+
+    @property
+    def total_failed(self) -> int:
+        """Number of alerts that could not be delivered across all channels."""
+        return sum(self.failed.values())
+
+    def merge(self, other: "DeliveryResults") -> None:
+        """Add another set of results to this one."""
+        for name, count in other.sent.items():
+            self.sent[name] = self.sent.get(name, 0) + count
+        for name, count in other.failed.items():
+            self.failed[name] = self.failed.get(name, 0) + count
+        self.outcomes.update(other.outcomes)
+
+
+class NotificationDispatcher:
+    """Fans price alerts out to the channels without blocking the caller.
+
+    Each channel gets its own worker pool, so a slow channel never holds up
+    another and at most ``channel_concurrency`` alerts are in flight per
+    channel. The dispatcher owns the notifiers and closes them on exit.
+
+    With a ``digest_threshold`` above zero, alerts are held until ``wait()``.
+    A channel with at least that many alerts gets them as a digest; otherwise
+    each is sent individually.
+    """
+
+    def __init__(
+        self,
+        notifiers: list[Notifier],
+        channel_concurrency: int = DEFAULT_CHANNEL_CONCURRENCY,
+        digest_threshold: int = 0,
+    ) -> None:
+        """Initialize the dispatcher with the channels to deliver to."""
+        self.notifiers = {notifier.name: notifier for notifier in notifiers}
+        self.digest_threshold = digest_threshold
+        self._executors = {
+            name: ThreadPoolExecutor(
+                max_workers=max(1, channel_concurrency),
+                thread_name_prefix=f"notify-{name}",
+            )
+            for name in self.notifiers
+        }
+        # (channel, keys covered, future returning one outcome per key)
+        self._pending: list[tuple[str, list[Hashable], Future[list[bool]]]] = []
+        self._held: dict[str, list[tuple[Hashable, PriceDropAlert]]] = {}
+
+    def __enter__(self) -> "NotificationDispatcher":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether any channel is configured."""
+        return bool(self.notifiers)
+
+    @property
+    def channels(self) -> list[str]:
+        """Names of the configured channels."""
+        return list(self.notifiers)
+
+    def submit(
+        self,
+        alert: PriceDropAlert,
+        channel: str | None = None,
+        key: Hashable | None = None,
+    ) -> None:
+        """Queue an alert for delivery and return immediately.
+
+        The alert goes to ``channel``, or to every channel when omitted.
+        ``key`` identifies the alert in ``DeliveryResults.outcomes``.
+        """
+        channels = [channel] if channel is not None else list(self.notifiers)
+        for name in channels:
+            item_key = key if key is not None else (name, alert)
+            if self.digest_threshold > 0:
+                self._held.setdefault(name, []).append((item_key, alert))
+            else:
+                self._submit_individual(name, item_key, alert)
+
+    def wait(self) -> DeliveryResults:
+        """Wait for every queued alert and collect the delivery results."""
+        held, self._held = self._held, {}
+        for name, items in held.items():
+            if len(items) >= self.digest_threshold:
+                future = self._executors[name].submit(
+                    self.notifiers[name].send_price_drop_digest,
+                    [alert for _, alert in items],
+                )
+                self._pending.append((name, [key for key, _ in items], future))
+            else:
+                for key, alert in items:
+                    self._submit_individual(name, key, alert)
+
+        pending, self._pending = self._pending, []
+        return _collect_results(pending)
+
+    def collect(self) -> DeliveryResults:
+        """Collect the results of the alerts delivered so far without waiting.
+
+        Alerts still in flight, and alerts held for a digest, are left for
+        a later ``collect()`` or ``wait()``.
+        """
+        pending, self._pending = self._pending, []
+        finished = []
+        for item in pending:
+            (finished if item[2].done() else self._pending).append(item)
+        return _collect_results(finished)
+
+    def _submit_individual(self, name: str, key: Hashable, alert: PriceDropAlert) -> None:
+        """Queue one alert as its own message on a channel."""
+        future = self._executors[name].submit(_send_one, self.notifiers[name], alert)
+        self._pending.append((name, [key], future))
+
+    def close(self) -> None:
+        """Finish queued deliveries and release every channel's connections."""
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
+        for notifier in self.notifiers.values():
+            notifier.close()
+
+
+def _collect_results(
+    pending: list[tuple[str, list[Hashable], Future[list[bool]]]],
+) -> DeliveryResults:
+    """Wait for queued deliveries and count their outcomes per channel."""
+    results = DeliveryResults()
+    for name, keys, future in pending:
+        try:
+            delivered = future.result()
+        except Exception as e:
+            print(f"Failed to send {name} notification: {e}")
+            delivered = [False] * len(keys)
+        for key, ok in zip(keys, delivered, strict=True):
+            results.outcomes[key] = ok
+            bucket = results.sent if ok else results.failed
+            bucket[name] = bucket.get(name, 0) + 1
+    return results
+
+
+def _send_one(notifier: Notifier, alert: PriceDropAlert) -> list[bool]:
+    """Send a single alert as its own message."""
+    return [
+        notifier.send_price_drop_alert(
+            product_id=alert.product_id,
+            product_name=alert.product_name,
+            current_price=alert.current_price,
+            historical_low=alert.historical_low,
+            reason=alert.reason,
+        )
+    ]
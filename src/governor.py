@@ -0,0 +1,222 @@
+"""Adaptive concurrency, retries and circuit breaking for PChome requests."""
+
+import random
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+import httpx
+
+from ratelimit import MAX_RETRY_AFTER, get_retry_after
+
+# Default number of attempts per GET request
+DEFAULT_MAX_ATTEMPTS = 4
+
+# Jittered exponential backoff bounds between attempts, in seconds
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_CAP = 8.0
+
+# Consecutive failed attempts at the lowest concurrency that open an endpoint's circuit
+DEFAULT_FAILURE_THRESHOLD = 5
+
+# Seconds an open circuit fails fast before letting a probe request through
+DEFAULT_RESET_TIMEOUT = 30.0
+
+# Factor the concurrency limit is cut by when an endpoint struggles
+DECREASE_FACTOR = 0.5
+
+# Responses that mean the endpoint is overloaded or failing, worth retrying
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """Raised instead of sending a request while its endpoint's circuit is open."""
+
+
+@dataclass
+class EndpointStats:
+    """What the governor did for one endpoint during a run."""
+
+    requests: int = 0
+    retries: int = 0
+    failures: int = 0
+    rejected: int = 0
+    circuit_opened: int = 0
+    limit: float = 0.0
+
+
+class _Endpoint:
+    """Concurrency limit and breaker state of one endpoint."""
+
+    def __init__(self, max_concurrency: int) -> None:
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+        self.last_decrease = 0.0
+        self.stats = EndpointStats(limit=self.limit)
+        self.condition = threading.Condition()
+
+
+class RequestGovernor:
+    """Shares a request budget for each PChome endpoint between threads and accounts.
+
+    Each endpoint gets an AIMD concurrency limit. It starts at
+    ``max_concurrency``, grows by one slot per limit's worth of successful
+    requests, and is halved when a request fails with a timeout, connection
+    error, 429 or 5xx. Failed GETs are retried up to ``max_attempts`` times
+    with jittered exponential backoff, and a ``Retry-After`` is honoured.
+
+    After ``failure_threshold`` consecutive failed attempts at the lowest
+    concurrency the endpoint's circuit opens. Requests then fail fast with ``CircuitOpenError`` for
+    ``reset_timeout`` seconds, after which one probe request decides whether
+    it closes again. ``failure_threshold=None`` disables the breaker.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        failure_threshold: int | None = DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+        backoff_base: float = RETRY_BACKOFF_BASE,
+        backoff_cap: float = RETRY_BACKOFF_CAP,
+    ) -> None:
+        """Initialize the governor with every endpoint at full concurrency."""
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.max_attempts = max(1, max_attempts)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._endpoints: dict[str, _Endpoint] = {}
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict[str, EndpointStats]:
+        """Counters and current concurrency limit of every endpoint used."""
+        with self._lock:
+            endpoints = dict(self._endpoints)
+        result = {}
+        for name, endpoint in endpoints.items():
+            with endpoint.condition:
+                result[name] = EndpointStats(**vars(endpoint.stats))
+                result[name].limit = endpoint.limit
+        return result
+
+    def send(self, endpoint: str, send: Callable[[], httpx.Response]) -> httpx.Response:
+        """Send an idempotent request to ``endpoint`` within its budget, retrying failures.
+
+        Returns the first response that is not retryable, or the last one
+        once the attempts run out. A transport error on the last attempt is
+        raised, as is ``CircuitOpenError`` while the circuit is open.
+        """
+        state = self._endpoint(endpoint)
+        attempt = 0
+        while True:
+            probe = self._acquire(endpoint, state)
+            started = time.monotonic()
+            last_attempt = attempt + 1 == self.max_attempts
+            # The slot is freed however the attempt ends; any other error says
+            # nothing about the endpoint's health
+            ok: bool | None = None
+            try:
+                response = send()
+                ok = response.status_code not in RETRYABLE_STATUSES
+            except httpx.TransportError:
+                ok = False
+                if last_attempt:
+                    raise
+                response = None
+            finally:
+                self._release(endpoint, state, started, ok=ok, probe=probe)
+
+            delay = self._backoff(attempt)
+            if response is not None:
+                if ok or last_attempt:
+                    return response
+                retry_after = get_retry_after(response) if response.status_code == 429 else None
+                if retry_after is not None:
+                    delay = min(retry_after, MAX_RETRY_AFTER) + random.uniform(0, delay)
+                response.close()
+
+            with state.condition:
+                state.stats.retries += 1
+            time.sleep(delay)
+            attempt += 1
+
+    def _endpoint(self, name: str) -> _Endpoint:
+        with self._lock:
+            state = self._endpoints.get(name)
+            if state is None:
+                state = self._endpoints[name] = _Endpoint(self.max_concurrency)
+            return state
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2**attempt))
+
+    def _acquire(self, name: str, state: _Endpoint) -> bool:
+        """Wait for a free slot, or fail fast while the circuit is open.
+
+        Returns whether the request is the probe of a half-open circuit.
+        """
+        with state.condition:
+            probe = False
+            # Requests arriving during a probe wait for its outcome
+            while state.probing:
+                state.condition.wait()
+            if state.opened_at is not None:
+                if time.monotonic() - state.opened_at < self.reset_timeout:
+                    state.stats.rejected += 1
+                    raise CircuitOpenError(f"{name} is failing; circuit open")
+                # Half-open: this request probes whether the endpoint recovered
+                state.probing = probe = True
+            while state.in_flight >= int(state.limit):
+                state.condition.wait()
+            state.in_flight += 1
+            state.stats.requests += 1
+            return probe
+
+    def _release(
+        self, name: str, state: _Endpoint, started: float, ok: bool | None, probe: bool
+    ) -> None:
+        """Free a slot and adapt the limit and breaker to the outcome.
+
+        With no outcome (``ok=None``) only the slot is freed; an unfinished
+        probe leaves the circuit half-open so the next request probes again.
+        """
+        with state.condition:
+            state.in_flight -= 1
+            if probe:
+                state.probing = False
+            if ok:
+                state.consecutive_failures = 0
+                state.opened_at = None
+                state.limit = min(self.max_concurrency, state.limit + 1 / state.limit)
+            elif ok is not None:
+                state.stats.failures += 1
+                # Overload is handled by backing off first; only failures that
+                # persist at the lowest concurrency count towards the breaker
+                if state.limit <= self.min_concurrency:
+                    state.consecutive_failures += 1
+                # Requests already in flight at the last decrease saw the same
+                # trouble, so only one cut is made per round of requests
+                if started >= state.last_decrease:
+                    state.limit = max(self.min_concurrency, state.limit * DECREASE_FACTOR)
+                    state.last_decrease = time.monotonic()
+                threshold = self.failure_threshold
+                if probe or (
+                    threshold is not None
+                    and state.opened_at is None
+                    and state.consecutive_failures >= threshold
+                ):
+                    state.opened_at = time.monotonic()
+                    state.stats.circuit_opened += 1
+                    print(
+                        f"   ⚠️  {name} keeps failing, pausing requests for "
+                        f"{self.reset_timeout:.0f}s"
+                    )
+            state.condition.notify_all()
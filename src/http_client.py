@@ -0,0 +1,26 @@
+"""HTTP clients sharing one TLS configuration."""
+
+import ssl
+from functools import cache
+
+import httpx
+
+
+@cache
+def shared_ssl_context() -> ssl.SSLContext:
+    """TLS context with the CA bundle loaded, created once per process.
+
+    Loading the certificates is the slowest part of creating an
+    ``httpx.Client``, so every client of a run verifies with this context.
+    """
+    return httpx.create_ssl_context()
+
+
+def create_client(transport: httpx.BaseTransport | None = None, **kwargs: object) -> httpx.Client:
+    """Create an ``httpx.Client`` that reuses the shared TLS context.
+
+    With a ``transport`` (a mock for benchmarks) no TLS context is needed.
+    """
+    if transport is None:
+        kwargs.setdefault("verify", shared_ssl_context())
+    return httpx.Client(transport=transport, **kwargs)  # type: ignore[arg-type]
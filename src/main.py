@@ -1,171 +1,528 @@
 """Main entry point for PChome tracking list price follower."""
 
+import argparse
+import contextlib
+import os
 import sys
+import tempfile
+import time
+from contextlib import ExitStack
 from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING
 
+import httpx
+
+from alerts import RULE_KINDS
 from api import PChomeAPI, PChomeAPIError
-from config import Config
+from config import Account, Config
 from db import PriceDatabase
-from slack_notifier import SlackNotifier
-from telegram_notifier import TelegramNotifier
+from dispatcher import NotificationDispatcher, Notifier
+from metrics import Metrics
+from pipeline import PipelineResult, StreamingPipeline
+from tracker import AccountClient, deliver_notifications, open_account_clients
+
+if TYPE_CHECKING:
+    from profiling import StageProfiler
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="PChome tracking list price follower")
+    parser.add_argument(
+        "--rebuild-stats",
+        action="store_true",
+        help="rebuild the per-product price summary from price history and exit",
+    )
+    parser.add_argument(
+        "--collapse-history",
+        action="store_true",
+        help="collapse repeated prices in price history into change-only rows and exit",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="downsample old price history into daily/weekly rollups and exit",
+    )
+    parser.add_argument(
+        "--deliver-only",
+        action="store_true",
+        help="deliver pending notifications from the outbox without fetching prices",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep running and poll each product on an adaptive schedule",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="profile CPU time and memory of each stage and write reports next to the database",
+    )
+    parser.add_argument(
+        "--replay",
+        nargs="+",
+        type=Path,
+        metavar="RECORDING",
+        help="run recorded PChome responses (files or directories) through the pipeline "
+        "offline, without sending alerts, and exit",
+    )
+    parser.add_argument(
+        "--replay-db",
+        type=Path,
+        help="database to replay into (default: a temporary scratch database)",
+    )
+    rules = parser.add_argument_group("alert rules")
+    rules.add_argument(
+        "--list-rules", action="store_true", help="list the stored alert rules and exit"
+    )
+    rules.add_argument(
+        "--add-rule",
+        choices=RULE_KINDS,
+        metavar="KIND",
+        help=f"store an alert rule and exit; KIND is one of {', '.join(RULE_KINDS)}",
+    )
+    rules.add_argument(
+        "--product", help="product ID the added rule applies to (default: every product)"
+    )
+    rules.add_argument(
+        "--threshold",
+        type=int,
+        help="target price for target_price, or percentage below the average for percent_drop",
+    )
+    rules.add_argument(
+        "--days", type=int, help="days of history for percent_drop and window_low rules"
+    )
+    rules.add_argument(
+        "--disable",
+        action="store_true",
+        help="add the rule disabled, switching the global rules of its kind off for --product",
+    )
+    rules.add_argument(
+        "--remove-rule", type=int, metavar="ID", help="delete an alert rule and exit"
+    )
+    return parser.parse_args(argv)
+
+
+def rebuild_stats(config: Config) -> int:
+    """Rebuild the per-product price summary from price history."""
+    print(f"💾 Database: {config.db_path}")
+    with PriceDatabase(config.db_path, history_mode=config.history_mode) as db:
+        count = db.rebuild_product_stats()
+    print(f"✅ Rebuilt price summary for {count} products")
+    return 0
+
+
+def collapse_history(config: Config) -> int:
+    """Collapse an existing price history into change-only rows."""
+    print(f"💾 Database: {config.db_path}")
+    size_before = config.db_path.stat().st_size if config.db_path.exists() else 0
+    with PriceDatabase(config.db_path, history_mode=config.history_mode) as db:
+        removed = db.collapse_price_history()
+        db.vacuum()
+    size_after = config.db_path.stat().st_size
+    print(f"✅ Removed {removed} repeated price rows")
+    print(f"   Database size: {size_before:,} → {size_after:,} bytes")
+    return 0
+
+
+def compact_history(db: PriceDatabase, config: Config) -> None:
+    """Downsample old price history and reclaim the freed space."""
+    print("🗜️  Compacting price history...")
+    result = db.compact_price_history(
+        full_resolution_days=config.history_full_resolution_days,
+        daily_resolution_days=config.history_daily_resolution_days,
+    )
+    db.vacuum(config.history_vacuum)
+    print(
+        f"   Downsampled {result.history_rows_removed} history rows and "
+        f"{result.daily_rows_removed} daily rollups in {result.batches} batches\n"
+    )
+
+
+def manage_rules(config: Config, args: argparse.Namespace) -> int:
+    """Add or remove an alert rule, then list the stored rules."""
+    print(f"💾 Database: {config.db_path}")
+    with PriceDatabase(config.db_path, history_mode=config.history_mode) as db:
+        if args.add_rule:
+            try:
+                rule_id = db.add_alert_rule(
+                    args.add_rule,
+                    product_id=args.product,
+                    threshold=args.threshold,
+                    window_days=args.days,
+                    enabled=not args.disable,
+                )
+            except ValueError as e:
+                print(f"❌ {e}")
+                return 1
+            print(f"✅ Added alert rule {rule_id}")
+        if args.remove_rule is not None:
+            if not db.remove_alert_rule(args.remove_rule):
+                print(f"❌ No alert rule {args.remove_rule}")
+                return 1
+            print(f"✅ Removed alert rule {args.remove_rule}")
+
+        print("\n🎯 Alert rules:")
+        for rule in db.get_alert_rules():
+            details = [rule.product_id or "all products"]
+            if rule.threshold is not None:
+                details.append(f"threshold {rule.threshold}")
+            if rule.window_days is not None:
+                details.append(f"{rule.window_days} days")
+            if not rule.enabled:
+                details.append("disabled")
+            print(f"   {rule.id:>4}  {rule.kind:<13} {', '.join(details)}")
+    return 0
+
+
+def create_profiler(config: Config) -> "StageProfiler":
+    """Create a profiler writing its reports next to the database."""
+    from profiling import StageProfiler
+
+    profile_dir = config.db_path.parent / f"profile-{datetime.now():%Y%m%d-%H%M%S}"
+    print(f"🔬 Profiling enabled, reports in {profile_dir}\n")
+    return StageProfiler(profile_dir)
+
+
+def replay_recordings(
+    config: Config, paths: list[Path], db_path: Path | None, profile: bool = False
+) -> int:
+    """Run recorded runs through the pipeline in order against a scratch database.
+
+    Nothing is sent: alerts are only counted. Prices are timestamped with
+    the time of their recorded run, so the history looks as if the runs had
+    happened live.
+    """
+    from governor import RequestGovernor
+    from recording import Recording, ReplayTransport, find_recordings
+
+    recordings = find_recordings(paths)
+    if not recordings:
+        print("❌ No recordings found")
+        return 1
+
+    profiler = create_profiler(config) if profile else None
+    metrics = Metrics(profiler=profiler)
+    totals = {"products": 0, "prices": 0, "new_lows": 0}
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        if db_path is None:
+            db_path = Path(stack.enter_context(tempfile.TemporaryDirectory())) / "replay.db"
+        print(f"⏪ Replaying {len(recordings)} recorded runs into {db_path}\n")
+        db = stack.enter_context(PriceDatabase(db_path, history_mode=config.history_mode))
+        dispatcher = stack.enter_context(NotificationDispatcher([]))
+        devnull = stack.enter_context(open(os.devnull, "w", encoding="utf-8"))
+
+        for path in recordings:
+            recording = Recording.load(path)
+            with ExitStack() as run_stack:
+                clients = [
+                    AccountClient(
+                        Account(index, "", None, None, None),
+                        run_stack.enter_context(
+                            PChomeAPI(
+                                "",
+                                price_chunk_size=config.price_chunk_size,
+                                max_concurrency=config.max_concurrency,
+                                transport=ReplayTransport(recording, index),
+                                # A response missing from a recording stays missing
+                                governor=RequestGovernor(
+                                    config.max_concurrency,
+                                    max_attempts=1,
+                                    failure_threshold=None,
+                                ),
+                            )
+                        ),
+                        [],
+                    )
+                    for index in recording.accounts
+                ]
+                if not clients:
+                    print(f"   ⚠️  {path.name}: no tracking list recorded, skipped")
+                    continue
+                pipeline = StreamingPipeline(
+                    db,
+                    clients,
+                    dispatcher,
+                    metrics,
+                    write_batch_size=config.write_batch_size,
+                    observed_at=recording.recorded_at,
+                )
+                # The per-product output would dominate a replay of many runs
+                with contextlib.redirect_stdout(devnull):
+                    result = pipeline.run()
+            print(
+                f"   {recording.recorded_at}  {result.tracked:>6} products  "
+                f"{result.prices:>6} prices  {result.new_lows:>4} new lows"
+            )
+            totals["products"] += result.tracked
+            totals["prices"] += result.prices
+            totals["new_lows"] += result.new_lows
+
+    elapsed = time.perf_counter() - start
+    print(f"\n{'=' * 60}")
+    print(f"📋 Replayed {len(recordings)} runs in {elapsed:.2f}s")
+    print(f"   • Products processed: {totals['products']}")
+    print(f"   • Prices recorded: {totals['prices']}")
+    print(f"   • New historical lows: {totals['new_lows']}")
+    for stage, seconds in metrics.stage_seconds.items():
+        print(f"   • {stage}: {seconds:.3f}s")
+    print(f"{'=' * 60}")
+    if profiler is not None:
+        print(f"🔬 Profile summary: {profiler.write_summary()}")
+    return 0
 
 
-def main() -> int:
+def print_summary(result: PipelineResult, retries: int = 0, rejected: int = 0) -> None:
+    """Print the totals of a run."""
+    print(f"\n{'=' * 60}")
+    print("📋 Summary:")
+    print(f"   • Products tracked: {result.tracked}")
+    print(f"   • New products added: {result.new_products}")
+    if result.revived_products:
+        print(f"   • Products tracked again: {result.revived_products}")
+    print(f"   • Products removed: {result.removed_products}")
+    print(f"   • New historical lows: {result.new_lows}")
+    if retries or rejected:
+        print(f"   • PChome retries: {retries}, failed fast: {rejected}")
+    if result.interrupted:
+        print("   • Tracking list incomplete: PChome failed while it was read")
+    if result.delivery is not None:
+        print(f"   • Alerts sent: {result.delivery.total_sent}")
+        if result.delivery.total_failed:
+            print(f"   • Alerts failed: {result.delivery.total_failed}")
+    print(f"{'=' * 60}")
+
+
+def build_notifiers(config: Config, account: Account) -> list[Notifier]:
+    """Create an account's enabled notification channels and report their status.
+
+    Each notifier module is only imported when its channel is configured.
+    """
+    notifiers: list[Notifier] = []
+    label = "" if account.index == 1 else f" (account {account.index})"
+
+    if account.slack_webhook_url and account.slack_webhook_url.strip():
+        from slack_notifier import SLACK_CHANNEL, SlackNotifier
+
+        notifiers.append(
+            SlackNotifier(account.slack_webhook_url, name=account.channel_name(SLACK_CHANNEL))
+        )
+        print(f"📢 Slack notifications{label}: Enabled")
+    else:
+        print(f"📢 Slack notifications{label}: Disabled (no webhook URL)")
+
+    if account.telegram_bot_token and account.telegram_chat_id:
+        from telegram_notifier import TELEGRAM_CHANNEL, TelegramNotifier
+
+        notifiers.append(
+            TelegramNotifier(
+                account.telegram_bot_token,
+                account.telegram_chat_id,
+                api_base=config.telegram_api_base,
+                name=account.channel_name(TELEGRAM_CHANNEL),
+            )
+        )
+        print(f"📢 Telegram notifications{label}: Enabled")
+    else:
+        if account.telegram_bot_token or account.telegram_chat_id:
+            suffix = account.env_suffix
+            print(
+                f"⚠️  Warning: Both TELEGRAM_BOT_TOKEN{suffix} and "
+                f"TELEGRAM_CHAT_ID{suffix} must be set"
+            )
+        print(f"📢 Telegram notifications{label}: Disabled")
+
+    return notifiers
+
+
+def export_metrics(metrics: Metrics, config: Config) -> None:
+    """Write the run's metrics to the configured textfile and Pushgateway."""
+    metrics.log(
+        "run",
+        stages={name: round(seconds, 4) for name, seconds in metrics.stage_seconds.items()},
+        success=metrics.succeeded,
+        **{name: value for name, (_, value) in metrics.gauges.items()},
+    )
+    if config.metrics_textfile is not None:
+        try:
+            metrics.write_textfile(config.metrics_textfile)
+        except OSError as e:
+            print(f"⚠️  Failed to write metrics to {config.metrics_textfile}: {e}")
+    if config.metrics_pushgateway_url:
+        try:
+            metrics.push(config.metrics_pushgateway_url)
+        except httpx.HTTPError as e:
+            print(f"⚠️  Failed to push metrics: {e}")
+
+
+def main(argv: list[str] | None = None) -> int:
     """Run the price tracker."""
+    args = parse_args(argv)
+
     print(f"{'=' * 60}")
     print("PChome Tracking List Price Follower")
     print(f"Run time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"{'=' * 60}\n")
 
+    manages_rules = args.list_rules or args.add_rule or args.remove_rule is not None
+
     # Load configuration
     try:
-        config = Config.load()
+        config = Config.load(require_session=not (args.replay or manages_rules))
     except ValueError as e:
         print(f"❌ Configuration error: {e}")
         return 1
 
+    if args.rebuild_stats:
+        return rebuild_stats(config)
+    if args.collapse_history:
+        return collapse_history(config)
+    if manages_rules:
+        return manage_rules(config, args)
+    if args.replay:
+        return replay_recordings(config, args.replay, args.replay_db, profile=args.profile)
+    if args.compact:
+        print(f"💾 Database: {config.db_path}")
+        with PriceDatabase(config.db_path, history_mode=config.history_mode) as db:
+            compact_history(db, config)
+        return 0
+
     # Initialize components
-    slack_notifier = SlackNotifier(config.slack_webhook_url)
+    account_notifiers = {
+        account.index: build_notifiers(config, account) for account in config.accounts
+    }
+    notifiers = [notifier for group in account_notifiers.values() for notifier in group]
+    account_channels = {
+        index: [notifier.name for notifier in group] for index, group in account_notifiers.items()
+    }
 
-    # Initialize Telegram notifier
-    telegram_notifier = None
-    if config.telegram_bot_token and config.telegram_chat_id:
-        telegram_notifier = TelegramNotifier(config.telegram_bot_token, config.telegram_chat_id)
-    elif config.telegram_bot_token or config.telegram_chat_id:
-        print("⚠️  Warning: Both TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID must be set")
+    print(f"💾 Database: {config.db_path}\n")
 
-    if slack_notifier.enabled:
-        print("📢 Slack notifications: Enabled")
-    else:
-        print("📢 Slack notifications: Disabled (no webhook URL)")
+    if args.deliver_only:
+        with (
+            PriceDatabase(config.db_path, history_mode=config.history_mode) as db,
+            NotificationDispatcher(
+                notifiers,
+                channel_concurrency=config.notify_concurrency,
+                digest_threshold=config.digest_threshold,
+            ) as dispatcher,
+        ):
+            deliver_notifications(db, dispatcher)
+        return 0
 
-    if telegram_notifier:
-        print("📢 Telegram notifications: Enabled")
-    else:
-        print("📢 Telegram notifications: Disabled")
+    if args.daemon:
+        from daemon import run_daemon
 
-    print(f"💾 Database: {config.db_path}\n")
+        try:
+            return run_daemon(config, notifiers, account_channels)
+        except PChomeAPIError as e:
+            print(f"\n❌ PChome API error: {e}")
+            return 1
 
-    # Fetch tracking list from PChome
-    print("📥 Fetching tracking list from PChome...")
+    profiler = create_profiler(config) if args.profile else None
+    metrics = Metrics(json_logs=config.metrics_json_logs, profiler=profiler)
+    for notifier in notifiers:
+        client = getattr(notifier, "client", None)
+        if isinstance(client, httpx.Client):
+            metrics.instrument_client(client)
+
+    # Stream the tracking list through prices, analysis and the outbox
+    print("📥 Fetching tracking list and prices from PChome...")
     try:
-        with PChomeAPI(config.pchome_ecwebsess) as api:
-            tracked_products = api.get_tracking_list()
-            print(f"   Found {len(tracked_products)} products in tracking list\n")
+        if config.shard_count > 1:
+            from sharding import run_shard
+
+            merged = run_shard(config, notifiers, account_channels, metrics)
+            if merged is not None:
+                if merged.delivery is not None:
+                    metrics.record_delivery(merged.delivery)
+                if merged.tracked and config.history_compaction:
+                    with (
+                        metrics.stage("compact"),
+                        PriceDatabase(config.db_path, history_mode=config.history_mode) as db,
+                    ):
+                        compact_history(db, config)
+                print_summary(merged)
+                if merged.interrupted:
+                    return 1
+            metrics.succeeded = True
+            return 0
+
+        with (
+            ExitStack() as stack,
+            NotificationDispatcher(
+                notifiers,
+                channel_concurrency=config.notify_concurrency,
+                digest_threshold=config.digest_threshold,
+            ) as dispatcher,
+            PriceDatabase(config.db_path, history_mode=config.history_mode) as db,
+        ):
+            recorder = None
+            if config.recordings_dir is not None:
+                from recording import ResponseRecorder
+
+                recorder = stack.enter_context(ResponseRecorder.in_directory(config.recordings_dir))
+                print(f"   Recording responses to {recorder.path}")
+            clients = open_account_clients(stack, config, account_channels, recorder=recorder)
+            for client in clients:
+                metrics.instrument_client(client.api.client)
+            metrics.instrument_database(db.conn)
 
-            if not tracked_products:
+            pipeline = StreamingPipeline(
+                db, clients, dispatcher, metrics, write_batch_size=config.write_batch_size
+            )
+            result = pipeline.run()
+
+            if len(clients) > 1:
+                for index, size in result.account_sizes.items():
+                    print(f"   Account {index}: {size} products")
+                print(f"   Found {result.tracked} unique products across {len(clients)} accounts")
+            else:
+                print(f"   Found {result.tracked} products in tracking list")
+            print(f"   Retrieved prices for {result.prices} products\n")
+            metrics.set_gauge(
+                "tracked_products", result.tracked, "Unique products in the tracking lists."
+            )
+            metrics.set_gauge("prices_retrieved", result.prices, "Products with a fetched price.")
+            metrics.set_gauge("new_lows", result.new_lows, "Products at a new historical low.")
+            if result.delivery is not None:
+                metrics.record_delivery(result.delivery)
+            governor_stats = clients[0].api.governor.stats().values()
+            retries = sum(stats.retries for stats in governor_stats)
+            rejected = sum(stats.rejected for stats in governor_stats)
+            metrics.set_gauge("pchome_retries", retries, "PChome requests retried.")
+            metrics.set_gauge(
+                "pchome_rejected", rejected, "PChome requests failed fast by an open circuit."
+            )
+
+            if not result.tracked and not result.interrupted:
                 print("⚠️  No products in tracking list. Nothing to do.")
+                metrics.succeeded = True
                 return 0
 
-            # Sync products with database
-            with PriceDatabase(config.db_path) as db:
-                existing_ids = db.get_tracked_product_ids()
-                current_ids = {p.id for p in tracked_products}
-
-                # Add new products
-                new_ids = current_ids - existing_ids
-                for product in tracked_products:
-                    if product.id in new_ids:
-                        db.add_product(product.id, product.name)
-                        print(f"   ➕ Added new product: {product.name[:40]}...")
-
-                # Remove products no longer in tracking list
-                removed_ids = existing_ids - current_ids
-                for product_id in removed_ids:
-                    db.remove_product(product_id)
-                    print(f"   ➖ Removed product: {product_id}")
-
-                if new_ids or removed_ids:
-                    print()
-
-                # Fetch current prices
-                print("💰 Fetching current prices...")
-                product_ids = [p.id for p in tracked_products]
-                prices = api.get_prices(product_ids)
-                print(f"   Retrieved prices for {len(prices)} products\n")
-
-                # Check for price drops and record prices
-                print("📊 Analyzing prices...\n")
-                alerts_sent = 0
-                new_lows = 0
-
-                for product in tracked_products:
-                    price_info = prices.get(product.id)
-                    if not price_info:
-                        print(f"   ⚠️  {product.name[:50]}")
-                        print("       價格: N/A")
-                        print()
-                        continue
-
-                    current_price = price_info.price
-                    historical_low = db.get_historical_low(product.id)
-
-                    # Check if this is a new historical low
-                    is_new_low = historical_low is None or current_price < historical_low
-
-                    # Determine status and icon
-                    if historical_low is None:
-                        icon = "🆕"
-                        status_line = "（首次記錄）"
-                    elif is_new_low:
-                        new_lows += 1
-                        drop = historical_low - current_price
-                        drop_pct = (drop / historical_low) * 100
-                        icon = "🔻"
-                        status_line = (
-                            f"（歷史新低！原低價 NT${historical_low:,}，降 {drop_pct:.1f}%）"
-                        )
-
-                        # Send Slack notification
-                        if slack_notifier.send_price_drop_alert(
-                            product_id=product.id,
-                            product_name=product.name,
-                            current_price=current_price,
-                            historical_low=historical_low,
-                        ):
-                            alerts_sent += 1
-
-                        # Send Telegram notification
-                        if telegram_notifier and telegram_notifier.send_price_drop_alert(
-                            product_id=product.id,
-                            product_name=product.name,
-                            current_price=current_price,
-                            historical_low=historical_low,
-                        ):
-                            alerts_sent += 1
-                    else:
-                        icon = "　"
-                        status_line = f"（歷史低價 NT${historical_low:,}）"
-
-                    # Print product info
-                    if len(product.name) <= 50:
-                        name_display = product.name
-                    else:
-                        name_display = product.name[:47] + "..."
-                    print(f"   {icon} {name_display}")
-                    print(f"       價格: NT${current_price:,} {status_line}")
-                    print()
-
-                    # Record current price
-                    db.record_price(product.id, current_price)
-
-                # Summary
-                print(f"\n{'=' * 60}")
-                print("📋 Summary:")
-                print(f"   • Products tracked: {len(tracked_products)}")
-                print(f"   • New products added: {len(new_ids)}")
-                print(f"   • Products removed: {len(removed_ids)}")
-                print(f"   • New historical lows: {new_lows}")
-                if slack_notifier.enabled or telegram_notifier:
-                    print(f"   • Alerts sent: {alerts_sent}")
-                print(f"{'=' * 60}")
+            if config.history_compaction:
+                with metrics.stage("compact"):
+                    compact_history(db, config)
+
+            print_summary(result, retries, rejected)
+            if result.interrupted:
+                return 1
+            metrics.succeeded = True
 
     except PChomeAPIError as e:
         print(f"\n❌ PChome API error: {e}")
+        metrics.log("error", error=str(e))
         return 1
     except Exception as e:
         print(f"\n❌ Unexpected error: {e}")
+        metrics.log("error", error=str(e))
         raise
+    finally:
+        export_metrics(metrics, config)
+        if profiler is not None:
+            print(f"🔬 Profile summary: {profiler.write_summary()}")
 
     return 0
 
@@ -0,0 +1,237 @@
+"""Run metrics exported in the Prometheus text format."""
+
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import httpx
+
+from api import BUTTON_API_URL, TRACE_LIST_URL
+from dispatcher import DeliveryResults
+from http_client import create_client
+
+if TYPE_CHECKING:
+    from profiling import StageProfiler
+
+# Prefix of every exported metric name
+METRIC_PREFIX = "pchome_tracker"
+
+# Job label used when pushing to a Pushgateway
+PUSHGATEWAY_JOB = "pchome_tracker"
+
+# Endpoint labels for known URLs, matched by prefix
+ENDPOINT_LABELS = (
+    (TRACE_LIST_URL, "trace_list"),
+    (BUTTON_API_URL.split("?", 1)[0], "button"),
+    ("https://hooks.slack.com/", "slack"),
+)
+
+
+def endpoint_label(url: httpx.URL) -> str:
+    """Label a request URL by the endpoint it calls."""
+    text = str(url)
+    for prefix, label in ENDPOINT_LABELS:
+        if text.startswith(prefix):
+            return label
+    if url.path.endswith("/sendMessage"):
+        return "telegram"
+    return url.host
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+class Metrics:
+    """Collects the measurements of one run.
+
+    Stages are timed with ``stage()``. HTTP clients and database connections
+    are measured once passed to ``instrument_client()`` and
+    ``instrument_database()``; statements are attributed to the stage that
+    runs them. With ``json_logs`` every finished stage is also logged to
+    stderr as one JSON object per line, and with a ``profiler`` every stage
+    is profiled as well.
+    """
+
+    def __init__(self, json_logs: bool = False, profiler: "StageProfiler | None" = None) -> None:
+        """Initialize an empty set of measurements."""
+        self.json_logs = json_logs
+        self.profiler = profiler
+        self.started_at = time.time()
+        self.stage_seconds: dict[str, float] = {}
+        # (endpoint, status) -> [request count, total seconds]
+        self.http: dict[tuple[str, str], list[float]] = {}
+        # (stage, statement kind) -> count
+        self.sqlite_statements: dict[tuple[str, str], int] = {}
+        # (channel, outcome) -> count
+        self.alerts: dict[tuple[str, str], int] = {}
+        # name -> (help text, value)
+        self.gauges: dict[str, tuple[str, float]] = {}
+        self.succeeded = False
+        self._current_stage = "other"
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a pipeline stage and attribute database statements to it."""
+        previous, self._current_stage = self._current_stage, name
+        start = time.perf_counter()
+        try:
+            if self.profiler is not None:
+                with self.profiler.stage(name):
+                    yield
+            else:
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._current_stage = previous
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + elapsed
+            self.log("stage", stage=name, seconds=round(elapsed, 4))
+
+    def instrument_client(self, client: httpx.Client) -> None:
+        """Record the count and latency of every request the client sends."""
+        hooks = client.event_hooks
+        client.event_hooks = {
+            "request": [*hooks["request"], self._on_request],
+            "response": [*hooks["response"], self._on_response],
+        }
+
+    def instrument_database(self, conn: sqlite3.Connection) -> None:
+        """Count the statements executed on a connection, by stage and kind."""
+        conn.set_trace_callback(self._on_statement)
+
+    def set_gauge(self, name: str, value: float, help_text: str) -> None:
+        """Set a run-level value such as the number of tracked products."""
+        self.gauges[name] = (help_text, value)
+
+    def record_delivery(self, delivery: DeliveryResults) -> None:
+        """Count the alerts sent and failed per channel."""
+        for outcome, counts in (("sent", delivery.sent), ("failed", delivery.failed)):
+            for channel, count in counts.items():
+                key = (channel, outcome)
+                self.alerts[key] = self.alerts.get(key, 0) + count
+
+    def log(self, event: str, **fields: object) -> None:
+        """Write a structured log line when JSON logging is enabled."""
+        if not self.json_logs:
+            return
+        record = {"ts": datetime.now(UTC).isoformat(), "event": event, **fields}
+        print(json.dumps(record, ensure_ascii=False), file=sys.stderr)
+
+    def _on_request(self, request: httpx.Request) -> None:
+        request.extensions["metrics_start"] = time.perf_counter()
+
+    def _on_response(self, response: httpx.Response) -> None:
+        start = response.request.extensions.get("metrics_start")
+        elapsed = time.perf_counter() - start if start is not None else 0.0
+        key = (endpoint_label(response.request.url), str(response.status_code))
+        with self._lock:
+            entry = self.http.setdefault(key, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def _on_statement(self, statement: str) -> None:
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        key = (self._current_stage, kind)
+        with self._lock:
+            self.sqlite_statements[key] = self.sqlite_statements.get(key, 0) + 1
+
+    def render(self) -> str:
+        """Format the measurements in the Prometheus text exposition format."""
+        lines: list[str] = []
+
+        def family(
+            name: str, kind: str, help_text: str, samples: list[tuple[str, dict, float]]
+        ) -> None:
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{METRIC_PREFIX}_{name}{suffix}{_format_labels(labels)} {value!r}")
+
+        family(
+            "stage_duration_seconds",
+            "gauge",
+            "Wall time of each pipeline stage in the last run.",
+            [("", {"stage": stage}, seconds) for stage, seconds in self.stage_seconds.items()],
+        )
+        family(
+            "http_request_duration_seconds",
+            "summary",
+            "Latency of HTTP requests by endpoint and status.",
+            [
+                sample
+                for (endpoint, status), (count, seconds) in sorted(self.http.items())
+                for sample in (
+                    ("_count", {"endpoint": endpoint, "status": status}, count),
+                    ("_sum", {"endpoint": endpoint, "status": status}, seconds),
+                )
+            ],
+        )
+        family(
+            "sqlite_statements",
+            "gauge",
+            "SQLite statements executed in the last run by stage and kind.",
+            [
+                ("", {"stage": stage, "kind": kind}, count)
+                for (stage, kind), count in sorted(self.sqlite_statements.items())
+            ],
+        )
+        family(
+            "alerts",
+            "gauge",
+            "Alerts delivered in the last run by channel and outcome.",
+            [
+                ("", {"channel": channel, "outcome": outcome}, count)
+                for (channel, outcome), count in sorted(self.alerts.items())
+            ],
+        )
+        for name, (help_text, value) in sorted(self.gauges.items()):
+            family(name, "gauge", help_text, [("", {}, value)])
+        family(
+            "run_success",
+            "gauge",
+            "Whether the last run completed (1) or failed (0).",
+            [("", {}, int(self.succeeded))],
+        )
+        family(
+            "last_run_timestamp_seconds",
+            "gauge",
+            "Unix time the last run started.",
+            [("", {}, self.started_at)],
+        )
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: Path) -> None:
+        """Write the metrics for the node exporter's textfile collector.
+
+        The file is replaced atomically so a scrape never sees partial output.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_text(self.render(), encoding="utf-8")
+        tmp_path.replace(path)
+
+    def push(self, gateway_url: str) -> None:
+        """Replace this job's metrics on a Prometheus Pushgateway."""
+        url = f"{gateway_url.rstrip('/')}/metrics/job/{PUSHGATEWAY_JOB}"
+        with create_client(timeout=10.0) as client:
+            response = client.put(
+                url,
+                content=self.render().encode(),
+                headers={"Content-Type": "text/plain; version=0.0.4"},
+            )
+        response.raise_for_status()
@@ -0,0 +1,90 @@
+"""Delivery stage that drains the notification outbox."""
+
+from db import PriceDatabase
+from dispatcher import DeliveryResults, NotificationDispatcher
+
+# Default number of outbox entries delivered per batch
+DEFAULT_OUTBOX_BATCH_SIZE = 100
+
+# Default number of delivery attempts before an entry is dead-lettered
+DEFAULT_OUTBOX_MAX_ATTEMPTS = 5
+
+
+def submit_outbox(
+    db: PriceDatabase,
+    dispatcher: NotificationDispatcher,
+    after_id: int = 0,
+    batch_size: int = DEFAULT_OUTBOX_BATCH_SIZE,
+) -> int:
+    """Queue every due outbox entry with an ID above ``after_id``.
+
+    The dispatcher sends them on its workers while the caller carries on;
+    ``record_delivered()`` and ``deliver_outbox()`` write back their
+    outcomes. Returns the ID of the last entry queued, or ``after_id``.
+    """
+    while entries := db.get_due_outbox_entries(dispatcher.channels, batch_size, after_id):
+        for entry in entries:
+            dispatcher.submit(entry.alert, channel=entry.channel, key=entry.id)
+        after_id = entries[-1].id
+    return after_id
+
+
+def record_delivered(
+    db: PriceDatabase,
+    dispatcher: NotificationDispatcher,
+    results: DeliveryResults,
+    max_attempts: int = DEFAULT_OUTBOX_MAX_ATTEMPTS,
+) -> None:
+    """Write back the outcomes of the queued entries delivered so far, without waiting.
+
+    Their counts are added to ``results``.
+    """
+    dead_lettered = _record_outcomes(db, dispatcher.collect(), results, max_attempts)
+    _report_dead_letters(dead_lettered, max_attempts)
+
+
+def deliver_outbox(
+    db: PriceDatabase,
+    dispatcher: NotificationDispatcher,
+    batch_size: int = DEFAULT_OUTBOX_BATCH_SIZE,
+    max_attempts: int = DEFAULT_OUTBOX_MAX_ATTEMPTS,
+    results: DeliveryResults | None = None,
+) -> DeliveryResults:
+    """Deliver every due outbox entry for the dispatcher's channels.
+
+    Entries already queued by ``submit_outbox()`` are waited for first, and
+    their counts added to ``results``, which holds those recorded earlier
+    by ``record_delivered()``. The rest are sent in batches; each batch's
+    outcome is written back in one transaction before the next batch is
+    read. Failed entries are scheduled for a later run, so the loop ends
+    once nothing is due.
+    """
+    results = results or DeliveryResults()
+    dead_lettered = _record_outcomes(db, dispatcher.wait(), results, max_attempts)
+    while entries := db.get_due_outbox_entries(dispatcher.channels, batch_size):
+        for entry in entries:
+            dispatcher.submit(entry.alert, channel=entry.channel, key=entry.id)
+        dead_lettered += _record_outcomes(db, dispatcher.wait(), results, max_attempts)
+
+    _report_dead_letters(dead_lettered, max_attempts)
+    db.prune_outbox()
+    return results
+
+
+def _record_outcomes(
+    db: PriceDatabase, batch: DeliveryResults, results: DeliveryResults, max_attempts: int
+) -> int:
+    """Write back a batch of outcomes keyed by entry ID and return the number dead-lettered."""
+    sent_ids = [entry_id for entry_id, ok in batch.outcomes.items() if ok]
+    failed_ids = [entry_id for entry_id, ok in batch.outcomes.items() if not ok]
+    # The outcomes are in the outbox now, so only their counts are kept
+    batch.outcomes.clear()
+    results.merge(batch)
+    if not sent_ids and not failed_ids:
+        return 0
+    return db.complete_outbox_entries(sent_ids, failed_ids, max_attempts)  # type: ignore[arg-type]
+
+
+def _report_dead_letters(dead_lettered: int, max_attempts: int) -> None:
+    if dead_lettered:
+        print(f"   ⚠️  {dead_lettered} alerts moved to dead letter after {max_attempts} attempts")
@@ -0,0 +1,354 @@
+"""Streaming one-shot run from tracking list pages to notification delivery."""
+
+import queue
+import threading
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from dataclasses import dataclass, field
+
+import httpx
+
+from api import ProductPrice, TrackedProduct
+from db import PriceDatabase, ProductSync
+from dispatcher import DeliveryResults, NotificationDispatcher
+from metrics import Metrics
+from outbox import record_delivered, submit_outbox
+from tracker import (
+    AccountClient,
+    AnalysisResult,
+    analyze_prices,
+    deliver_notifications,
+    print_product_sync,
+)
+
+# Default number of products analyzed and written per database transaction
+DEFAULT_WRITE_BATCH_SIZE = 500
+
+# Tracking list pages each account reads ahead of the pipeline
+LIST_PAGES_AHEAD = 2
+
+# An account's next tracking list page, the error that ended its list, or
+# None once it is read to the end
+type ListItem = tuple[AccountClient, list[TrackedProduct] | BaseException | None]
+
+# A streamed product with the channels of every account tracking it, and
+# its price once fetched
+type StreamedProduct = tuple[TrackedProduct, list[str], ProductPrice | None]
+
+
+@dataclass
+class PipelineResult:
+    """Totals of a streaming run."""
+
+    tracked: int = 0
+    prices: int = 0
+    new_products: int = 0
+    revived_products: int = 0
+    removed_products: int = 0
+    new_lows: int = 0
+    delivery: DeliveryResults | None = None
+    # Number of products in each account's list, by account index
+    account_sizes: dict[int, int] = field(default_factory=dict)
+    # Whether PChome failed before every tracking list was read to the end
+    interrupted: bool = False
+
+
+def stage_batch(
+    db: PriceDatabase, metrics: Metrics, result: PipelineResult, products: Sequence[tuple[str, str]]
+) -> None:
+    """Mark a batch of ``(id, name)`` products as seen by the run and count the changes."""
+    with metrics.stage("sync_products"):
+        sync = db.stage_products(products)
+    result.new_products += len(sync.added)
+    result.revived_products += len(sync.revived)
+    print_product_sync(sync, dict(products))
+
+
+def analyze_batch(
+    db: PriceDatabase,
+    metrics: Metrics,
+    result: PipelineResult,
+    products: list[TrackedProduct],
+    prices: dict[str, ProductPrice],
+    observed_at: str | None,
+) -> AnalysisResult:
+    """Evaluate the alert rules on a batch's prices and compare them with its history."""
+    with metrics.stage("analyze"):
+        stats = db.get_product_stats([product.id for product in products])
+        matches = db.evaluate_alert_rules(
+            {product_id: price.price for product_id, price in prices.items()},
+            observed_at=observed_at,
+        )
+        baselines = db.get_products_without_variant_history(
+            [product_id for product_id, price in prices.items() if len(price.variants) > 1]
+        )
+        analysis = analyze_prices(products, prices, stats, matches, variant_baselines=baselines)
+    result.new_lows += analysis.new_lows
+    return analysis
+
+
+def remove_untracked(db: PriceDatabase, metrics: Metrics, result: PipelineResult) -> None:
+    """Soft-delete products that no account tracks any more, unless the lists were incomplete."""
+    # An empty list more likely means a PChome hiccup than an emptied list, and
+    # products after the page PChome failed on were never seen
+    if not result.tracked or result.interrupted:
+        return
+    with metrics.stage("sync_products"):
+        removed = db.finish_product_sync()
+    result.removed_products += len(removed)
+    print_product_sync(ProductSync(removed=removed), {})
+
+
+class StreamingPipeline:
+    """Runs the tracker as a chain of stages connected by generators.
+
+    Tracking list pages feed price chunks, price chunks feed analysis, and
+    every ``write_batch_size`` products are synced, recorded and enqueued in
+    the outbox together. Each stage only pulls from the one before it when
+    it needs more input, and pages and price chunks are fetched at most
+    ``max_concurrency`` ahead, so memory stays bounded by the batch and
+    window sizes rather than the length of the tracking list. The products
+    already written are looked up in the run's staging table, which also
+    finds the removed products, so a product several accounts track is
+    streamed once; an account reaching it after its batch has the alerts
+    copied to its channels in the outbox.
+
+    Without digests, each batch's alerts are handed to the dispatcher's
+    workers as soon as they are enqueued, so the first ones go out while
+    later pages are still being fetched, and the outcomes of those
+    delivered are written back with each batch. With a digest threshold
+    they are delivered once at the end so a digest can cover the whole run.
+    """
+
+    def __init__(
+        self,
+        db: PriceDatabase,
+        clients: list[AccountClient],
+        dispatcher: NotificationDispatcher,
+        metrics: Metrics,
+        write_batch_size: int = DEFAULT_WRITE_BATCH_SIZE,
+        observed_at: str | None = None,
+    ) -> None:
+        """Initialize the pipeline with already-open components.
+
+        ``observed_at`` timestamps the recorded prices, e.g. with the time of
+        a replayed run; by default they are recorded as observed now.
+        """
+        self.db = db
+        self.clients = clients
+        self.dispatcher = dispatcher
+        self.metrics = metrics
+        self.write_batch_size = max(1, write_batch_size)
+        self.observed_at = observed_at
+        self.result = PipelineResult()
+        # Products whose price is being fetched, with their channels
+        self._in_flight: dict[str, tuple[TrackedProduct, list[str]]] = {}
+        self._batch: dict[str, StreamedProduct] = {}
+        # Outbox entries up to this ID were there before the run or handed to
+        # the dispatcher already
+        self._outbox_start = 0
+        self._submitted_through = 0
+        # Outcomes of the alerts delivered while the run streams
+        self._delivered = DeliveryResults()
+
+    def run(self) -> PipelineResult:
+        """Stream every account's tracking list through to the outbox.
+
+        If PChome fails while the lists are paged, or its circuit opens, the
+        products read so far are still priced, recorded and alerted on, and
+        the result is marked ``interrupted``.
+        """
+        self.db.start_product_sync()
+        self._outbox_start = self._submitted_through = self.db.get_last_outbox_id()
+        self._stream()
+        remove_untracked(self.db, self.metrics, self.result)
+
+        with self.metrics.stage("deliver"):
+            self.result.delivery = deliver_notifications(
+                self.db, self.dispatcher, delivered=self._delivered
+            )
+        return self.result
+
+    def _stream(self) -> None:
+        """Fetch the prices of the streamed products and flush them in batches."""
+        # Prices are public, so one account fetches them for all
+        api = self.clients[0].api
+
+        price_results = api.iter_prices(self._product_chunks(api.price_chunk_size))
+        while True:
+            with self.metrics.stage("fetch"):
+                item = next(price_results, None)
+            if item is None:
+                break
+            chunk, prices = item
+            self.result.prices += len(prices)
+            for product_id in chunk:
+                product, channels = self._in_flight.pop(product_id)
+                self._batch[product_id] = (product, channels, prices.get(product_id))
+            if len(self._batch) >= self.write_batch_size:
+                self._flush()
+        self._flush()
+
+    def _owns(self, product_id: str) -> bool:
+        """Whether this run handles the product; a shard only handles its own."""
+        return True
+
+    def _written_products(self, product_ids: list[str]) -> set[str]:
+        """The products among ``product_ids`` already written by this run."""
+        return self.db.get_synced_products(product_ids)
+
+    def _add_late_channels(self, late_channels: dict[str, list[str]]) -> None:
+        """Send the alerts of written products to more accounts' channels too."""
+        self.db.enqueue_late_channels(late_channels, self._outbox_start)
+
+    def _tracked_products(self) -> Iterator[tuple[TrackedProduct, list[str]]]:
+        """Yield each unique tracked product once with its account's channels.
+
+        Every account's list is paged concurrently, like
+        ``fetch_tracking_lists()`` does, and the pages are taken in the order
+        they arrive; each account reads at most ``LIST_PAGES_AHEAD`` pages
+        ahead. If PChome fails one account's list, the other lists are still
+        read to the end before the error is raised.
+        """
+        pages: queue.Queue[ListItem] = queue.Queue(LIST_PAGES_AHEAD * len(self.clients))
+        stop = threading.Event()
+        sizes = dict.fromkeys((client.account.index for client in self.clients), 0)
+        error: httpx.HTTPError | None = None
+        with ThreadPoolExecutor(max_workers=len(self.clients)) as executor:
+            for client in self.clients:
+                executor.submit(_read_tracking_list, client, pages, stop)
+            try:
+                remaining = len(self.clients)
+                while remaining:
+                    client, page = pages.get()
+                    index = client.account.index
+                    if page is None:
+                        remaining -= 1
+                        self.result.account_sizes[index] = sizes[index]
+                    elif isinstance(page, httpx.HTTPError):
+                        remaining -= 1
+                        error = error or page
+                    elif isinstance(page, BaseException):
+                        raise page
+                    else:
+                        sizes[index] += len(page)
+                        yield from self._new_products(page, client.channels)
+            finally:
+                stop.set()
+        if error is not None:
+            raise error
+
+    def _new_products(
+        self, page: list[TrackedProduct], channels: list[str]
+    ) -> Iterator[tuple[TrackedProduct, list[str]]]:
+        """Yield a page's products not streamed yet; add ``channels`` to the others.
+
+        A product streamed before is still being fetched, buffered or
+        already written, which is checked when it is reached, as the
+        products move on while the page is consumed.
+        """
+        page = [product for product in page if self._owns(product.id)]
+        ids = [product.id for product in page]
+        streamed = {pid for pid in ids if pid in self._in_flight or pid in self._batch}
+        streamed |= self._written_products([pid for pid in ids if pid not in streamed])
+        late: dict[str, list[str]] = {}
+        for product in page:
+            if product.id not in streamed:
+                streamed.add(product.id)
+                self.result.tracked += 1
+                yield product, list(channels)
+                continue
+            if product.id in self._in_flight:
+                known = self._in_flight[product.id][1]
+            elif product.id in self._batch:
+                known = self._batch[product.id][1]
+            else:
+                known = late.setdefault(product.id, [])
+            known.extend(channel for channel in channels if channel not in known)
+        if late:
+            self._add_late_channels(late)
+
+    def _product_chunks(self, chunk_size: int) -> Iterator[list[str]]:
+        """Group the streamed products into price request chunks."""
+        chunk: list[str] = []
+        try:
+            for product, channels in self._tracked_products():
+                self._in_flight[product.id] = (product, channels)
+                chunk.append(product.id)
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+        except httpx.HTTPError as e:
+            # End the stream here so the chunks already read are still priced
+            print(f"   ⚠️  Stopped reading the tracking list while PChome was failing: {e}")
+            self.result.interrupted = True
+        if chunk:
+            yield chunk
+
+    def _flush(self) -> None:
+        """Sync, analyze and record the buffered products in one batch."""
+        batch, self._batch = list(self._batch.values()), {}
+        if not batch:
+            return
+        stage_batch(
+            self.db,
+            self.metrics,
+            self.result,
+            [(product.id, product.name) for product, _, _ in batch],
+        )
+        analysis = self._analyze(batch)
+
+        product_channels = {product.id: channels for product, channels, _ in batch}
+        with self.metrics.stage("record_prices"):
+            self.db.record_prices(
+                analysis.observed_prices,
+                analysis.alerts,
+                product_channels=product_channels,
+                observed_at=self.observed_at,
+                variant_prices=analysis.observed_variants,
+            )
+
+        if self.dispatcher.enabled and self.dispatcher.digest_threshold == 0:
+            with self.metrics.stage("submit_alerts"):
+                record_delivered(self.db, self.dispatcher, self._delivered)
+                self._submitted_through = submit_outbox(
+                    self.db, self.dispatcher, self._submitted_through
+                )
+
+    def _analyze(self, batch: list[StreamedProduct]) -> AnalysisResult:
+        """Analyze the prices fetched for a batch of streamed products."""
+        return analyze_batch(
+            self.db,
+            self.metrics,
+            self.result,
+            [product for product, _, _ in batch],
+            {product.id: price for product, _, price in batch if price is not None},
+            self.observed_at,
+        )
+
+
+def _read_tracking_list(
+    client: AccountClient, pages: queue.Queue[ListItem], stop: threading.Event
+) -> None:
+    """Page an account's tracking list into ``pages`` until it ends or ``stop`` is set."""
+    try:
+        with closing(client.api.iter_tracking_list()) as account_pages:
+            for page in account_pages:
+                if not _put(pages, (client, page), stop):
+                    return
+    except BaseException as e:
+        _put(pages, (client, e), stop)
+    else:
+        _put(pages, (client, None), stop)
+
+
+def _put(pages: queue.Queue[ListItem], item: ListItem, stop: threading.Event) -> bool:
+    """Hand an item to the pipeline once it has room, unless it stopped reading."""
+    while not stop.is_set():
+        try:
+            pages.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
@@ -0,0 +1,136 @@
+"""Per-stage CPU and memory profiling for a single run."""
+
+import cProfile
+import io
+import pstats
+import resource
+import time
+import tracemalloc
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+# Default number of functions and allocation sites listed per stage
+DEFAULT_PROFILE_TOP = 25
+
+# Leave the profilers' own allocations out of the reports
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, __file__),
+)
+
+
+@dataclass
+class StageProfile:
+    """Resource use of one profiled stage."""
+
+    name: str
+    seconds: float
+    allocated_bytes: int
+    peak_bytes: int
+    peak_rss_bytes: int
+
+
+def _peak_rss_bytes() -> int:
+    """Peak resident set size of this process so far (ru_maxrss is in KiB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageProfiler:
+    """Profiles pipeline stages with cProfile and tracemalloc.
+
+    Each stage gets a report in ``output_dir`` with its hottest functions by
+    cumulative time and the allocation sites that grew the most, plus the raw
+    ``.pstats`` file for other viewers. A stage entered several times, like
+    the per-batch stages of a streaming run, is profiled as one: its times
+    and allocations add up and its peak is the highest of any entry. Taking
+    a tracemalloc snapshot costs far more than a batch, so allocation sites
+    come from snapshots around each stage's first entry only. Reports and a
+    table of every stage's time and peak memory are written by
+    ``write_summary()``.
+
+    cProfile only sees the thread that runs the stage, so time spent in
+    worker threads shows up as waiting; tracemalloc covers every thread.
+    """
+
+    def __init__(self, output_dir: Path, top: int = DEFAULT_PROFILE_TOP) -> None:
+        """Initialize the profiler and start tracing allocations."""
+        self.output_dir = output_dir
+        self.top = top
+        self.stages: dict[str, StageProfile] = {}
+        self._profiles: dict[str, cProfile.Profile] = {}
+        # Stage -> snapshots before and after its first entry
+        self._snapshots: dict[str, tuple[tracemalloc.Snapshot, tracemalloc.Snapshot]] = {}
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Profile the code run inside the block as (part of) one stage."""
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot() if name not in self._snapshots else None
+        current_before = tracemalloc.get_traced_memory()[0]
+        profile = self._profiles.setdefault(name, cProfile.Profile())
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            if before is not None:
+                self._snapshots[name] = (before, tracemalloc.take_snapshot())
+
+            result = self.stages.setdefault(name, StageProfile(name, 0.0, 0, 0, 0))
+            result.seconds += elapsed
+            result.allocated_bytes += current - current_before
+            result.peak_bytes = max(result.peak_bytes, peak)
+            result.peak_rss_bytes = _peak_rss_bytes()
+
+    def _write_stage_report(self, number: int, result: StageProfile) -> None:
+        """Write one stage's hot functions and allocation sites."""
+        prefix = f"{number:02d}-{result.name}"
+        profile = self._profiles[result.name]
+        profile.dump_stats(self.output_dir / f"{prefix}.pstats")
+
+        hot = io.StringIO()
+        pstats.Stats(profile, stream=hot).sort_stats("cumulative").print_stats(self.top)
+
+        before, after = (
+            snapshot.filter_traces(_SNAPSHOT_FILTERS) for snapshot in self._snapshots[result.name]
+        )
+        allocations = [stat for stat in after.compare_to(before, "lineno") if stat.size_diff]
+        lines = [
+            f"Stage: {result.name}",
+            f"Wall time: {result.seconds:.3f}s",
+            f"Python memory: {result.allocated_bytes / 1024:+,.1f} KiB retained, "
+            f"{result.peak_bytes / 1024:,.1f} KiB peak",
+            f"Process peak RSS so far: {result.peak_rss_bytes / 1024 / 1024:,.1f} MiB",
+            "",
+            f"Top {self.top} allocation sites by growth over the first entry:",
+        ]
+        lines.extend(
+            f"  {stat.traceback}: {stat.size_diff / 1024:+,.1f} KiB"
+            for stat in allocations[: self.top]
+        )
+        lines.extend(["", f"Top {self.top} functions by cumulative time:", hot.getvalue()])
+        (self.output_dir / f"{prefix}.txt").write_text("\n".join(lines), encoding="utf-8")
+
+    def write_summary(self) -> Path:
+        """Write the stage reports and summary table, stop tracing and return its path."""
+        lines = [
+            f"{'stage':<16} {'seconds':>9} {'retained KiB':>13} {'peak KiB':>10} {'RSS MiB':>8}"
+        ]
+        for number, stage in enumerate(self.stages.values(), start=1):
+            self._write_stage_report(number, stage)
+            lines.append(
+                f"{stage.name:<16} {stage.seconds:>9.3f} {stage.allocated_bytes / 1024:>13,.1f} "
+                f"{stage.peak_bytes / 1024:>10,.1f} {stage.peak_rss_bytes / 1024 / 1024:>8.1f}"
+            )
+        path = self.output_dir / "summary.txt"
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        tracemalloc.stop()
+        return path
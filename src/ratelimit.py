@@ -0,0 +1,127 @@
+"""Client-side rate limiting and retry helpers for outbound HTTP calls."""
+
+import random
+import threading
+import time
+from collections.abc import Callable, Sequence
+
+import httpx
+
+# Default number of delivery attempts per message
+DEFAULT_MAX_ATTEMPTS = 4
+
+# Exponential backoff bounds in seconds
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+
+# Longest server-requested wait we are willing to honour, in seconds
+MAX_RETRY_AFTER = 120.0
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at a fixed rate.
+
+    ``rate`` is the sustained number of tokens per second and ``capacity``
+    the largest burst allowed after an idle period.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0) -> None:
+        """Initialize a full bucket."""
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a token is available, then take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Drain the bucket so the next token becomes available in ``seconds``."""
+        with self._lock:
+            self._tokens = min(self._tokens, 1.0 - seconds * self.rate)
+            self._updated = time.monotonic()
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    """Return a full-jitter exponential backoff delay for a 0-based attempt."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def get_retry_after(response: httpx.Response) -> float | None:
+    """Extract the server-requested wait from a rate-limited response.
+
+    Slack sends a ``Retry-After`` header; Telegram reports
+    ``parameters.retry_after`` in the JSON body.
+    """
+    header = response.headers.get("Retry-After")
+    if header is not None:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+
+    try:
+        data = response.json()
+    except ValueError:
+        return None
+    if isinstance(data, dict):
+        retry_after = (data.get("parameters") or {}).get("retry_after")
+        if isinstance(retry_after, int | float):
+            return float(retry_after)
+    return None
+
+
+def send_with_retry(
+    send: Callable[[], httpx.Response],
+    limiters: Sequence[TokenBucket] = (),
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    channel: str = "HTTP",
+) -> httpx.Response | None:
+    """Send a request under rate limits, retrying throttled and failed attempts.
+
+    429 responses wait for the server's ``Retry-After`` (plus jitter) and
+    pause the limiters so concurrent senders back off too. 5xx responses and
+    transport errors retry with jittered exponential backoff. Returns the
+    final response, or None if no response was received.
+    """
+    response: httpx.Response | None = None
+    for attempt in range(max_attempts):
+        for limiter in limiters:
+            limiter.acquire()
+
+        try:
+            response = send()
+        except httpx.RequestError as e:
+            print(f"Failed to send {channel} notification: {e}")
+            response = None
+            delay = backoff_delay(attempt)
+        else:
+            if response.status_code == 429:
+                retry_after = get_retry_after(response)
+                if retry_after is None:
+                    delay = backoff_delay(attempt)
+                else:
+                    delay = min(retry_after, MAX_RETRY_AFTER) + random.uniform(0, BACKOFF_BASE)
+                for limiter in limiters:
+                    limiter.pause(delay)
+                print(f"{channel} rate limited, retrying in {delay:.1f}s")
+            elif response.status_code >= 500:
+                delay = backoff_delay(attempt)
+            else:
+                return response
+
+        if attempt + 1 < max_attempts:
+            time.sleep(delay)
+
+    return response
@@ -0,0 +1,163 @@
+"""Recording of PChome API responses and their offline replay.
+
+A recording holds the tracking list pages and button API responses of one
+run as a gzip-compressed JSON Lines file: a header line with the time of
+the run, then one line per successful response. Cookies and other request
+headers are never written.
+
+``ReplayTransport`` serves a recording back to ``PChomeAPI`` without any
+network access. Button API responses are indexed by product, so a replay
+may use a different price chunk size than the recorded run.
+"""
+
+import gzip
+import json
+import threading
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from pathlib import Path
+
+import httpx
+
+from api import BUTTON_API_URL, TRACE_LIST_URL
+
+# File name suffix of recordings
+RECORDING_SUFFIX = ".jsonl.gz"
+
+
+def _button_item_ids(url: str) -> list[str]:
+    """Item IDs (``<product>-<variant>``) requested from the button API."""
+    if "&id=" not in url:
+        return []
+    return url.split("&id=", 1)[1].split("&", 1)[0].split(",")
+
+
+class ResponseRecorder:
+    """Writes the PChome responses of one run to a recording.
+
+    Responses are appended to a temporary file that replaces ``path`` when
+    the recorder exits without an exception, so an aborted run never leaves
+    a partial recording behind.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """Initialize the recorder and write the recording's header."""
+        self.path = path
+        self.tmp_path = path.with_name(path.name + ".tmp")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = gzip.open(self.tmp_path, "wt", encoding="utf-8")
+        self._lock = threading.Lock()
+        recorded_at = datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S")
+        self._file.write(json.dumps({"recorded_at": recorded_at}) + "\n")
+
+    @classmethod
+    def in_directory(cls, directory: Path) -> "ResponseRecorder":
+        """Start a recording named after the current time in ``directory``."""
+        return cls(directory / f"{datetime.now():%Y%m%d-%H%M%S}{RECORDING_SUFFIX}")
+
+    def __enter__(self) -> "ResponseRecorder":
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, *args: object) -> None:
+        self._file.close()
+        if exc_type is None:
+            self.tmp_path.replace(self.path)
+        else:
+            self.tmp_path.unlink(missing_ok=True)
+
+    def attach(self, client: httpx.Client, account: int) -> None:
+        """Record every successful response ``client`` receives for ``account``."""
+
+        def record(response: httpx.Response) -> None:
+            if response.status_code != 200:
+                return
+            response.read()
+            line = json.dumps(
+                {"account": account, "url": str(response.request.url), "body": response.text},
+                ensure_ascii=False,
+            )
+            with self._lock:
+                self._file.write(line + "\n")
+
+        client.event_hooks["response"].append(record)
+
+
+@dataclass
+class Recording:
+    """The responses of one recorded run, indexed for replay."""
+
+    path: Path
+    # UTC time of the run, in SQLite's CURRENT_TIMESTAMP format
+    recorded_at: str
+    # (account, page) -> raw tracking list page
+    tracking_pages: dict[tuple[int, int], str] = field(default_factory=dict)
+    # Product ID -> button API items of the product and its variants
+    items: dict[str, list[dict]] = field(default_factory=dict)
+
+    @property
+    def accounts(self) -> list[int]:
+        """Indexes of the accounts whose tracking list was recorded."""
+        return sorted({account for account, _ in self.tracking_pages})
+
+    @classmethod
+    def load(cls, path: Path) -> "Recording":
+        """Read a recording file."""
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            recording = cls(path, json.loads(file.readline())["recorded_at"])
+            for line in file:
+                entry = json.loads(line)
+                url = httpx.URL(entry["url"])
+                if entry["url"].startswith(TRACE_LIST_URL):
+                    page = int(url.params.get("page", 1))
+                    recording.tracking_pages[(entry["account"], page)] = entry["body"]
+                elif entry["url"].startswith(BUTTON_API_URL):
+                    for item in json.loads(entry["body"]):
+                        product_id = item.get("Id", "").rsplit("-", 1)[0]
+                        variants = recording.items.setdefault(product_id, [])
+                        if item not in variants:
+                            variants.append(item)
+        return recording
+
+
+def find_recordings(paths: list[Path]) -> list[Path]:
+    """Expand files and directories into recording files in chronological order.
+
+    Recordings are named after the time of their run, so name order is
+    chronological. Paths that don't exist are ignored.
+    """
+    found: list[Path] = []
+    for path in paths:
+        if path.is_dir():
+            found.extend(path.glob(f"*{RECORDING_SUFFIX}"))
+        elif path.exists():
+            found.append(path)
+    return sorted(set(found), key=lambda p: p.name)
+
+
+class ReplayTransport(httpx.BaseTransport):
+    """Answers one account's PChome requests from a recording.
+
+    Requests the recording has no answer for fail like an unreachable
+    server, so they are handled the same way as during a live run.
+    """
+
+    def __init__(self, recording: Recording, account: int) -> None:
+        """Initialize the transport for ``account``'s side of ``recording``."""
+        self.recording = recording
+        self.account = account
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        if url.startswith(TRACE_LIST_URL):
+            page = int(request.url.params.get("page", 1))
+            body = self.recording.tracking_pages.get((self.account, page))
+            if body is not None:
+                return httpx.Response(200, content=body.encode(), request=request)
+        elif url.startswith(BUTTON_API_URL):
+            items = [
+                item
+                for item_id in _button_item_ids(url)
+                for item in self.recording.items.get(item_id.rsplit("-", 1)[0], [])
+            ]
+            return httpx.Response(200, json=items, request=request)
+        raise httpx.ConnectError(f"{url} is not in {self.recording.path.name}", request=request)
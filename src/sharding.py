@@ -0,0 +1,475 @@
+"""Horizontal sharding of a run across parallel processes or Kubernetes Job pods.
+
+With ``SHARD_COUNT`` above 1, each process handles the products whose ID
+hashes to its ``SHARD_INDEX`` (``JOB_COMPLETION_INDEX`` in an Indexed Job).
+It streams every account's tracking list like a normal run, but fetches and
+analyzes only its own products and writes them to a shard file in
+``db/shards`` instead of ``prices.db``. No shard writes to ``prices.db``, so
+they all analyze against its history as it was before the run.
+
+The shard that completes last merges every shard file of the run into
+``prices.db`` with the usual batched writes and delivers the alerts. Shard
+files are renamed into place only when complete and are named after the
+run's ``SHARD_RUN_ID``, so a merge never picks up a partial file or one
+left over from an earlier run, and only removes its own run's files.
+"""
+
+import fcntl
+import hashlib
+import json
+import sqlite3
+from collections.abc import Iterator
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from pathlib import Path
+
+from alerts import PriceDropAlert
+from config import Config
+from db import PriceDatabase
+from dispatcher import NotificationDispatcher, Notifier
+from metrics import Metrics
+from pipeline import PipelineResult, StreamingPipeline, remove_untracked, stage_batch
+from tracker import (
+    AccountClient,
+    deliver_notifications,
+    open_account_clients,
+)
+
+# Schema of a shard file: the shard's header, its products, their alerts and
+# the variant prices of products sold in several
+SHARD_SCHEMA = """
+    CREATE TABLE shard_info (
+        shard_index INTEGER NOT NULL,
+        shard_count INTEGER NOT NULL,
+        run_id TEXT NOT NULL,
+        observed_at TEXT NOT NULL,
+        tracked INTEGER NOT NULL DEFAULT 0,
+        prices INTEGER NOT NULL DEFAULT 0,
+        new_lows INTEGER NOT NULL DEFAULT 0,
+        account_sizes TEXT NOT NULL DEFAULT '{}',
+        interrupted INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE products (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        channels TEXT NOT NULL,
+        price INTEGER
+    );
+    CREATE TABLE alerts (
+        product_id TEXT PRIMARY KEY,
+        product_name TEXT NOT NULL,
+        current_price INTEGER NOT NULL,
+        historical_low INTEGER NOT NULL,
+        rule TEXT NOT NULL,
+        reason TEXT,
+        crossed_from TEXT
+    );
+    CREATE TABLE variants (
+        product_id TEXT NOT NULL,
+        variant_id TEXT NOT NULL,
+        price INTEGER NOT NULL,
+        PRIMARY KEY (product_id, variant_id)
+    );
+"""
+
+
+# A batch of a shard's (id, name, channels, price) products, their alerts
+# and the (product, variant, price) rows of those sold in several variants
+type ShardBatch = tuple[
+    list[tuple[str, str, list[str], int | None]],
+    list[PriceDropAlert],
+    list[tuple[str, str, int]],
+]
+
+
+def shard_of(product_id: str, shard_count: int) -> int:
+    """The shard a product belongs to, the same in every process and run."""
+    digest = hashlib.blake2b(product_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest) % shard_count
+
+
+def shard_path(directory: Path, run_id: str, shard_index: int, shard_count: int) -> Path:
+    """Path of a shard's file in a run."""
+    return directory / f"shard-{run_id}-{shard_index:03d}-of-{shard_count:03d}.db"
+
+
+@contextmanager
+def shard_lock(directory: Path) -> Iterator[None]:
+    """Hold the lock that serializes database migrations and merges between shards."""
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / "shards.lock", "w") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+class ShardWriter:
+    """Writes one shard's products and alerts to its shard file.
+
+    Rows go to a temporary file that replaces ``path`` on ``complete()``;
+    leaving the context without completing removes it.
+    """
+
+    def __init__(
+        self, path: Path, shard_index: int, shard_count: int, run_id: str, observed_at: str
+    ) -> None:
+        """Initialize the writer with an empty shard file."""
+        self.path = path
+        self.tmp_path = path.with_name(path.name + ".tmp")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp_path.unlink(missing_ok=True)
+        self.completed = False
+        self.conn = sqlite3.connect(self.tmp_path)
+        self.conn.executescript(SHARD_SCHEMA)
+        self.conn.execute(
+            """
+            INSERT INTO shard_info (shard_index, shard_count, run_id, observed_at)
+            VALUES (?, ?, ?, ?)
+            """,
+            (shard_index, shard_count, run_id, observed_at),
+        )
+        self.conn.commit()
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        if not self.completed:
+            self.conn.close()
+            self.tmp_path.unlink(missing_ok=True)
+
+    def write(
+        self,
+        products: list[tuple[str, str, list[str], int | None]],
+        alerts: list[PriceDropAlert],
+        variants: list[tuple[str, str, int]],
+    ) -> None:
+        """Add ``(id, name, channels, price)`` rows with their alerts and variants at once."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO products (id, name, channels, price) VALUES (?, ?, ?, ?)",
+            [(pid, name, json.dumps(channels), price) for pid, name, channels, price in products],
+        )
+        self.conn.executemany(
+            """
+            INSERT OR REPLACE INTO alerts
+                (product_id, product_name, current_price, historical_low, rule, reason,
+                 crossed_from)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    alert.product_id,
+                    alert.product_name,
+                    alert.current_price,
+                    alert.historical_low,
+                    alert.rule,
+                    alert.reason,
+                    alert.crossed_from,
+                )
+                for alert in alerts
+            ],
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO variants (product_id, variant_id, price) VALUES (?, ?, ?)",
+            variants,
+        )
+        self.conn.commit()
+
+    def get_products(self, product_ids: list[str]) -> set[str]:
+        """The products among ``product_ids`` already written to the shard file."""
+        rows = self.conn.execute(
+            "SELECT id FROM products WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(product_ids),),
+        )
+        return {product_id for (product_id,) in rows}
+
+    def add_channels(self, extra_channels: dict[str, list[str]]) -> None:
+        """Add the channels of accounts whose list reached a product after its batch."""
+        self.conn.executemany(
+            """
+            UPDATE products SET channels = (
+                SELECT json_group_array(value) FROM (
+                    SELECT value FROM json_each(products.channels)
+                    UNION
+                    SELECT value FROM json_each(?2)
+                )
+            )
+            WHERE id = ?1
+            """,
+            [(pid, json.dumps(channels)) for pid, channels in extra_channels.items()],
+        )
+        self.conn.commit()
+
+    def complete(self, result: PipelineResult) -> None:
+        """Record the shard's totals and move the file into place."""
+        self.conn.execute(
+            """
+            UPDATE shard_info
+            SET tracked = ?, prices = ?, new_lows = ?, account_sizes = ?, interrupted = ?
+            """,
+            (
+                result.tracked,
+                result.prices,
+                result.new_lows,
+                json.dumps(result.account_sizes),
+                result.interrupted,
+            ),
+        )
+        self.conn.commit()
+        self.conn.close()
+        self.tmp_path.replace(self.path)
+        self.completed = True
+
+
+@dataclass
+class ShardFile:
+    """A completed shard file and its totals."""
+
+    path: Path
+    shard_index: int
+    shard_count: int
+    run_id: str
+    # UTC time the shard's prices were observed, in SQLite's format
+    observed_at: str
+    tracked: int
+    prices: int
+    new_lows: int
+    account_sizes: dict[int, int] = field(default_factory=dict)
+    interrupted: bool = False
+
+    @classmethod
+    def load(cls, path: Path) -> "ShardFile":
+        """Read a shard file's header."""
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute("SELECT * FROM shard_info").fetchone()
+        finally:
+            conn.close()
+        return cls(
+            path=path,
+            shard_index=row["shard_index"],
+            shard_count=row["shard_count"],
+            run_id=row["run_id"],
+            observed_at=row["observed_at"],
+            tracked=row["tracked"],
+            prices=row["prices"],
+            new_lows=row["new_lows"],
+            account_sizes={int(k): v for k, v in json.loads(row["account_sizes"]).items()},
+            interrupted=bool(row["interrupted"]),
+        )
+
+    def iter_batches(self, batch_size: int) -> Iterator[ShardBatch]:
+        """Yield the shard's products ``batch_size`` at a time with their alerts and variants."""
+        conn = sqlite3.connect(self.path)
+        try:
+            products = conn.execute("SELECT id, name, channels, price FROM products ORDER BY id")
+            while batch := products.fetchmany(batch_size):
+                product_ids = json.dumps([pid for pid, _, _, _ in batch])
+                alerts = conn.execute(
+                    """
+                    SELECT product_id, product_name, current_price, historical_low, rule, reason,
+                           crossed_from
+                    FROM alerts
+                    WHERE product_id IN (SELECT value FROM json_each(?))
+                    """,
+                    (product_ids,),
+                ).fetchall()
+                variants = conn.execute(
+                    """
+                    SELECT product_id, variant_id, price FROM variants
+                    WHERE product_id IN (SELECT value FROM json_each(?))
+                    """,
+                    (product_ids,),
+                ).fetchall()
+                yield (
+                    [
+                        (pid, name, json.loads(channels), price)
+                        for pid, name, channels, price in batch
+                    ],
+                    [PriceDropAlert(*alert) for alert in alerts],
+                    variants,
+                )
+        finally:
+            conn.close()
+
+
+def find_complete_shards(directory: Path, shard_count: int, run_id: str) -> list[ShardFile] | None:
+    """The completed files of every shard of a run, or None while any is missing."""
+    shards = []
+    for index in range(shard_count):
+        path = shard_path(directory, run_id, index, shard_count)
+        if not path.exists():
+            return None
+        shard = ShardFile.load(path)
+        if shard.run_id != run_id:
+            return None
+        shards.append(shard)
+    return shards
+
+
+class ShardPipeline(StreamingPipeline):
+    """Streams one shard's products through analysis into its shard file.
+
+    ``db`` is only read: product summaries and alert rules come from it,
+    and everything the normal pipeline would write goes to ``writer``.
+    """
+
+    def __init__(
+        self,
+        db: PriceDatabase,
+        writer: ShardWriter,
+        clients: list[AccountClient],
+        dispatcher: NotificationDispatcher,
+        metrics: Metrics,
+        shard_index: int,
+        shard_count: int,
+        write_batch_size: int,
+        observed_at: str,
+    ) -> None:
+        """Initialize the pipeline for one shard of a run."""
+        super().__init__(db, clients, dispatcher, metrics, write_batch_size, observed_at)
+        self.writer = writer
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+
+    def run(self) -> PipelineResult:
+        """Stream the shard's products into the shard file."""
+        self._stream()
+        return self.result
+
+    def _owns(self, product_id: str) -> bool:
+        return shard_of(product_id, self.shard_count) == self.shard_index
+
+    def _written_products(self, product_ids: list[str]) -> set[str]:
+        return self.writer.get_products(product_ids)
+
+    def _add_late_channels(self, late_channels: dict[str, list[str]]) -> None:
+        self.writer.add_channels(late_channels)
+
+    def _flush(self) -> None:
+        """Analyze the buffered products and write them to the shard file."""
+        batch, self._batch = list(self._batch.values()), {}
+        if not batch:
+            return
+        analysis = self._analyze(batch)
+
+        with self.metrics.stage("write_shard"):
+            self.writer.write(
+                [
+                    (product.id, product.name, channels, price.price if price else None)
+                    for product, channels, price in batch
+                ],
+                analysis.alerts,
+                analysis.observed_variants,
+            )
+
+
+def merge_shards(
+    db: PriceDatabase,
+    dispatcher: NotificationDispatcher,
+    metrics: Metrics,
+    shards: list[ShardFile],
+    write_batch_size: int,
+) -> PipelineResult:
+    """Sync, record and enqueue every shard's products, then deliver the alerts."""
+    result = PipelineResult(account_sizes=shards[0].account_sizes)
+    db.start_product_sync()
+    for shard in shards:
+        result.tracked += shard.tracked
+        result.prices += shard.prices
+        result.new_lows += shard.new_lows
+        result.interrupted |= shard.interrupted
+        for products, alerts, variants in shard.iter_batches(write_batch_size):
+            stage_batch(db, metrics, result, [(pid, name) for pid, name, _, _ in products])
+            with metrics.stage("record_prices"):
+                db.record_prices(
+                    [(pid, price) for pid, _, _, price in products if price is not None],
+                    alerts,
+                    product_channels={pid: channels for pid, _, channels, _ in products},
+                    observed_at=shard.observed_at,
+                    variant_prices=variants,
+                )
+    remove_untracked(db, metrics, result)
+
+    with metrics.stage("deliver"):
+        result.delivery = deliver_notifications(db, dispatcher)
+    return result
+
+
+def run_shard(
+    config: Config,
+    notifiers: list[Notifier],
+    account_channels: dict[int, list[str]],
+    metrics: Metrics,
+) -> PipelineResult | None:
+    """Run this process's shard, and merge the run if it is the last shard to complete.
+
+    Returns the merged run's totals, or None while other shards are still
+    running.
+    """
+    index, count = config.shard_index, config.shard_count
+    observed_at = datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"🧩 Shard {index + 1} of {count}")
+
+    with ExitStack() as stack:
+        # The first shard creates or migrates the database while the others wait
+        with shard_lock(config.shard_dir):
+            db = stack.enter_context(
+                PriceDatabase(config.db_path, history_mode=config.history_mode)
+            )
+        metrics.instrument_database(db.conn)
+        clients = open_account_clients(stack, config, account_channels)
+        for client in clients:
+            metrics.instrument_client(client.api.client)
+        writer = stack.enter_context(
+            ShardWriter(
+                shard_path(config.shard_dir, config.shard_run_id, index, count),
+                index,
+                count,
+                config.shard_run_id,
+                observed_at,
+            )
+        )
+        pipeline = ShardPipeline(
+            db,
+            writer,
+            clients,
+            stack.enter_context(NotificationDispatcher([])),
+            metrics,
+            index,
+            count,
+            config.write_batch_size,
+            observed_at,
+        )
+        result = pipeline.run()
+        writer.complete(result)
+    print(
+        f"   Shard {index + 1}: {result.tracked} products, {result.prices} prices, "
+        f"{result.new_lows} new lows\n"
+    )
+
+    with shard_lock(config.shard_dir):
+        shards = find_complete_shards(config.shard_dir, count, config.shard_run_id)
+        if shards is None:
+            print("   Other shards are still running; the last one to finish merges the run")
+            return None
+
+        print(f"🔀 Merging {count} shards into {config.db_path}")
+        with (
+            PriceDatabase(config.db_path, history_mode=config.history_mode) as db,
+            NotificationDispatcher(
+                notifiers,
+                channel_concurrency=config.notify_concurrency,
+                digest_threshold=config.digest_threshold,
+            ) as dispatcher,
+        ):
+            metrics.instrument_database(db.conn)
+            merged = merge_shards(db, dispatcher, metrics, shards, config.write_batch_size)
+        # Other runs' files may still be written, so only this run's go
+        for shard in shards:
+            shard.path.unlink()
+    return merged
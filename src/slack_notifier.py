@@ -2,14 +2,114 @@
 
 import httpx
 
+from alerts import PriceDropAlert
+from http_client import create_client
+from ratelimit import DEFAULT_MAX_ATTEMPTS, TokenBucket, send_with_retry
+
+# Outbox channel name of the primary account's Slack destination
+SLACK_CHANNEL = "slack"
+
+# Incoming webhooks allow about one message per second
+SLACK_WEBHOOK_RATE = 1.0
+
+# Block Kit allows at most 50 blocks per message
+SLACK_MAX_BLOCKS = 50
+
+# Longest product name shown in a digest entry
+DIGEST_NAME_LIMIT = 200
+
+
+def _escape_mrkdwn(text: str) -> str:
+    """Escape the control characters of Slack mrkdwn text."""
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def build_digest_messages(alerts: list[PriceDropAlert]) -> list[tuple[dict, int]]:
+    """Pack price drop alerts into as few Block Kit messages as possible.
+
+    Each message has a header block followed by one section per alert.
+    Returns ``(message, alert_count)`` pairs.
+    """
+    title = "價格新低通知" if all(alert.reason is None for alert in alerts) else "價格通知"
+    per_message = SLACK_MAX_BLOCKS - 1
+    chunks = [alerts[i : i + per_message] for i in range(0, len(alerts), per_message)]
+
+    messages = []
+    for index, chunk in enumerate(chunks, start=1):
+        page = f" ({index}/{len(chunks)})" if len(chunks) > 1 else ""
+        blocks: list[dict] = [
+            {
+                "type": "header",
+                "text": {
+                    "type": "plain_text",
+                    "text": f"🔔 PChome {title}：{len(alerts)} 項{page}",
+                    "emoji": True,
+                },
+            }
+        ]
+        for alert in chunk:
+            price_drop = alert.historical_low - alert.current_price
+            drop_percent = (
+                (price_drop / alert.historical_low) * 100 if alert.historical_low > 0 else 0
+            )
+            name = alert.product_name
+            if len(name) > DIGEST_NAME_LIMIT:
+                name = name[: DIGEST_NAME_LIMIT - 1] + "…"
+            if alert.reason is None:
+                detail = (
+                    f"歷史最低 NT$ {alert.historical_low:,}，-{price_drop:,} / {drop_percent:.1f}%"
+                )
+            else:
+                detail = _escape_mrkdwn(alert.reason)
+            blocks.append(
+                {
+                    "type": "section",
+                    "text": {
+                        "type": "mrkdwn",
+                        "text": (
+                            f"*<https://24h.pchome.com.tw/prod/{alert.product_id}"
+                            f"|{_escape_mrkdwn(name)}>*\n"
+                            f"NT$ {alert.current_price:,}（{detail}）"
+                        ),
+                    },
+                }
+            )
+        messages.append(({"blocks": blocks}, len(chunk)))
+    return messages
+
 
 class SlackNotifier:
     """Sends price drop notifications to Slack."""
 
-    def __init__(self, webhook_url: str | None) -> None:
-        """Initialize the notifier with Slack webhook URL."""
+    def __init__(
+        self,
+        webhook_url: str | None,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        name: str = SLACK_CHANNEL,
+        transport: httpx.BaseTransport | None = None,
+    ) -> None:
+        """Initialize the notifier with Slack webhook URL.
+
+        ``name`` is the channel name alerts are queued under in the outbox.
+        ``transport`` replaces the network, e.g. for offline benchmarks.
+        """
+        self.name = name
         self.webhook_url = webhook_url
         self.enabled = webhook_url is not None and webhook_url.strip() != ""
+        self.max_attempts = max_attempts
+        self.rate_limiter = TokenBucket(rate=SLACK_WEBHOOK_RATE)
+        # Persistent client so consecutive alerts reuse one TLS connection
+        self.client = create_client(timeout=10.0, transport=transport)
+
+    def __enter__(self) -> "SlackNotifier":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the underlying HTTP client."""
+        self.client.close()
 
     def send_price_drop_alert(
         self,
@@ -17,9 +117,11 @@ class SlackNotifier:
         product_name: str,
         current_price: int,
         historical_low: int,
+        reason: str | None = None,
     ) -> bool:
         """Send a price drop notification to Slack.
 
+        An alert rule's ``reason`` replaces the drop from the historical low.
         Returns True if notification was sent successfully, False otherwise.
         """
         if not self.enabled:
@@ -29,6 +131,12 @@ class SlackNotifier:
         drop_percent = (price_drop / historical_low) * 100 if historical_low > 0 else 0
 
         product_url = f"https://24h.pchome.com.tw/prod/{product_id}"
+        if reason is None:
+            header = "🔔 PChome 價格新低通知"
+            detail = f"*🔻 降幅*\n-{price_drop:,} ({drop_percent:.1f}%)"
+        else:
+            header = "🔔 PChome 價格通知"
+            detail = f"*🎯 條件*\n{reason}"
 
         message = {
             "blocks": [
@@ -36,7 +144,7 @@ class SlackNotifier:
                     "type": "header",
                     "text": {
                         "type": "plain_text",
-                        "text": "🔔 PChome 價格新低通知",
+                        "text": header,
                         "emoji": True,
                     },
                 },
@@ -57,7 +165,7 @@ class SlackNotifier:
                         },
                         {
                             "type": "mrkdwn",
-                            "text": f"*🔻 降幅*\n-{price_drop:,} ({drop_percent:.1f}%)",
+                            "text": detail,
                         },
                     ],
                 },
@@ -78,13 +186,30 @@ class SlackNotifier:
             ]
         }
 
-        try:
-            response = httpx.post(
+        return self._post(message)
+
+    def send_price_drop_digest(self, alerts: list[PriceDropAlert]) -> list[bool]:
+        """Send many price drops packed into as few messages as possible.
+
+        Returns whether each alert's message was delivered, in input order.
+        """
+        if not self.enabled:
+            return [False] * len(alerts)
+
+        delivered: list[bool] = []
+        for message, count in build_digest_messages(alerts):
+            delivered.extend([self._post(message)] * count)
+        return delivered
+
+    def _post(self, message: dict) -> bool:
+        """Post a Block Kit message to the webhook."""
+        response = send_with_retry(
+            lambda: self.client.post(
                 self.webhook_url,  # type: ignore[arg-type]
                 json=message,
-                timeout=10.0,
-            )
-            return response.status_code == 200
-        except httpx.RequestError as e:
-            print(f"Failed to send Slack notification: {e}")
-            return False
+            ),
+            limiters=[self.rate_limiter],
+            max_attempts=self.max_attempts,
+            channel="Slack",
+        )
+        return response is not None and response.status_code == 200
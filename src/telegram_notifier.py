@@ -1,9 +1,45 @@
 """Telegram notification module for price alerts."""
 
 import re
+import threading
 
 import httpx
 
+from alerts import PriceDropAlert
+from http_client import create_client
+from ratelimit import DEFAULT_MAX_ATTEMPTS, TokenBucket, send_with_retry
+
+TELEGRAM_API_BASE = "https://api.telegram.org"
+
+# Outbox channel name of the primary account's Telegram destination
+TELEGRAM_CHANNEL = "telegram"
+
+# Bot API limits: ~30 messages/second per bot, 1/second per chat, 20/minute per group
+TELEGRAM_BOT_RATE = 30.0
+TELEGRAM_CHAT_RATE = 1.0
+TELEGRAM_GROUP_RATE = 20 / 60
+
+# Maximum message length, counted in UTF-16 code units
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Digest layout: room kept for the header, and the longest product name shown
+DIGEST_HEADER_RESERVE = 64
+DIGEST_NAME_LIMIT = 200
+
+# Per-bot limiters shared by every notifier using the same token
+_bot_limiters: dict[str, TokenBucket] = {}
+_bot_limiters_lock = threading.Lock()
+
+
+def _get_bot_limiter(bot_token: str) -> TokenBucket:
+    """Return the process-wide rate limiter for a bot token."""
+    with _bot_limiters_lock:
+        if bot_token not in _bot_limiters:
+            _bot_limiters[bot_token] = TokenBucket(
+                rate=TELEGRAM_BOT_RATE, capacity=TELEGRAM_BOT_RATE
+            )
+        return _bot_limiters[bot_token]
+
 
 def escape_markdown_v2(text: str) -> str:
     """Escape special characters for Telegram MarkdownV2 format."""
@@ -11,14 +47,98 @@ def escape_markdown_v2(text: str) -> str:
     return re.sub(f"([{re.escape(special_chars)}])", r"\\\1", text)
 
 
+def _message_length(text: str) -> int:
+    """Length of a message as Telegram counts it (UTF-16 code units)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def build_digest_messages(
+    alerts: list[PriceDropAlert], limit: int = TELEGRAM_MESSAGE_LIMIT
+) -> list[tuple[str, int]]:
+    """Pack price drop alerts into as few MarkdownV2 messages as possible.
+
+    Each alert is escaped as a whole entry before packing, and messages are
+    only split between entries, so an escape sequence is never cut in half.
+    Returns ``(text, alert_count)`` pairs.
+    """
+    entries = []
+    for alert in alerts:
+        price_drop = alert.historical_low - alert.current_price
+        drop_percent = (price_drop / alert.historical_low) * 100 if alert.historical_low > 0 else 0
+        product_url = f"https://24h.pchome.com.tw/prod/{alert.product_id}"
+        # Truncate before escaping so an entry always fits in one message
+        name = alert.product_name
+        if len(name) > DIGEST_NAME_LIMIT:
+            name = name[: DIGEST_NAME_LIMIT - 1] + "…"
+        if alert.reason is None:
+            detail = f"(-{price_drop:,}, {drop_percent:.1f}%)"
+        else:
+            detail = f"({alert.reason})"
+        entries.append(
+            f"*{escape_markdown_v2(name)}*\n"
+            f"💰 `NT${alert.current_price:,}` "
+            f"{escape_markdown_v2(detail)} "
+            f"[查看]({product_url})"
+        )
+
+    messages: list[list[str]] = []
+    length = 0
+    for entry in entries:
+        entry_length = _message_length(entry) + 2
+        if not messages or length + entry_length > limit - DIGEST_HEADER_RESERVE:
+            messages.append([])
+            length = 0
+        messages[-1].append(entry)
+        length += entry_length
+
+    total = len(messages)
+    subject = "歷史新低" if all(alert.reason is None for alert in alerts) else "價格通知"
+    result = []
+    for index, chunk in enumerate(messages, start=1):
+        page = escape_markdown_v2(f" ({index}/{total})") if total > 1 else ""
+        header = f"🔔 *價格警報*：{len(alerts)} 項{subject}{page}\n\n"
+        result.append((header + "\n\n".join(chunk), len(chunk)))
+    return result
+
+
 class TelegramNotifier:
     """Sends price drop notifications to Telegram."""
 
-    def __init__(self, bot_token: str, chat_id: str) -> None:
-        """Initialize the notifier with Telegram Bot credentials."""
+    def __init__(
+        self,
+        bot_token: str,
+        chat_id: str,
+        api_base: str | None = None,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        name: str = TELEGRAM_CHANNEL,
+        transport: httpx.BaseTransport | None = None,
+    ) -> None:
+        """Initialize the notifier with Telegram Bot credentials.
+
+        ``api_base`` defaults to the public Bot API at ``TELEGRAM_API_BASE``.
+        ``name`` is the channel name alerts are queued under in the outbox.
+        ``transport`` replaces the network, e.g. for offline benchmarks.
+        """
+        self.name = name
         self.bot_token = bot_token
         self.chat_id = chat_id
-        self.api_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+        self.api_url = f"{(api_base or TELEGRAM_API_BASE).rstrip('/')}/bot{bot_token}/sendMessage"
+        self.max_attempts = max_attempts
+        # Group and channel chat IDs are negative
+        chat_rate = TELEGRAM_GROUP_RATE if chat_id.startswith("-") else TELEGRAM_CHAT_RATE
+        self.rate_limiters = [_get_bot_limiter(bot_token), TokenBucket(rate=chat_rate)]
+        # Persistent client so consecutive alerts reuse one TLS connection
+        self.client = create_client(timeout=10.0, transport=transport)
+
+    def __enter__(self) -> "TelegramNotifier":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the underlying HTTP client."""
+        self.client.close()
 
     def send_price_drop_alert(
         self,
@@ -26,9 +146,11 @@ class TelegramNotifier:
         product_name: str,
         current_price: int,
         historical_low: int,
+        reason: str | None = None,
     ) -> bool:
         """Send a price drop notification to Telegram.
 
+        An alert rule's ``reason`` replaces the drop from the historical low.
         Returns True if notification was sent successfully, False otherwise.
         """
         price_drop = historical_low - current_price
@@ -39,30 +161,50 @@ class TelegramNotifier:
         # Escape product name for MarkdownV2
         escaped_name = escape_markdown_v2(product_name)
 
-        message = (
-            f"🔔 *價格警報*\n\n"
-            f"*{escaped_name}*\n"
-            f"💰 `NT${current_price:,}`（歷史新低！）\n"
-            f"📉 前次低價：NT${historical_low:,}\n"
-            f"🔻 降幅：\\-{price_drop:,} \\({drop_percent:.1f}%\\)\n"
-            f"[查看商品]({product_url})"
-        )
+        if reason is None:
+            detail = (
+                f"💰 `NT${current_price:,}`（歷史新低！）\n"
+                f"📉 前次低價：NT${historical_low:,}\n"
+                f"🔻 降幅：{escape_markdown_v2(f'-{price_drop:,} ({drop_percent:.1f}%)')}\n"
+            )
+        else:
+            detail = (
+                f"💰 `NT${current_price:,}`\n"
+                f"🎯 {escape_markdown_v2(reason)}\n"
+                f"📉 歷史低價：NT${historical_low:,}\n"
+            )
+
+        message = f"🔔 *價格警報*\n\n*{escaped_name}*\n{detail}[查看商品]({product_url})"
+
+        return self._send_message(message)
+
+    def send_price_drop_digest(self, alerts: list[PriceDropAlert]) -> list[bool]:
+        """Send many price drops packed into as few messages as possible.
 
+        Returns whether each alert's message was delivered, in input order.
+        """
+        delivered: list[bool] = []
+        for text, count in build_digest_messages(alerts):
+            delivered.extend([self._send_message(text)] * count)
+        return delivered
+
+    def _send_message(self, text: str) -> bool:
+        """Send a MarkdownV2 message to the configured chat."""
         payload = {
             "chat_id": self.chat_id,
-            "text": message,
+            "text": text,
             "parse_mode": "MarkdownV2",
         }
 
-        try:
-            response = httpx.post(self.api_url, json=payload, timeout=10.0)
-            if response.status_code == 200:
-                return True
-            else:
-                print(
-                    f"Failed to send Telegram notification: {response.status_code} {response.text}"
-                )
-                return False
-        except httpx.RequestError as e:
-            print(f"Failed to send Telegram notification: {e}")
+        response = send_with_retry(
+            lambda: self.client.post(self.api_url, json=payload),
+            limiters=self.rate_limiters,
+            max_attempts=self.max_attempts,
+            channel="Telegram",
+        )
+        if response is None:
             return False
+        if response.status_code == 200:
+            return True
+        print(f"Failed to send Telegram notification: {response.status_code} {response.text}")
+        return False
@@ -0,0 +1,280 @@
+"""Pipeline steps shared by the one-shot run and the daemon."""
+
+from collections.abc import Set
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from alerts import RULE_PERCENT_DROP, RULE_TARGET_PRICE, RULE_WINDOW_LOW, PriceDropAlert
+from api import PChomeAPI, ProductPrice, TrackedProduct, TrackingListCache
+from config import Account, Config
+from db import PriceDatabase, ProductStats, ProductSync, RuleMatch
+from dispatcher import DeliveryResults, NotificationDispatcher
+from governor import RequestGovernor
+from outbox import deliver_outbox
+from ratelimit import TokenBucket
+
+if TYPE_CHECKING:
+    from recording import ResponseRecorder
+
+
+@dataclass
+class AnalysisResult:
+    """Prices to record and alerts to enqueue after analyzing fetched prices."""
+
+    observed_prices: list[tuple[str, int]] = field(default_factory=list)
+    # (product, variant, price) of products sold in several variants
+    observed_variants: list[tuple[str, str, int]] = field(default_factory=list)
+    alerts: list[PriceDropAlert] = field(default_factory=list)
+    new_lows: int = 0
+
+
+@dataclass
+class AccountClient:
+    """An account's API client and the alert channels of its destinations."""
+
+    account: Account
+    api: PChomeAPI
+    channels: list[str]
+
+
+@dataclass
+class MergedTrackingList:
+    """The tracking lists of every account merged into unique products."""
+
+    products: list[TrackedProduct] = field(default_factory=list)
+    # Alert channels of every account tracking each product
+    product_channels: dict[str, list[str]] = field(default_factory=dict)
+    # Number of products in each account's list, by account index
+    account_sizes: dict[int, int] = field(default_factory=dict)
+
+
+def build_tracking_cache(config: Config, account: Account) -> TrackingListCache | None:
+    """Create an account's tracking list cache, or None when caching is disabled."""
+    if config.tracking_cache_path is None or config.tracking_list_ttl_minutes == 0:
+        return None
+    path = config.tracking_cache_path
+    # Shards run at the same time, so each keeps its own copy
+    shard_suffix = f"-shard{config.shard_index}" if config.shard_count > 1 else ""
+    path = path.with_stem(path.stem + account.env_suffix + shard_suffix)
+    return TrackingListCache(path, ttl=config.tracking_list_ttl_minutes * 60)
+
+
+def open_account_clients(
+    stack: ExitStack,
+    config: Config,
+    account_channels: dict[int, list[str]],
+    rate_limiter: TokenBucket | None = None,
+    recorder: "ResponseRecorder | None" = None,
+) -> list[AccountClient]:
+    """Open an API client for every account, closed when ``stack`` exits.
+
+    ``account_channels`` maps each account index to its enabled channels.
+    All clients share ``rate_limiter`` and one request governor, so the
+    request budget and PChome's observed health are global.
+    With a ``recorder``, every response is recorded for replay; the
+    tracking list cache is bypassed so each recording holds every page.
+    """
+    clients: list[AccountClient] = []
+    governor = RequestGovernor(config.max_concurrency, max_attempts=config.max_attempts)
+    for account in config.accounts:
+        api = PChomeAPI(
+            account.ecwebsess,
+            price_chunk_size=config.price_chunk_size,
+            max_concurrency=config.max_concurrency,
+            rate_limiter=rate_limiter,
+            tracking_cache=build_tracking_cache(config, account) if recorder is None else None,
+            session_variable=account.session_variable,
+            governor=governor,
+        )
+        stack.enter_context(api)
+        if recorder is not None:
+            recorder.attach(api.client, account.index)
+        clients.append(AccountClient(account, api, account_channels.get(account.index, [])))
+    return clients
+
+
+def fetch_tracking_lists(clients: list[AccountClient]) -> MergedTrackingList:
+    """Fetch every account's tracking list concurrently and merge them.
+
+    Each product appears once, in the order first seen, so its price is
+    fetched once however many accounts track it. Its alerts go to the
+    channels of every account tracking it.
+    """
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        lists = list(executor.map(lambda client: client.api.get_tracking_list(), clients))
+
+    merged = MergedTrackingList()
+    for client, products in zip(clients, lists, strict=True):
+        merged.account_sizes[client.account.index] = len(products)
+        for product in products:
+            channels = merged.product_channels.get(product.id)
+            if channels is None:
+                merged.products.append(product)
+                channels = merged.product_channels[product.id] = []
+            channels.extend(channel for channel in client.channels if channel not in channels)
+    return merged
+
+
+def print_product_sync(sync: ProductSync, names: dict[str, str]) -> None:
+    """Report the products a sync added, revived and removed."""
+    for product_id in sync.added:
+        print(f"   ➕ Added new product: {names.get(product_id, product_id)[:40]}...")
+    for product_id in sync.revived:
+        print(f"   ♻️  Tracking again: {names.get(product_id, product_id)[:40]}...")
+    for product_id in sync.removed:
+        print(f"   ➖ Removed product: {product_id}")
+
+
+def sync_products(db: PriceDatabase, tracked_products: list[TrackedProduct]) -> ProductSync:
+    """Sync the products table with the tracking list.
+
+    Untracked products are soft-deleted, so their history is still there
+    if they are tracked again. Returns the products added, revived and
+    removed.
+    """
+    sync = db.sync_products([(p.id, p.name) for p in tracked_products])
+    print_product_sync(sync, {p.id: p.name for p in tracked_products})
+    if sync.added or sync.revived or sync.removed:
+        print()
+    return sync
+
+
+def describe_rule_match(match: RuleMatch) -> str | None:
+    """Why a rule other than the historical low fired, for the alert message."""
+    if match.kind == RULE_TARGET_PRICE:
+        return f"達到目標價 NT${match.reference_price:,}"
+    if match.kind == RULE_PERCENT_DROP:
+        drop_pct = (match.reference_price - match.current_price) / match.reference_price * 100
+        return f"較 {match.window_days} 日均價 NT${match.reference_price:,} 降 {drop_pct:.1f}%"
+    if match.kind == RULE_WINDOW_LOW:
+        return f"{match.window_days} 日新低（原低價 NT${match.reference_price:,}）"
+    return None
+
+
+def analyze_prices(
+    tracked_products: list[TrackedProduct],
+    prices: dict[str, ProductPrice],
+    stats: dict[str, ProductStats],
+    matches: dict[str, RuleMatch],
+    verbose: bool = True,
+    variant_baselines: Set[str] = frozenset(),
+) -> AnalysisResult:
+    """Compare fetched prices with each product's historical low.
+
+    A product sold in several variants is compared at its cheapest one, and
+    every variant's price is kept for its own history. Products in
+    ``variant_baselines`` are seen in several variants for the first time,
+    while their history only holds their ``-000`` item's prices, so their
+    other variants are not compared with it: their prices are recorded as
+    a baseline, and only count as a new low and alert when the ``-000``
+    item itself is below the historical low.
+
+    ``matches`` are the alert rules the prices satisfied, from
+    ``PriceDatabase.evaluate_alert_rules``; each one becomes an alert.
+    With ``verbose`` every product is printed; otherwise only new lows and
+    alerts are.
+    """
+    result = AnalysisResult()
+
+    for product in tracked_products:
+        price_info = prices.get(product.id)
+        if not price_info:
+            if verbose:
+                print(f"   ⚠️  {product.name[:50]}")
+                print("       價格: N/A")
+                print()
+            continue
+
+        current_price = price_info.price
+        product_stats = stats.get(product.id)
+        historical_low = product_stats.low_price if product_stats else None
+        match = matches.get(product.id)
+
+        # Check if this is a new historical low
+        is_new_low = historical_low is None or current_price < historical_low
+        is_baseline = historical_low is not None and product.id in variant_baselines
+        if is_baseline:
+            base_price = price_info.base_price
+            is_new_low = base_price is not None and base_price < historical_low
+            is_baseline = not is_new_low
+            if is_baseline:
+                match = None
+
+        # Determine status and icon
+        if historical_low is None:
+            icon = "🆕"
+            status_line = "（首次記錄）"
+        elif is_baseline:
+            icon = "　"
+            status_line = "（首次記錄各規格價格）"
+        elif is_new_low:
+            result.new_lows += 1
+            drop = historical_low - current_price
+            drop_pct = (drop / historical_low) * 100
+            icon = "🔻"
+            status_line = f"（歷史新低！原低價 NT${historical_low:,}，降 {drop_pct:.1f}%）"
+        else:
+            icon = "　"
+            status_line = f"（歷史低價 NT${historical_low:,}）"
+
+        if match is not None:
+            reason = describe_rule_match(match)
+            if reason is not None and icon != "🔻":
+                icon = "🎯"
+                status_line = f"（{reason}）"
+            result.alerts.append(
+                PriceDropAlert(
+                    product_id=product.id,
+                    product_name=product.name,
+                    current_price=current_price,
+                    historical_low=historical_low if historical_low is not None else current_price,
+                    rule=match.kind,
+                    reason=reason,
+                    crossed_from=match.previous_changed_at,
+                )
+            )
+
+        # Print product info
+        if verbose or icon == "🔻" or match is not None:
+            if len(product.name) <= 50:
+                name_display = product.name
+            else:
+                name_display = product.name[:47] + "..."
+            print(f"   {icon} {name_display}")
+            print(f"       價格: NT${current_price:,} {status_line}")
+            if len(price_info.variants) > 1:
+                highest = max(price_info.variants.values())
+                print(f"       規格: {len(price_info.variants)} 款，最高 NT${highest:,}")
+            print()
+
+        result.observed_prices.append((product.id, current_price))
+        if len(price_info.variants) > 1:
+            result.observed_variants.extend(
+                (product.id, variant_id, price) for variant_id, price in price_info.variants.items()
+            )
+
+    return result
+
+
+def deliver_notifications(
+    db: PriceDatabase,
+    dispatcher: NotificationDispatcher,
+    delivered: DeliveryResults | None = None,
+) -> DeliveryResults | None:
+    """Drain the notification outbox and report the outcome.
+
+    ``delivered`` holds the outcomes already recorded by the run, which the
+    report includes.
+    """
+    if not dispatcher.enabled:
+        return None
+
+    print("📤 Delivering notifications...")
+    delivery = deliver_outbox(db, dispatcher, results=delivered)
+    print(f"   Sent {delivery.total_sent} alerts")
+    if delivery.total_failed:
+        print(f"   Failed {delivery.total_failed} alerts (will retry next run)")
+    print()
+    return delivery